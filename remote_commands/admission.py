@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+########################################################################################
+# For any questions or suggestions please contact : Ajmal Yusuf <ayusuf@hortonworks.com>
+########################################################################################
+
+'''
+Admission control of the new ssh connections of a run. sshd drops the connections beyond its MaxStartups
+(10 unauthenticated connections by default) and a bastion or a single host drops them the same way when
+hundreds of handshakes reach it at once. So the new connections are admitted at a rate from a token bucket,
+and only so many handshakes to the same target (the host, or the jump host in front of it) are in flight at
+a time. A connection reset before the banner is retried after a jittered exponential backoff.
+'''
+
+import re
+import time
+import random
+import threading
+
+RETRY_SECS = 0.05      # Wait before trying again when a target has all its handshakes in flight
+MAX_BACKOFF_SECS = 30  # Longest wait before a retry
+
+# What ssh prints when the connection is dropped before the banner
+reset_regex = re.compile(r'(kex_exchange_identification|ssh_exchange_identification|Connection reset by peer|'
+                         r'Connection closed by remote host)')
+
+# -J [user@]host[:port][,...], -o ProxyJump=...
+jump_regex = re.compile(r'(?:^|\s)(?:-J\s*|-o\s*ProxyJump[=\s]\s*)(\S+)', re.IGNORECASE)
+
+def get_jump(options):
+    '''Returns (hostname, port or None) of the first jump host of the options, or None if there is none'''
+    match = jump_regex.search(options or '')
+    if not match or match.group(1).lower() == 'none':
+        return None
+    # [user@]host[:port] or ssh://[user@]host[:port], with an IPv6 host in brackets
+    jump = match.group(1).split(',')[0]
+    if jump.lower().startswith('ssh://'):
+        jump = jump[len('ssh://'):]
+    jump = jump.rsplit('@', 1)[-1]
+    if jump.startswith('['):
+        hostname, port = jump[1:].partition(']')[0], jump.partition(']')[2][1:]
+    else:
+        hostname, port = jump.partition(':')[0], jump.partition(':')[2]
+    return hostname, int(port) if port.isdigit() else None
+
+def get_target(hostname, options):
+    '''Returns the host the ssh connection is made to: the first jump host if there is one, else hostname'''
+    jump = get_jump(options)
+    return jump[0] if jump else hostname
+
+def is_reset(output):
+    '''Returns True if the output of ssh tells that the connection was dropped before the banner'''
+    return bool(output) and reset_regex.search(output) is not None
+
+def get_backoff(attempt, base_secs):
+    '''Returns the wait before retry number attempt (from 0): a random time upto base_secs * 2 ** attempt, so
+    that the connections dropped together do not come back together'''
+    return random.uniform(0, min(MAX_BACKOFF_SECS, base_secs * 2 ** attempt))
+
+class Admission(object):
+    '''Admits rate new connections per second, in bursts of upto burst (0 for no limit), and upto per_target
+    handshakes in flight to the same target (0 for no limit). clock returns the time in seconds'''
+    def __init__(self, rate=0, burst=None, per_target=0, clock=time.time):
+        self.rate = float(rate)
+        self.burst = float(burst or 0) or max(self.rate, 1.0)
+        self.tokens = self.burst
+        self.clock = clock
+        self.updated = clock()
+        self.per_target = int(per_target)
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, target):
+        '''Admits a new connection to target. Returns 0 once it is admitted, else the seconds to wait before
+        trying again'''
+        with self.lock:
+            if self.per_target and self.in_flight.get(target, 0) >= self.per_target:
+                return RETRY_SECS
+            if self.rate:
+                now = self.clock()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens < 1:
+                    return (1 - self.tokens) / self.rate
+                self.tokens -= 1
+            self.in_flight[target] = self.in_flight.get(target, 0) + 1
+            return 0
+
+    def release(self, target):
+        '''Ends the handshake of a connection admitted by acquire()'''
+        with self.lock:
+            count = self.in_flight.get(target, 0) - 1
+            if count > 0:
+                self.in_flight[target] = count
+            else:
+                self.in_flight.pop(target, None)
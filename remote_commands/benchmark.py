@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+########################################################################################
+# For any questions or suggestions please contact : Ajmal Yusuf <ayusuf@hortonworks.com>
+########################################################################################
+
+'''
+Benchmarks remote.execute() end to end on the simulated fleet of fleet_sim.py.
+
+Each scenario is run --repeat times and the best run is kept. The results can be saved as a JSON
+baseline and compared with a later run, which fails (exit status 1) if the hosts/sec of a scenario
+dropped, or its seconds or p95 latency grew, by more than --threshold.
+
+    python benchmark.py --save baseline.json
+    python benchmark.py --baseline baseline.json --threshold 0.2 --engine async
+'''
+
+import sys
+import os
+import json
+import argparse
+
+import fleet_sim
+
+version = '1.0'
+default_root = '/tmp/remote_benchmark'
+
+# name -> (default number of hosts, description)
+scenarios = [
+    ('connect_only', 100, 'Connect to each host without running a command'),
+    ('one_command', 100, 'A ssh action with 1 command'),
+    ('fifty_commands', 20, 'A ssh action with 50 commands'),
+    ('large_output', 1, 'A command printing --large-output-mb MB'),
+    ('scp_send', 20, 'scp a file to each host'),
+    ('scp_get', 20, 'scp a file from each host'),
+    ('dry_run', 100, 'Print the resolved commands of 10 commands, without --live-run')
+]
+scenario_names = [name for name, hosts, description in scenarios]
+
+# Higher is better for hosts_per_sec, lower is better for the rest
+metrics = ['hosts_per_sec', 'seconds', 'p95']
+
+def get_scenario_config(name, hostnames, root, settings, large_output_mb, scp_kb):
+    '''Returns (config, live_run, phase whose p95 is reported) for a scenario'''
+    config = fleet_sim.get_config(hostnames, [], settings)
+    step = config['simulate']
+    if name == 'connect_only':
+        return config, True, 'first_prompt'
+    elif name == 'one_command':
+        step['commands'] = ['echo {hostname}']
+        return config, True, 'command'
+    elif name == 'fifty_commands':
+        step['commands'] = ['echo {0} {{hostname}}'.format(index) for index in range(50)]
+        return config, True, 'command'
+    elif name == 'large_output':
+        config['variables']['timeout_secs'] = '3600'
+        step['commands'] = ['sim_output {0}'.format(large_output_mb * 1024 * 1024)]
+        return config, True, 'command'
+    elif name in ('scp_send', 'scp_get'):
+        payload_dir = os.path.join(root, 'payload')
+        if not os.path.isdir(payload_dir):
+            os.makedirs(payload_dir)
+        with open(os.path.join(payload_dir, 'payload.bin'), 'wb') as payload:
+            payload.write(b'x' * scp_kb * 1024)
+        if name == 'scp_send':
+            config['simulate'] = { 'action' : 'scp', 'direction' : 'send', 'source_dir' : payload_dir,
+                                   'source_file' : 'payload.bin', 'target_dir' : '.' }
+        else:
+            for hostname in hostnames:
+                home = fleet_sim.get_home(root, hostname)
+                with open(os.path.join(home, 'payload.bin'), 'wb') as payload:
+                    payload.write(b'x' * scp_kb * 1024)
+            config['simulate'] = { 'action' : 'scp', 'direction' : 'get', 'source_dir' : '.',
+                                   'source_file' : 'payload.bin', 'target_dir' : os.path.join(root, 'got') }
+            if not os.path.isdir(os.path.join(root, 'got')):
+                os.makedirs(os.path.join(root, 'got'))
+        return config, True, 'scp'
+    elif name == 'dry_run':
+        step['commands'] = ['echo {0} {{hostname}}'.format(index) for index in range(10)]
+        return config, False, 'first_prompt'
+
+def run_scenario(name, count, root, settings, options, repeat, large_output_mb, scp_kb):
+    '''Runs a scenario repeat times and returns the best run: the highest hosts/sec'''
+    hostnames = fleet_sim.get_hostnames(count)
+    config, live_run, phase = get_scenario_config(name, hostnames, root, settings, large_output_mb, scp_kb)
+    timings_file = os.path.join(root, 'timings.json')
+    best = None
+    for attempt in range(repeat):
+        if os.path.exists(timings_file):
+            os.remove(timings_file)
+        result = fleet_sim.measure(root, hostnames, config, dict(options, timings_file=timings_file), live_run)
+        result['p95'] = None
+        if os.path.exists(timings_file):
+            with open(timings_file) as json_file:
+                phases = json.load(json_file)['phases']
+            if phase in phases:
+                result['p95'] = phases[phase]['p95']
+        if best is None or result['hosts_per_sec'] > best['hosts_per_sec']:
+            best = result
+    best['phase'] = phase
+    return best
+
+def get_regressions(results, baseline, threshold):
+    '''Returns a (scenario, metric, baseline value, value) for each metric worse than the baseline by more
+    than the threshold (a fraction)'''
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        for metric in metrics:
+            old, new = baseline[name].get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            if metric == 'hosts_per_sec':
+                worse = new < old * (1 - threshold)
+            else:
+                worse = new > old * (1 + threshold)
+            if worse:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+def change(old, new):
+    if not old or new is None:
+        return ''
+    return '{0:+.0f}%'.format((new - old) * 100.0 / old)
+
+def print_results(results, baseline):
+    row_format = '{0:<16} {1:>6} {2:>9} {3:>8} {4:>10} {5:>8} {6:>10} {7:>8} {8:>10}'
+    print(row_format.format('Scenario', 'Hosts', 'Seconds', '', 'Hosts/sec', '', 'p95', '', 'Memory KB'))
+    for name in scenario_names:
+        if name not in results:
+            continue
+        result, old = results[name], baseline.get(name, {})
+        p95 = '{0:.4f}'.format(result['p95']) if result['p95'] is not None else '-'
+        print(row_format.format(name, result['hosts'], '{0:.2f}'.format(result['seconds']),
+                                change(old.get('seconds'), result['seconds']),
+                                '{0:.1f}'.format(result['hosts_per_sec']),
+                                change(old.get('hosts_per_sec'), result['hosts_per_sec']),
+                                p95, change(old.get('p95'), result['p95']), result['memory_kb']))
+
+def main():
+    description = 'Benchmarks remote.execute() end to end on a simulated fleet (fleet_sim.py) and compares ' \
+                  'the results with a JSON baseline'
+    parser = argparse.ArgumentParser(version='{0} {1}'.format('benchmark.py', version), description=description,
+                                     prog='benchmark.py')
+    parser.add_argument('--root', default=default_root,
+                        help='Directory of the simulated fleet. Default: {0}'.format(default_root))
+    parser.add_argument('-s', '--scenarios', default=','.join(scenario_names),
+                        help='Comma separated scenarios. Default: all of {0}'.format(', '.join(scenario_names)))
+    parser.add_argument('-n', '--hosts', type=int, help='Number of hosts for every scenario but large_output. '
+                        'Default: ' + ', '.join('{0} for {1}'.format(hosts, name) for name, hosts, d in scenarios))
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each scenario, the best is kept. Default: 3')
+    parser.add_argument('--large-output-mb', dest='large_output_mb', type=int, default=100,
+                        help='MB printed by the large_output scenario. Default: 100')
+    parser.add_argument('--scp-kb', dest='scp_kb', type=int, default=1024,
+                        help='KB of the file in the scp scenarios. Default: 1024')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds of a simulated round trip. Default: 0')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Random seconds added to a round trip. Default: 0')
+    parser.add_argument('--parallel', type=int, default=0, help='--parallel of remote.py. Default: 0 (all hosts)')
+    parser.add_argument('--engine', default='async', help='--engine of remote.py. Default: async')
+    parser.add_argument('-o', '--option', dest='options', action='append', default=[],
+                        help='Other run option of remote.py as NAME=VALUE (like batch=true). Can be repeated')
+    parser.add_argument('--save', dest='save_file', help='Write the results as the JSON baseline to this file')
+    parser.add_argument('--baseline', dest='baseline_file', help='Compare the results with this JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed fraction of a drop in hosts/sec or a growth in seconds and p95. Default: 0.2')
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in scenario_names]
+    if unknown:
+        parser.error('Unknown scenario(s): {0}'.format(', '.join(unknown)))
+    options = { 'parallel' : args.parallel, 'engine' : args.engine }
+    for option in args.options:
+        name, value = option.split('=', 1)
+        options[name] = json.loads(value) if value in ('true', 'false') or value.isdigit() else value
+
+    settings = dict(fleet_sim.default_settings, latency=args.latency, jitter=args.jitter)
+    fleet_sim.install(args.root, settings)
+    default_hosts = dict((name, hosts) for name, hosts, description in scenarios)
+    results = {}
+    for name in names:
+        count = args.hosts if args.hosts and name != 'large_output' else default_hosts[name]
+        sys.stdout.write('Running {0} on {1} host(s)...\n'.format(name, count))
+        sys.stdout.flush()
+        results[name] = run_scenario(name, count, args.root, settings, options, args.repeat,
+                                     args.large_output_mb, args.scp_kb)
+
+    baseline = {}
+    if args.baseline_file:
+        with open(args.baseline_file) as json_file:
+            baseline = json.load(json_file)['results']
+    print('')
+    print_results(results, baseline)
+    if args.save_file:
+        with open(args.save_file, 'w') as json_file:
+            json.dump({ 'options' : options, 'settings' : settings, 'large_output_mb' : args.large_output_mb,
+                        'scp_kb' : args.scp_kb, 'results' : results }, json_file,
+                      indent=4, sort_keys=True)
+        print('\nBaseline written to {0}'.format(args.save_file))
+    regressions = get_regressions(results, baseline, args.threshold)
+    if regressions:
+        print('\nRegressions beyond {0:.0f}%:'.format(args.threshold * 100))
+        for name, metric, old, new in regressions:
+            print('  {0} {1}: {2:.4f} -> {3:.4f}'.format(name, metric, old, new))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
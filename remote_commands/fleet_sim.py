@@ -0,0 +1,429 @@
+#!/usr/bin/env python
+
+########################################################################################
+# For any questions or suggestions please contact : Ajmal Yusuf <ayusuf@hortonworks.com>
+########################################################################################
+
+'''
+Simulates a fleet of ssh hosts on this box, so that remote.py can be benchmarked without real hosts.
+
+"install" writes fake ssh and scp executables into <root>/bin. With that directory first on the PATH,
+remote.py connects to any hostname through them: they answer with the password prompt, a bash shell
+with a "[user@host dir]$ " prompt, a sudo password prompt (sudo is a shell function) and scp progress,
+after the configured latency and jitter. Each host gets its own home directory under <root>/hosts.
+"measure" runs remote.execute() on N simulated hosts and reports hosts/sec and memory per session.
+
+    python fleet_sim.py --root /tmp/fleet install --latency 0.05 --jitter 0.01
+    PATH=/tmp/fleet/bin:$PATH python remote.py -f conf.json --live-run
+    python fleet_sim.py --root /tmp/fleet measure --hosts 10,100,1000 --engine async --parallel 0
+'''
+
+import sys
+import os
+import re
+import json
+import time
+import fcntl
+import random
+import shutil
+import hashlib
+import argparse
+import resource
+import subprocess
+
+default_root = '/tmp/remote_fleet_sim'
+default_settings = {
+    'password' : None,       # Password the hosts accept. None accepts any password
+    'key_auth' : False,      # Hosts let users in without a password (like keys or an agent)
+    'latency' : 0.0,         # Seconds of one network round trip
+    'jitter' : 0.0,          # Upto this many seconds are added to each round trip at random
+    'failure_rate' : 0.0,    # Fraction of the hosts which refuse the connection
+    'hang_rate' : 0.0,       # Fraction of the hosts which never answer
+    'output_bytes' : 1024,   # Bytes printed by the sim_output command when no size is given
+    'bandwidth' : 0,         # Bytes per second of a scp transfer. 0 for no limit
+    'max_startups' : 0,      # Handshakes in flight to a host (or jump host) beyond which it resets the connection
+    'seed' : 0,              # Picks which hosts fail or hang
+    'hosts' : {}             # hostname -> settings above, overriding them for that host
+}
+
+wrapper_format = '#!/bin/sh\nexec "{python}" "{script}" --root "{root}" {program} "$@"\n'
+
+# Read by the bash of every simulated host
+bashrc = r'''
+PS1='[$USER@$SIM_HOST \W]$ '
+__sim_delay() {
+    local ms=$((SIM_LATENCY_MS + (SIM_JITTER_MS > 0 ? RANDOM % (SIM_JITTER_MS + 1) : 0)))
+    [ $ms -gt 0 ] && sleep $((ms / 1000)).$(printf '%03d' $((ms % 1000)))
+    return 0
+}
+PROMPT_COMMAND=__sim_delay
+sudo() {
+    local password
+    read -r -s -p "[sudo] password for $USER: " password
+    echo
+    "$@"
+}
+sim_output() {
+    head -c "${1:-$SIM_OUTPUT_BYTES}" /dev/zero | tr '\0' 'x' | fold -w 100
+    echo
+}
+'''
+
+def load_settings(root):
+    settings = dict(default_settings)
+    with open(os.path.join(root, 'settings.json')) as settings_file:
+        settings.update(json.load(settings_file))
+    return settings
+
+def get_host_settings(settings, hostname):
+    host_settings = dict(settings)
+    host_settings.update(settings['hosts'].get(hostname, {}))
+    return host_settings
+
+def install(root, settings):
+    '''Writes the settings, the fake ssh and scp and the bashrc of the hosts into root. Returns the
+    directory to put first on the PATH'''
+    bin_dir = os.path.join(root, 'bin')
+    for directory in (root, bin_dir, os.path.join(root, 'hosts')):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    with open(os.path.join(root, 'settings.json'), 'w') as settings_file:
+        json.dump(settings, settings_file, indent=4)
+    with open(os.path.join(root, 'bashrc'), 'w') as bashrc_file:
+        bashrc_file.write(bashrc)
+    # measure runs remote.py in root, which reads its defaults from the current directory
+    shutil.copyfile(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'default_properties.json'),
+                    os.path.join(root, 'default_properties.json'))
+    for program in ('ssh', 'scp'):
+        path = os.path.join(bin_dir, program)
+        with open(path, 'w') as wrapper:
+            wrapper.write(wrapper_format.format(python=sys.executable, script=os.path.abspath(__file__),
+                                                root=os.path.abspath(root), program=program))
+        os.chmod(path, 0o755)
+    return bin_dir
+
+def get_hostnames(count, prefix='sim'):
+    return ['{0}{1:05d}'.format(prefix, index) for index in range(1, count + 1)]
+
+def is_unlucky(host_settings, hostname, rate_name):
+    '''Decides, the same way in every run with the same seed, whether the host is one of the rate_name
+    fraction of the hosts'''
+    digest = hashlib.md5('{0}:{1}:{2}'.format(host_settings['seed'], rate_name, hostname).encode()).hexdigest()
+    return int(digest[:8], 16) / float(0xffffffff) < host_settings[rate_name]
+
+def round_trips(host_settings, count=1):
+    delay = count * host_settings['latency'] + random.uniform(0, host_settings['jitter'])
+    if delay > 0:
+        time.sleep(delay)
+
+def parse_ssh_args(args):
+    '''Splits the ssh/scp arguments into (-o options, other flags, positional arguments)'''
+    options, flags, positional = {}, [], []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if positional:
+            positional.append(arg)
+        elif arg == '-o' and args:
+            name, value = args.pop(0).split('=', 1)
+            options[name] = value
+        elif arg in ('-O', '-p', '-P', '-i', '-l', '-J') and args:
+            flags.append((arg, args.pop(0)))
+        elif arg.startswith('-'):
+            flags.append((arg, None))
+        else:
+            positional.append(arg)
+    return options, dict(flags), positional
+
+def read_password(prompt):
+    '''Asks for a password on the terminal without echoing it, the way ssh does. Like ssh, the echo is
+    turned off (which flushes the input) before the prompt is written, so a password sent as soon as the
+    prompt shows up is not flushed'''
+    import termios
+    fd = sys.stdin.fileno()
+    old = termios.tcgetattr(fd)
+    new = termios.tcgetattr(fd)
+    new[3] &= ~termios.ECHO
+    termios.tcsetattr(fd, termios.TCSAFLUSH, new)
+    sys.stdout.write(prompt)
+    sys.stdout.flush()
+    try:
+        password = sys.stdin.readline().rstrip('\n')
+    finally:
+        termios.tcsetattr(fd, termios.TCSAFLUSH, old)
+    sys.stdout.write('\n')
+    sys.stdout.flush()
+    return password
+
+def start_handshake(root, host_settings, target):
+    '''Counts a handshake in flight to the target, like sshd MaxStartups. Resets the connection the way ssh
+    reports it if max_startups handshakes are already in flight. Returns the file to remove once it is over'''
+    directory = os.path.join(root, 'startups', target)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass
+    with open(os.path.join(root, 'startups', 'lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        in_flight = 0
+        for name in os.listdir(directory):
+            try:
+                os.kill(int(name), 0)
+                in_flight += 1
+            except OSError:
+                os.remove(os.path.join(directory, name)) # Left by a process which was killed
+        if in_flight >= host_settings['max_startups']:
+            sys.stderr.write('kex_exchange_identification: read: Connection reset by peer\r\n')
+            sys.exit(255)
+        path = os.path.join(directory, str(os.getpid()))
+        open(path, 'w').close()
+    return path
+
+def connect(root, options, flags, username, hostname):
+    '''Goes through the connection to a simulated host: the round trips, the failures and the password.
+    Exits the way ssh does if the connection fails. Returns the settings of the host'''
+    host_settings = get_host_settings(load_settings(root), hostname)
+    handshake = None
+    if host_settings['max_startups']:
+        handshake = start_handshake(root, host_settings, flags.get('-J') or options.get('ProxyJump') or hostname)
+    try:
+        return authenticate(host_settings, options, username, hostname)
+    finally:
+        if handshake:
+            os.remove(handshake)
+
+def authenticate(host_settings, options, username, hostname):
+    round_trips(host_settings, 2)
+    if is_unlucky(host_settings, hostname, 'hang_rate'):
+        while True:
+            time.sleep(3600)
+    if is_unlucky(host_settings, hostname, 'failure_rate'):
+        sys.stderr.write('ssh: connect to host {0} port 22: Connection refused\r\n'.format(hostname))
+        sys.exit(255)
+    control_path = options.get('ControlPath')
+    master = options.get('ControlMaster', 'no')
+    if control_path and os.path.exists(control_path) and master in ('no', 'auto'):
+        return host_settings # Riding the master connection
+    if not host_settings['key_auth']:
+        if options.get('BatchMode') == 'yes':
+            sys.stderr.write('{0}@{1}: Permission denied (publickey,password).\r\n'.format(username, hostname))
+            sys.exit(255)
+        for attempt in range(3):
+            password = read_password("{0}@{1}'s password: ".format(username, hostname))
+            round_trips(host_settings)
+            if host_settings['password'] is None or password == host_settings['password']:
+                break
+            sys.stdout.write('Permission denied, please try again.\r\n')
+        else:
+            sys.stderr.write('{0}@{1}: Permission denied (publickey,password).\r\n'.format(username, hostname))
+            sys.exit(255)
+    if control_path and master in ('yes', 'auto'):
+        # Only marks the master as running, the later connections still run their own shell
+        open(control_path, 'w').close()
+    return host_settings
+
+def get_home(root, hostname):
+    home = os.path.join(root, 'hosts', hostname)
+    if not os.path.isdir(home):
+        os.makedirs(home)
+    return home
+
+def fake_ssh(root, args):
+    options, flags, positional = parse_ssh_args(args)
+    if not positional:
+        sys.stderr.write('usage: ssh [options] [user@]hostname [command]\n')
+        sys.exit(255)
+    target, command = positional[0], positional[1:]
+    username, hostname = target.split('@', 1) if '@' in target else (flags.get('-l', os.environ.get('USER', 'root')), target)
+    if '-O' in flags:
+        control_path = options.get('ControlPath')
+        if control_path and os.path.exists(control_path):
+            os.remove(control_path)
+        sys.stderr.write('Exit request sent.\r\n')
+        sys.exit(0)
+    host_settings = connect(root, options, flags, username, hostname)
+    if options.get('PermitLocalCommand') == 'yes' and options.get('LocalCommand'):
+        # Like ssh, runs the LocalCommand on this side once the connection is authenticated
+        sys.stdout.flush()
+        subprocess.call([os.environ.get('SHELL') or '/bin/sh', '-c', options['LocalCommand']])
+    home = get_home(root, hostname)
+    os.chdir(home)
+    os.environ.update({ 'HOME' : home, 'USER' : username, 'SIM_HOST' : hostname,
+                        'SIM_LATENCY_MS' : str(int(host_settings['latency'] * 1000)),
+                        'SIM_JITTER_MS' : str(int(host_settings['jitter'] * 1000)),
+                        'SIM_OUTPUT_BYTES' : str(host_settings['output_bytes']),
+                        'BASH_ENV' : os.path.join(root, 'bashrc') })
+    if command:
+        os.execvp('bash', ['bash', '-c', ' '.join(command)])
+    if sys.stdin.isatty():
+        # Like ssh, which puts the terminal in raw mode for the session and leaves the echo to the remote
+        # host. Only the echo is turned off, so the shell still reads lines like on a remote pty
+        import termios
+        attrs = termios.tcgetattr(sys.stdin.fileno())
+        attrs[3] &= ~termios.ECHO
+        termios.tcsetattr(sys.stdin.fileno(), termios.TCSADRAIN, attrs)
+    os.execvp('bash', ['bash', '--noprofile', '--rcfile', os.path.join(root, 'bashrc'), '-i'])
+
+def fake_scp(root, args):
+    options, flags, positional = parse_ssh_args(args)
+    remote_regex = re.compile('^(?:([^@:/]+)@)?([^:/]+):(.*)$')
+    if len(positional) != 2:
+        sys.stderr.write('usage: scp [options] source target\n')
+        sys.exit(1)
+    paths = []
+    for path in positional:
+        match = remote_regex.match(path)
+        if match:
+            username, hostname, remote_path = match.groups()
+            host_settings = connect(root, options, flags, username, hostname)
+            path = os.path.join(get_home(root, hostname), remote_path.lstrip('/'))
+        paths.append(path)
+    source, target = paths
+    if not os.path.exists(source):
+        sys.stderr.write('scp: {0}: No such file or directory\r\n'.format(positional[0]))
+        sys.exit(1)
+    if os.path.isdir(target):
+        target = os.path.join(target, os.path.basename(source.rstrip('/')))
+    elif not os.path.isdir(os.path.dirname(target) or '.'):
+        os.makedirs(os.path.dirname(target))
+    if os.path.isdir(source):
+        size = sum(os.path.getsize(os.path.join(directory, name))
+                   for directory, dirs, names in os.walk(source) for name in names)
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        shutil.copytree(source, target)
+    else:
+        size = os.path.getsize(source)
+        shutil.copyfile(source, target)
+    if host_settings['bandwidth']:
+        time.sleep(size / float(host_settings['bandwidth']))
+    sys.stdout.write('{0:<40} 100% {1:>6}KB   1.0MB/s   00:00 ETA\r\n'.format(os.path.basename(source),
+                                                                              size // 1024))
+    sys.stdout.flush()
+
+def get_memory_kb():
+    '''Max resident set size of this process so far, in KB'''
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss // 1024 if sys.platform == 'darwin' else maxrss
+
+def execute_config(config_file, options, live_run=True):
+    '''Runs remote.execute() on a config with its output thrown away. Returns the seconds it took and the
+    memory it added'''
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import remote
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    with open(config_file) as json_file:
+        config = json.load(json_file)
+    stdout = sys.stdout
+    memory = get_memory_kb()
+    started = time.time()
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            remote.execute(config, live_run, None, options)
+        finally:
+            sys.stdout = stdout
+    return { 'seconds' : time.time() - started, 'base_memory_kb' : memory, 'memory_kb' : get_memory_kb() - memory }
+
+def get_config(hostnames, commands, settings, timeout_secs=30):
+    return { 'variables' : { 'hostname' : hostnames, 'username' : 'sim', 'password' : settings['password'] or 'sim',
+                             'timeout_secs' : str(timeout_secs) },
+             'main' : ['simulate'],
+             'simulate' : { 'action' : 'ssh', 'commands' : commands } }
+
+def measure(root, hostnames, config, options, live_run=True, environ=None):
+    '''Runs remote.execute() for the config in a new process, with the simulated fleet on the PATH, and
+    returns its seconds, memory and hosts per second'''
+    config_file = os.path.join(root, 'config.json')
+    with open(config_file, 'w') as json_file:
+        json.dump(config, json_file, indent=4)
+    env = dict(environ or os.environ)
+    env['PATH'] = os.path.join(root, 'bin') + os.pathsep + env.get('PATH', '')
+    command = [sys.executable, os.path.abspath(__file__), '--root', root, 'execute', config_file,
+               '--options', json.dumps(options)] + ([] if live_run else ['--dry-run'])
+    output = subprocess.check_output(command, env=env, cwd=root)
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    result['hosts'] = len(hostnames)
+    result['hosts_per_sec'] = len(hostnames) / result['seconds'] if result['seconds'] else 0
+    result['memory_per_session_kb'] = result['memory_kb'] / float(len(hostnames)) if hostnames else 0
+    return result
+
+def main():
+    if len(sys.argv) > 3 and sys.argv[1] == '--root' and sys.argv[3] in ('ssh', 'scp'):
+        # Called for every connection, so the ssh and scp arguments are passed on as they are
+        root, program, args = sys.argv[2], sys.argv[3], sys.argv[4:]
+        return fake_ssh(root, args) if program == 'ssh' else fake_scp(root, args)
+    parser = argparse.ArgumentParser(description='Simulates a fleet of ssh hosts on this box, for benchmarking '
+                                     'remote.py without real hosts', prog='fleet_sim.py')
+    parser.add_argument('--root', default=default_root,
+                        help='Directory of the simulated fleet. Default: {0}'.format(default_root))
+    subparsers = parser.add_subparsers(dest='command')
+
+    def add_settings_arguments(subparser):
+        subparser.add_argument('--latency', type=float, default=0.0, help='Seconds of one round trip')
+        subparser.add_argument('--jitter', type=float, default=0.0, help='Random seconds added to a round trip')
+        subparser.add_argument('--failure-rate', dest='failure_rate', type=float, default=0.0,
+                               help='Fraction of the hosts refusing the connection')
+        subparser.add_argument('--hang-rate', dest='hang_rate', type=float, default=0.0,
+                               help='Fraction of the hosts which never answer')
+        subparser.add_argument('--output-bytes', dest='output_bytes', type=int, default=1024,
+                               help='Bytes printed by sim_output when no size is given')
+        subparser.add_argument('--bandwidth', type=int, default=0, help='Bytes per second of scp. 0 for no limit')
+        subparser.add_argument('--max-startups', dest='max_startups', type=int, default=0,
+                               help='Handshakes in flight to a host, or to the -J jump host, beyond which it resets ' \
+                               'the connection, like sshd MaxStartups. 0 for no limit')
+        subparser.add_argument('--password', help='Password the hosts accept. Default: any')
+        subparser.add_argument('--key-auth', dest='key_auth', action='store_true',
+                               help='Hosts let users in without a password')
+        subparser.add_argument('--seed', type=int, default=0, help='Picks which hosts fail or hang')
+
+    install_parser = subparsers.add_parser('install', help='Writes the fake ssh and scp into ROOT/bin')
+    add_settings_arguments(install_parser)
+
+    measure_parser = subparsers.add_parser('measure', help='Measures hosts/sec and memory per session of '
+                                           'remote.execute() on N simulated hosts')
+    add_settings_arguments(measure_parser)
+    measure_parser.add_argument('--hosts', dest='host_counts', default='10,100,1000,5000',
+                                help='Comma separated numbers of hosts. Default: 10,100,1000,5000')
+    measure_parser.add_argument('--commands', default='echo {hostname}',
+                                help="Semicolon separated commands run on each host. Default: 'echo {hostname}'")
+    measure_parser.add_argument('--parallel', type=int, default=0, help='Hosts at a time. Default: 0 (all)')
+    measure_parser.add_argument('--engine', default='async', help='Engine of remote.py. Default: async')
+    measure_parser.add_argument('--json', dest='json_file', help='Also write the results as JSON to this file')
+
+    execute_parser = subparsers.add_parser('execute', help='Runs remote.execute() on a config and prints the '
+                                           'seconds and memory as JSON (used by measure)')
+    execute_parser.add_argument('config_file')
+    execute_parser.add_argument('--options', default='{}', help='run options of remote.py as JSON')
+    execute_parser.add_argument('--dry-run', dest='live_run', action='store_false', help='Without --live-run')
+
+    args = parser.parse_args()
+    if args.command == 'execute':
+        print(json.dumps(execute_config(args.config_file, json.loads(args.options), args.live_run)))
+    else:
+        settings = dict(default_settings)
+        settings.update(dict((name, getattr(args, name)) for name in default_settings if hasattr(args, name)))
+        bin_dir = install(args.root, settings)
+        if args.command == 'install':
+            print('Simulated fleet installed. Put it first on the PATH with:')
+            print('export PATH={0}:$PATH'.format(bin_dir))
+            return
+        results = []
+        options = { 'parallel' : args.parallel, 'engine' : args.engine }
+        print('{0:>7} {1:>10} {2:>11} {3:>12} {4:>16}'.format('Hosts', 'Seconds', 'Hosts/sec', 'Memory KB',
+                                                              'KB per session'))
+        for count in [int(value) for value in args.host_counts.split(',')]:
+            hostnames = get_hostnames(count)
+            result = measure(args.root, hostnames, get_config(hostnames, args.commands.split(';'), settings), options)
+            print('{0:>7} {1:>10.2f} {2:>11.1f} {3:>12} {4:>16.1f}'.format(count, result['seconds'],
+                  result['hosts_per_sec'], result['memory_kb'], result['memory_per_session_kb']))
+            results.append(result)
+        if args.json_file:
+            with open(args.json_file, 'w') as json_file:
+                json.dump({ 'settings' : settings, 'options' : options, 'results' : results }, json_file, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+########################################################################################
+# For any questions or suggestions please contact : Ajmal Yusuf <ayusuf@hortonworks.com>
+########################################################################################
+
+'''
+An append-only journal of the outcomes of a run, one file per run_id, with one JSON line per entry:
+    { "kind" : "command", "step", "host", "command", "status", "ok", "seconds", "time" }
+        a command of a ssh action on a host
+    { "kind" : "unit", "step", "host", "command", "status", "ok", "seconds", "time" }
+        a unit of work completed: a ssh or scp action on a host (command is null), or a local command
+
+A run resumed from the journal skips the units it completed, or runs only the ones which failed.
+The entries are written as they come and fsync'ed in batches, so a crash loses at most the last batch.
+'''
+
+import os
+import json
+import time
+import threading
+
+BATCH_SIZE = 64      # Entries written before they are fsync'ed
+BATCH_SECS = 1.0     # Seconds after which the entries written are fsync'ed
+
+def get_path(directory, run_id):
+    return os.path.join(os.path.expanduser(directory), '{0}.journal'.format(run_id))
+
+class Journal(object):
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        self.path = path
+        self.journal_file = open(path, 'a')
+        self.pending = 0
+        self.synced = time.time()
+        self.lock = threading.Lock()
+
+    def record(self, kind, step, host, command, status, ok, seconds):
+        entry = { 'kind' : kind, 'step' : step, 'host' : host, 'command' : command, 'status' : status,
+                  'ok' : ok, 'seconds' : round(seconds, 6), 'time' : time.time() }
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self.lock:
+            self.journal_file.write(line)
+            self.pending += 1
+            if self.pending >= BATCH_SIZE or entry['time'] - self.synced >= BATCH_SECS:
+                self.sync()
+
+    def sync(self):
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+        self.pending = 0
+        self.synced = time.time()
+
+    def close(self):
+        with self.lock:
+            if not self.journal_file.closed:
+                self.sync()
+                self.journal_file.close()
+
+def load(path):
+    '''Returns the state of the units of a journal: { (step, host, command) : { "done", "failed" } }. A unit
+    failed if it did not complete successfully or any of its commands failed. The last attempt of a unit
+    counts, so a unit which failed and then completed on a rerun did not fail'''
+    units = {}
+    with open(path) as journal_file:
+        for line in journal_file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue # A line cut short by a crash
+            if entry.get('kind') == 'command':
+                key = (entry['step'], entry['host'], None)
+            else:
+                key = (entry['step'], entry['host'], entry['command'])
+            state = units.get(key)
+            if state is None or state['done']:
+                state = units[key] = { 'done' : False, 'failed' : False }
+            if not entry['ok']:
+                state['failed'] = True
+            if entry.get('kind') == 'unit':
+                state['done'] = True
+    return units
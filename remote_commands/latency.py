@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+########################################################################################
+# For any questions or suggestions please contact : Ajmal Yusuf <ayusuf@hortonworks.com>
+########################################################################################
+
+'''
+The history of how long each host took to connect, kept between the runs in a JSON file:
+    { hostname : { phase : [ seconds, ... ] } }
+with the last SAMPLES seconds of each phase (first_prompt, auth and master of timings.phases).
+
+The timeout of a phase on a host is a high percentile of its history plus a margin, within timeout_secs.
+Once it expires, the host is reported as slower than usual and the phase waits on upto timeout_secs, so a
+slow but healthy host is not aborted. The time the phase took in the end is what is added to the history,
+so a host which got slower gets a longer timeout in the next run.
+'''
+
+import os
+import json
+import tempfile
+import threading
+
+import timings
+
+# Phases whose timeouts are learned. The commands keep timeout_secs, as they take what they take
+phases = ['first_prompt', 'auth', 'master']
+
+SAMPLES = 50       # Seconds kept per host and phase
+MIN_SAMPLES = 5    # Seconds needed before the timeout of a host and phase is learned
+PERCENTILE = 99
+FACTOR = 1.5       # The timeout is the percentile times FACTOR plus MARGIN_SECS
+MARGIN_SECS = 1.0
+
+class LatencyHistory(object):
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self.history = {}
+        self.changed = False
+        self.lock = threading.Lock()
+        try:
+            with open(self.path) as history_file:
+                history = json.load(history_file)
+            if isinstance(history, dict):
+                self.history = history
+        except (IOError, OSError, ValueError):
+            pass # No history yet, or a file cut short: the hosts get timeout_secs until they have one
+
+    def record(self, hostname, phase, seconds):
+        with self.lock:
+            samples = self.history.setdefault(hostname, {}).setdefault(phase, [])
+            samples.append(round(seconds, 4))
+            del samples[:-SAMPLES]
+            self.changed = True
+
+    def get_timeout(self, hostname, phase, floor, cap):
+        '''Returns the timeout of the phase on the host, from its history, within floor and cap. Returns cap
+        until the host has MIN_SAMPLES of the phase'''
+        with self.lock:
+            samples = sorted(self.history.get(hostname, {}).get(phase, []))
+        if len(samples) < MIN_SAMPLES:
+            return cap
+        timeout = timings.percentile(samples, PERCENTILE) * FACTOR + MARGIN_SECS
+        return min(cap, max(floor, timeout))
+
+    def save(self):
+        '''Writes the history if it changed. The file is replaced at once, so a run reading it at the same
+        time reads the old or the new history'''
+        with self.lock:
+            if not self.changed:
+                return
+            data = json.dumps(self.history, separators=(',', ':'), sort_keys=True)
+            self.changed = False
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=directory or '.')
+        try:
+            with os.fdopen(handle, 'w') as history_file:
+                history_file.write(data)
+            os.rename(temp_path, self.path)
+        except:
+            os.remove(temp_path)
+            raise
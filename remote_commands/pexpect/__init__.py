@@ -68,12 +68,14 @@ PY3 = (sys.version_info[0] >= 3)
 
 from .exceptions import ExceptionPexpect, EOF, TIMEOUT
 from .utils import split_command_line, which, is_executable_file
-from .expect import Expecter, searcher_re, searcher_string
+from .expect import (Expecter, searcher_re, searcher_combined, searcher_string, searcher_ac,
+                     searcher_exact)
 
 if sys.platform != 'win32':
     # On Unix, these are available at the top level for backwards compatibility
     from .pty_spawn import spawn, spawnu
     from .run import run, runu
+    from .reactor import Reactor
 
 __version__ = '4.6.0'
 __revision__ = ''
@@ -1,4 +1,9 @@
+import re
 import time
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    import sre_parse, sre_constants
 
 from .exceptions import EOF, TIMEOUT
 
@@ -9,8 +14,24 @@ class Expecter(object):
         if searchwindowsize == -1:
             searchwindowsize = spawn.searchwindowsize
         self.searchwindowsize = searchwindowsize
+        # Without a searchwindowsize, a searcher which knows how far back
+        # into the data already searched a match can start (its lookback)
+        # gets the data as chunks: see new_chunk()
+        self.lookback = None
+        if not searchwindowsize:
+            self.lookback = getattr(searcher, 'lookback', None)
+        self._chunks = []
+        self._size = 0
+        self._tail = spawn.string_type()
+        # A searcher which keeps state between the data it is given
+        # starts over with each expect
+        reset = getattr(searcher, 'reset', None)
+        if reset is not None:
+            reset()
 
     def new_data(self, data):
+        if self.lookback is not None:
+            return self.new_chunk(data)
         spawn = self.spawn
         searcher = self.searcher
 
@@ -41,9 +62,56 @@ class Expecter(object):
             spawn._buffer = spawn.buffer_type()
             spawn._buffer.write(window)
 
+    def new_chunk(self, data):
+        '''Keeps the data read as a list of chunks instead of copying it into
+        the buffer, and searches only the new data and the last 'lookback'
+        characters before it. The chunks are joined once, on a match (or on
+        EOF, TIMEOUT or an error), so reading N bytes costs O(N) instead of a
+        copy of the whole buffer on every read.'''
+        spawn = self.spawn
+        searcher = self.searcher
+
+        self._chunks.append(data)
+        self._size += len(data)
+        window = self._tail + data
+        index = searcher.search(window, len(data))
+        if index < 0:
+            self._tail = window[len(window) - min(self.lookback, len(window)):]
+            return None
+        start = self._size - len(window) + searcher.start
+        end = self._size - len(window) + searcher.end
+        # The match is near the end, so only the last chunks are walked back
+        chunks = self._chunks
+        n, offset = len(chunks), self._size
+        while n > 0 and offset > start:
+            n -= 1
+            offset -= len(chunks[n])
+        rest = spawn.string_type().join(chunks[n:])
+        self._reset_chunks()
+        spawn._buffer = spawn.buffer_type()
+        spawn._buffer.write(rest[end - offset:])
+        spawn._before = spawn.buffer_type()
+        spawn.before = spawn.string_type().join(chunks[:n] + [rest[:start - offset]])
+        spawn.after = rest[start - offset:end - offset]
+        spawn.match = searcher.match
+        spawn.match_index = index
+        return index
+
+    def _reset_chunks(self):
+        self._chunks = []
+        self._size = 0
+        self._tail = self.spawn.string_type()
+
+    def _unmatched(self):
+        '''Moves the chunks not matched back into the buffer of the spawn'''
+        if self._chunks:
+            self.spawn.buffer = self.spawn.string_type().join(self._chunks)
+            self._reset_chunks()
+
     def eof(self, err=None):
         spawn = self.spawn
 
+        self._unmatched()
         spawn.before = spawn.buffer
         spawn._buffer = spawn.buffer_type()
         spawn._before = spawn.buffer_type()
@@ -65,6 +133,7 @@ class Expecter(object):
     def timeout(self, err=None):
         spawn = self.spawn
 
+        self._unmatched()
         spawn.before = spawn.buffer
         spawn.after = TIMEOUT
         index = self.searcher.timeout_index
@@ -83,6 +152,7 @@ class Expecter(object):
 
     def errored(self):
         spawn = self.spawn
+        self._unmatched()
         spawn.before = spawn.buffer
         spawn.after = None
         spawn.match = None
@@ -156,6 +226,8 @@ class searcher_string(object):
                 self.timeout_index = n
                 continue
             self._strings.append((n, s))
+        # A match can start at most this many characters before new data
+        self.lookback = max([len(s) - 1 for n, s in self._strings] or [0])
 
     def __str__(self):
         '''This returns a human-readable string that represents the state of
@@ -196,6 +268,10 @@ class searcher_string(object):
         # rescanning until we've read three more bytes.
         #
         # Sadly, I don't know enough about this interesting topic. /grahn
+        #
+        # searcher_ac below scans the input once for all N strings. In
+        # CPython it only pays off for many strings, as each find() here
+        # is a pass in C: see searcher_exact().
 
         for index, s in self._strings:
             if searchwindowsize is None:
@@ -217,6 +293,167 @@ class searcher_string(object):
         return best_index
 
 
+class searcher_ac(object):
+    '''This is a plain string search helper like searcher_string, which
+    scans each character once however many strings it searches for. The
+    strings are precompiled into an Aho-Corasick automaton, whose state is
+    kept from one search() to the next, so only the fresh data is scanned.
+    Between the characters which can start a string the scan is a regex
+    character class, so it runs in C until a candidate is found.
+
+    It returns the same match as searcher_string: the one which starts
+    first, and of those the string which comes first in the list.
+
+    Attributes:
+
+        eof_index     - index of EOF, or -1
+        timeout_index - index of TIMEOUT, or -1
+
+    After a successful match by the search() method the following attributes
+    are available:
+
+        start - index into the buffer, first byte of match
+        end   - index into the buffer, first byte after match
+        match - the matching string itself
+
+    '''
+
+    def __init__(self, strings):
+        '''This creates an instance of searcher_ac. This argument 'strings'
+        may be a list; a sequence of strings; or the EOF or TIMEOUT types. '''
+
+        self.eof_index = -1
+        self.timeout_index = -1
+        self._strings = []
+        for n, s in enumerate(strings):
+            if s is EOF:
+                self.eof_index = n
+                continue
+            if s is TIMEOUT:
+                self.timeout_index = n
+                continue
+            self._strings.append((n, s))
+        # A match can start at most this many characters before new data
+        self.lookback = max([len(s) - 1 for n, s in self._strings] or [0])
+
+        # The trie of the strings. _longest[state] is the (length, index,
+        # string) of the longest string ending at the state, the one which
+        # starts first, or None
+        goto = [{}]
+        self._longest = [None]
+        for index, s in self._strings:
+            state = 0
+            for i in range(len(s)):
+                c = s[i:i + 1]
+                if c not in goto[state]:
+                    goto[state][c] = len(goto)
+                    goto.append({})
+                    self._longest.append(None)
+                state = goto[state][c]
+            if s and self._longest[state] is None:
+                self._longest[state] = (len(s), index, s)
+        # Failure links, breadth first, then the transitions of each state
+        # for every character, so that a character is one dict lookup
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for state in queue:
+            for c, child in goto[state].items():
+                queue.append(child)
+                f = fail[state]
+                while f and c not in goto[f]:
+                    f = fail[f]
+                fail[child] = goto[f].get(c, 0)
+                if self._longest[child] is None:
+                    self._longest[child] = self._longest[fail[child]]
+        self._delta = [goto[0]] + [None] * (len(goto) - 1)
+        for state in queue:
+            self._delta[state] = dict(self._delta[fail[state]])
+            self._delta[state].update(goto[state])
+        self._starts = None
+        self._state = 0
+
+    def __str__(self):
+        '''This returns a human-readable string that represents the state of
+        the object.'''
+
+        ss = [(ns[0], '    %d: %r' % ns) for ns in self._strings]
+        ss.append((-1, 'searcher_ac:'))
+        if self.eof_index >= 0:
+            ss.append((self.eof_index, '    %d: EOF' % self.eof_index))
+        if self.timeout_index >= 0:
+            ss.append((self.timeout_index,
+                '    %d: TIMEOUT' % self.timeout_index))
+        ss.sort()
+        ss = list(zip(*ss))[1]
+        return '\n'.join(ss)
+
+    def reset(self):
+        '''Forgets the data searched so far, for a new expect.'''
+        self._state = 0
+
+    def search(self, buffer, freshlen, searchwindowsize=None):
+        '''This searches 'buffer' for the first occurrence of one of the search
+        strings, like searcher_string.search(). Only the last 'freshlen'
+        characters are scanned: the data before them must be what the
+        previous search() scanned, as the automaton carries on from there.
+        'searchwindowsize' is not needed, and a match must start within
+        'buffer'.
+
+        If there is a match this returns the index of that string, and sets
+        'start', 'end' and 'match'. Otherwise, this returns -1. '''
+
+        if self._starts is None:
+            # The characters which can start a string, of the type of the data
+            starts = sorted(set(re.escape(s[:1]) for n, s in self._strings if s))
+            if isinstance(buffer, bytes):
+                empty, brackets, never = b'', [b'[', b']'], b'(?!)'
+            else:
+                empty, brackets, never = u'', [u'[', u']'], u'(?!)'
+            self._starts = re.compile(empty.join(starts).join(brackets) if starts else never)
+        delta, longest, starts = self._delta, self._longest, self._starts
+        state = self._state
+        i, limit = len(buffer) - freshlen, len(buffer)
+        found = None
+        while i < limit:
+            if not state:
+                m = starts.search(buffer, i, limit)
+                if m is None:
+                    break
+                i = m.start()
+            state = delta[state].get(buffer[i:i + 1], 0)
+            i += 1
+            if longest[state] is not None:
+                length, index, string = longest[state]
+                start = i - length
+                if start >= 0 and (found is None or start < found[0] or
+                                   (start == found[0] and index < found[1])):
+                    found = (start, index, string)
+                    # A match starting as early ends within the next lookback
+                    limit = min(limit, start + self.lookback + 1)
+        if found is None:
+            self._state = state
+            return -1
+        self._state = 0
+        self.start, index, self.match = found
+        self.end = self.start + len(self.match)
+        return index
+
+
+# Literal strings from which searcher_ac is faster than searcher_string: the
+# automaton scans about 30 MB/s whatever the number of strings, while each
+# string costs searcher_string a find() at hundreds of MB/s
+AC_MIN_STRINGS = 48
+
+def searcher_exact(strings):
+    '''Returns the searcher of expect_exact() for 'strings': searcher_ac for
+    many strings, else searcher_string.'''
+    strings = list(strings)
+    literals = [s for s in strings if s is not EOF and s is not TIMEOUT]
+    if len(literals) >= AC_MIN_STRINGS and all(literals):
+        return searcher_ac(strings)
+    return searcher_string(strings)
+
+
 class searcher_re(object):
     '''This is regular expression string search helper for the
     spawn.expect_any() method. This helper class is for powerful
@@ -304,3 +541,225 @@ class searcher_re(object):
         self.match = the_match
         self.end = self.match.end()
         return best_index
+
+
+# Longest match of a pattern whose length is known for which searcher_combined
+# searches only near the new data. Longer ones are searched in all the buffer
+MAX_LOOKBACK = 4096
+
+# Zero-width assertions which hold the same in a window of the data as in the
+# whole buffer: the end of the data is the end of the buffer
+_window_safe_at = (sre_constants.AT_END, sre_constants.AT_END_STRING,
+                   sre_constants.AT_END_LINE)
+
+def _walk(parsed):
+    '''Yields the (op, av) of a parsed pattern and of all its subpatterns.'''
+    for op, av in parsed:
+        yield op, av
+        stack = [av]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, sre_parse.SubPattern):
+                for node in _walk(item):
+                    yield node
+            elif isinstance(item, (list, tuple)):
+                stack.extend(item)
+
+def _same_type(text, source):
+    '''Returns the ascii 'text' as bytes if 'source' is bytes.'''
+    return text.encode('ascii') if isinstance(source, bytes) else text
+
+
+class searcher_combined(object):
+    '''This is a regular expression search helper like searcher_re, which
+    fuses the patterns into one alternation of named groups, so the buffer is
+    scanned once instead of once per pattern. The match is the same as with
+    searcher_re: the one which starts first, and of those the pattern which
+    comes first in the list, as an alternation tries its branches in order.
+
+    The patterns are parsed to know how far back a match can start:
+
+        - a pattern of known length (at most MAX_LOOKBACK) can only match in
+          the new data or that length before it
+        - a pattern anchored at the end ($ or \\Z, like the shell and password
+          prompts) can only match at the end of the buffer, so only the last
+          characters of its length are searched, whatever the new data
+        - a lookahead looks past the end of the match, so the length of what
+          it can look at is added to the length of its pattern, and two more
+          characters for a $ in it (which also matches before a newline at
+          the end)
+
+    so the cost of a search stays the same however long the buffer grows.
+    With 'tail', a pattern anchored at the end but of unknown length (like
+    '.*[$#] $') is searched in the last 'tail' characters only, and a longer
+    match of it is cut to them. A pattern of unknown length otherwise, or
+    which looks at the beginning, a word boundary or behind, makes every
+    search cover all the buffer, same as searcher_re.
+
+    Patterns with different flags or with backreferences are searched one by
+    one, with the same windows.
+
+    Attributes:
+
+        eof_index     - index of EOF, or -1
+        timeout_index - index of TIMEOUT, or -1
+        lookback      - how far before the new data a match can start, or
+                        None if it can start anywhere
+
+    After a successful match by the search() method the following attributes
+    are available:
+
+        start - index into the buffer, first byte of match
+        end   - index into the buffer, first byte after match
+        match - the re.match object of the pattern which matched
+
+    '''
+
+    def __init__(self, patterns, tail=None):
+        '''This creates an instance that searches for 'patterns' Where
+        'patterns' may be a list or other sequence of compiled regular
+        expressions, or the EOF or TIMEOUT types. 'tail' is the number of
+        characters searched for a pattern anchored at the end of unknown
+        length, or None to search all the buffer for it.'''
+
+        self.eof_index = -1
+        self.timeout_index = -1
+        self._searches = []
+        for n, s in enumerate(patterns):
+            if s is EOF:
+                self.eof_index = n
+                continue
+            if s is TIMEOUT:
+                self.timeout_index = n
+                continue
+            self._searches.append((n, s))
+
+        # The most characters a match can start before the new data, and
+        # before the end of the buffer for the patterns anchored at the end
+        self._fresh_lookback = None
+        self._end_lookback = None
+        windowed = True
+        fusable = len(set(s.flags for n, s in self._searches)) <= 1
+        for n, s in self._searches:
+            parsed = sre_parse.parse(s.pattern, s.flags)
+            nodes = list(_walk(parsed))
+            ops = [op for op, av in nodes]
+            if (sre_constants.GROUPREF in ops or
+                    sre_constants.GROUPREF_EXISTS in ops):
+                # The group numbers change in the alternation, and the length
+                # of the match is not known
+                fusable = False
+                windowed = False
+                continue
+            # What a lookahead looks at is not part of the match: a match
+            # whose lookahead needs data read later starts further back
+            ahead = 0
+            for op, av in nodes:
+                if op == sre_constants.AT and av not in _window_safe_at:
+                    windowed = False
+                elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+                    if av[0] < 0:
+                        windowed = False
+                    else:
+                        ahead += av[1].getwidth()[1] + 2
+            width = parsed.getwidth()[1] + ahead
+            items = list(parsed)
+            anchored = (items and items[-1][0] == sre_constants.AT and
+                        (items[-1][1] == sre_constants.AT_END_STRING or
+                         (items[-1][1] == sre_constants.AT_END and
+                          not s.flags & re.MULTILINE)))
+            if anchored and width > MAX_LOOKBACK and tail is not None:
+                width = tail
+            if width > MAX_LOOKBACK:
+                windowed = False
+            elif anchored:
+                # $ also matches before a newline at the end
+                self._end_lookback = max(self._end_lookback or 0, width + 1)
+            else:
+                self._fresh_lookback = max(self._fresh_lookback or 0, width - 1)
+        self.lookback = None
+        if windowed and self._searches:
+            self.lookback = max(self._fresh_lookback or 0,
+                                (self._end_lookback or 1) - 1)
+        else:
+            self._fresh_lookback = self._end_lookback = None
+
+        self._regex = None
+        self._groups = {}
+        if fusable and len(self._searches) > 1:
+            sources = []
+            for n, s in self._searches:
+                name = '_pexpect_%d' % n
+                self._groups[name] = (n, s)
+                sources.append(_same_type('(?P<%s>' % name, s.pattern) +
+                               s.pattern + _same_type(')', s.pattern))
+            try:
+                self._regex = re.compile(
+                    _same_type('|', sources[0]).join(sources),
+                    self._searches[0][1].flags)
+            except re.error:
+                pass # Like the same group name in two patterns
+
+    def __str__(self):
+        '''This returns a human-readable string that represents the state of
+        the object.'''
+
+        ss = list()
+        for n, s in self._searches:
+            ss.append((n, '    %d: re.compile(%r)' % (n, s.pattern)))
+        ss.append((-1, 'searcher_combined:'))
+        if self.eof_index >= 0:
+            ss.append((self.eof_index, '    %d: EOF' % self.eof_index))
+        if self.timeout_index >= 0:
+            ss.append((self.timeout_index, '    %d: TIMEOUT' %
+                self.timeout_index))
+        ss.sort()
+        ss = list(zip(*ss))[1]
+        return '\n'.join(ss)
+
+    def search(self, buffer, freshlen, searchwindowsize=None):
+        '''This searches 'buffer' for the first occurrence of one of the regular
+        expressions. 'freshlen' must indicate the number of bytes at the end of
+        'buffer' which have not been searched before.
+
+        See class spawn for the 'searchwindowsize' argument.
+
+        If there is a match this returns the index of that string, and sets
+        'start', 'end' and 'match'. Otherwise, returns -1.'''
+
+        if searchwindowsize is not None:
+            searchstart = max(0, len(buffer) - searchwindowsize)
+        elif self.lookback is None:
+            searchstart = 0
+        else:
+            # A match can not start further back: one which starts before
+            # and ends in the data already searched was found then
+            reach = 0
+            if self._fresh_lookback is not None:
+                reach = freshlen + self._fresh_lookback
+            if self._end_lookback is not None:
+                reach = max(reach, self._end_lookback)
+            searchstart = max(0, len(buffer) - reach)
+
+        if self._regex is not None:
+            match = self._regex.search(buffer, searchstart)
+            if match is None:
+                return -1
+            best_index, s = self._groups[match.lastgroup]
+            # The same match, with the groups of the pattern itself
+            the_match = s.match(buffer, match.start())
+        else:
+            the_match = None
+            for index, s in self._searches:
+                match = s.search(buffer, searchstart)
+                if match is None:
+                    continue
+                if the_match is None or match.start() < the_match.start():
+                    the_match = match
+                    best_index = index
+            if the_match is None:
+                return -1
+        self.start = the_match.start()
+        self.match = the_match
+        self.end = the_match.end()
+        return best_index
@@ -5,6 +5,7 @@ import pty
 import tty
 import errno
 import signal
+import termios
 from contextlib import contextmanager
 
 import ptyprocess
@@ -37,7 +38,7 @@ class spawn(SpawnBase):
                  searchwindowsize=None, logfile=None, cwd=None, env=None,
                  ignore_sighup=False, echo=True, preexec_fn=None,
                  encoding=None, codec_errors='strict', dimensions=None,
-                 use_poll=False):
+                 use_poll=False, echo_sync=False):
         '''This is the constructor. The command parameter may be a string that
         includes a command and any arguments to the command. For example::
 
@@ -149,6 +150,19 @@ class spawn(SpawnBase):
         second (50 ms) seems to be enough to clear up the problem. You can set
         delaybeforesend to None to return to the old behavior.
 
+        With echo_sync=True, send() does not sleep. It writes as soon as the
+        terminal has ECHO off, waiting at most delaybeforesend for it. A
+        child reading a password turns echo off before it prints its prompt
+        (ssh, sudo, su and getpass do), and so does a shell with readline
+        (bash) before its prompt, while the commands it runs get the terminal
+        back with echo on. So echo off tells that the child is reading, and
+        the password is neither echoed nor flushed by the child setting up
+        the terminal. A child which reads with echo on still gets its input
+        after delaybeforesend, as before. The ECHO flag is read from the
+        terminal with tcgetattr(), so this costs a system call instead of a
+        sleep. It only tells anything if the child is the one turning echo
+        off, so do not call setecho(False) on a spawn with echo_sync.
+
         Note that spawn is clever about finding commands on your path.
         It uses the same logic that "which" uses to find executables.
 
@@ -203,6 +217,7 @@ class spawn(SpawnBase):
         else:
             self._spawn(command, args, preexec_fn, dimensions)
         self.use_poll = use_poll
+        self.echo_sync = echo_sync
 
     def __str__(self):
         '''This returns a human-readable string that represents the state of
@@ -361,14 +376,28 @@ class spawn(SpawnBase):
             timeout = self.timeout
         if timeout is not None:
             end_time = time.time() + timeout
+        # The child usually turns echo off within milliseconds, so the ECHO
+        # flag is checked often at first, then every 0.1 seconds
+        interval = 0.001
         while True:
             if not self.getecho():
                 return True
-            if timeout < 0 and timeout is not None:
-                return False
             if timeout is not None:
                 timeout = end_time - time.time()
-            time.sleep(0.1)
+                if timeout <= 0:
+                    return False
+            time.sleep(interval if timeout is None else min(interval, timeout))
+            interval = min(interval * 2, 0.1)
+
+    def is_reading(self):
+        '''This returns True if the terminal has ECHO off, which with
+        echo_sync tells that the child is reading and may be sent to at once.
+        See send().'''
+
+        try:
+            return not self.getecho()
+        except (IOError, OSError, termios.error):
+            return False
 
     def getecho(self):
         '''This returns the terminal echo mode. This returns True if echo is
@@ -536,7 +565,15 @@ class spawn(SpawnBase):
             >>> bash.sendline('x' * 5000)
         '''
 
-        if self.delaybeforesend is not None:
+        if self.echo_sync:
+            # Waits for the child to read, with echo off, instead of sleeping
+            delay = self.delaybeforesend or 0
+            if not self.is_reading() and delay > 0:
+                try:
+                    self.waitnoecho(delay)
+                except (IOError, OSError, termios.error):
+                    time.sleep(delay) # No ECHO flag to read on this platform
+        elif self.delaybeforesend is not None:
             time.sleep(self.delaybeforesend)
 
         s = self._coerce_send_string(s)
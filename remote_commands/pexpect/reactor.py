@@ -0,0 +1,217 @@
+'''A reactor which runs the expects of many spawns in one thread.
+
+Each spawn.expect() waits on its own file descriptor, and each read of
+spawn.read_nonblocking() checks isalive() with waitpid() and select()s the
+descriptor again before reading it. With hundreds of spawns that is a thread
+per spawn, or hundreds of system calls per round of reads. The Reactor
+instead waits on the descriptors of all its expects with one epoll_wait()
+(or poll() where there is no epoll), reads only the ones which are ready,
+feeds what it read to their Expecter, and calls back once an expect is over:
+
+    reactor = Reactor()
+    reactor.expect(child, searcher, on_prompt, timeout=30)
+    while reactor:
+        reactor.poll(reactor.get_wait())
+
+The callback of an expect gets the index of the pattern which matched, same
+as spawn.expect(), and the exc_info of the error it raised instead, if any
+(like EOF or TIMEOUT when they are not in the patterns). It may start the
+next expect of the same spawn, or of any other. Callbacks are only called from
+poll(): an expect which matches the data read before, or fails right away, is
+queued for the next poll() instead, so a callback starting expect after expect
+on buffered data loops in poll() rather than recursing. Other descriptors,
+like the pipes of a subprocess, can be watched with the same epoll_wait().
+
+It works with the spawns which read a file descriptor: spawn, spawnu and
+fdspawn.
+'''
+
+import collections
+import errno
+import select
+import sys
+import time
+
+from .exceptions import EOF, TIMEOUT
+from .expect import Expecter
+from .spawnbase import SpawnBase
+
+if hasattr(select, 'epoll'):
+    READ_EVENTS = (select.EPOLLIN | select.EPOLLPRI | select.EPOLLHUP |
+                   select.EPOLLERR)
+else:
+    READ_EVENTS = (select.POLLIN | select.POLLPRI | select.POLLHUP |
+                   select.POLLERR)
+
+
+class _Watch(object):
+    '''What the reactor does when a file descriptor is ready: an expect on
+    a spawn, or a callback of watch().'''
+
+    def __init__(self, fd, callback, expecter=None, deadline=None):
+        self.fd = fd
+        self.callback = callback
+        self.expecter = expecter
+        self.deadline = deadline
+
+
+class Reactor(object):
+    '''Runs the expects of many spawns, and watches other file descriptors,
+    with one epoll_wait() per poll(). Its truth value tells whether it has
+    anything left to wait for.'''
+
+    def __init__(self):
+        if hasattr(select, 'epoll'):
+            self._poller = select.epoll()
+        else:
+            self._poller = select.poll()
+        self._watches = {}  # file descriptor -> _Watch
+        # (callback, index, exc_info) of the expects which are over already
+        self._ready = collections.deque()
+
+    def __len__(self):
+        return len(self._watches) + len(self._ready)
+
+    def expect(self, spawn, searcher, callback, timeout=-1,
+               searchwindowsize=-1):
+        '''Starts an expect of 'searcher' (searcher_re, searcher_combined,
+        searcher_string or searcher_ac) on 'spawn', with the same 'timeout'
+        and 'searchwindowsize' as spawn.expect(). Once the expect is over,
+        calls callback(index, exc_info), with exc_info None unless the
+        expect raised, in which case index is None. The data read before is
+        searched first: if that is enough to end the expect, the callback
+        is called by the next poll(), which then does not wait.
+        '''
+
+        if timeout == -1:
+            timeout = spawn.timeout
+        expecter = Expecter(spawn, searcher, searchwindowsize)
+        incoming = spawn.buffer
+        spawn._buffer = spawn.buffer_type()
+        spawn._before = spawn.buffer_type()
+        try:
+            index = expecter.new_data(incoming)
+        except Exception:
+            expecter.errored()
+            return self._ready.append((callback, None, sys.exc_info()))
+        if index is not None:
+            return self._ready.append((callback, index, None))
+        deadline = time.time() + timeout if timeout is not None else None
+        self._add(_Watch(spawn.child_fd, callback, expecter, deadline))
+
+    def watch(self, fd, callback):
+        '''Calls callback(fd) whenever 'fd' is readable, or hung up, until
+        unwatch(fd).'''
+
+        self._add(_Watch(fd, callback))
+
+    def unwatch(self, fd):
+        watch = self._watches.pop(fd, None)
+        if watch is not None:
+            try:
+                self._poller.unregister(fd)
+            except (IOError, OSError, ValueError, KeyError):
+                pass # Closed already, which unregistered it
+
+    def get_wait(self):
+        '''Returns the seconds until the next expect times out, 0 if some
+        are over already, or None if none of them has a timeout.'''
+
+        if self._ready:
+            return 0
+        deadlines = [watch.deadline for watch in self._watches.values()
+                     if watch.deadline is not None]
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - time.time())
+
+    def poll(self, timeout=None):
+        '''Waits upto 'timeout' seconds (None for as long as it takes) for
+        the watched file descriptors, reads the spawns which are ready, and
+        times out the expects which are due. The expects which were over
+        already are called back first, without waiting. Returns the number
+        of file descriptors which were ready.'''
+
+        if self._ready:
+            self._call_ready()
+            timeout = 0
+        try:
+            if hasattr(select, 'epoll'):
+                events = self._poller.poll(-1 if timeout is None else timeout)
+            else:
+                events = self._poller.poll(
+                    None if timeout is None else int(timeout * 1000 + 0.999))
+        except (IOError, OSError, select.error) as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            events = []
+        # The watches of the events, taken before any callback can end them
+        # or start new ones on a reused file descriptor
+        ready = [self._watches.get(fd) for fd, event in events]
+        for watch in ready:
+            if watch is None or self._watches.get(watch.fd) is not watch:
+                continue
+            if watch.expecter is None:
+                watch.callback(watch.fd)
+            else:
+                self._read(watch)
+        now = time.time()
+        for watch in list(self._watches.values()):
+            if (watch.deadline is not None and watch.deadline <= now and
+                    self._watches.get(watch.fd) is watch):
+                self._timeout(watch)
+        return len(events)
+
+    def close(self):
+        for fd in list(self._watches):
+            self.unwatch(fd)
+        self._ready.clear()
+        if hasattr(self._poller, 'close'):
+            self._poller.close()
+
+    def _call_ready(self):
+        # The callbacks queue the expects they start which are over already,
+        # and those are called back in this same loop
+        while self._ready:
+            callback, index, error = self._ready.popleft()
+            callback(index, error)
+
+    def _add(self, watch):
+        if watch.fd in self._watches:
+            raise ValueError('File descriptor %d is watched already' %
+                             watch.fd)
+        self._poller.register(watch.fd, READ_EVENTS)
+        self._watches[watch.fd] = watch
+
+    def _read(self, watch):
+        expecter = watch.expecter
+        spawn = expecter.spawn
+        try:
+            try:
+                # The descriptor is ready, so it is read without checking
+                # isalive() and select()ing it again: a child which exited
+                # gives EOF here, as EIO or an empty read
+                data = SpawnBase.read_nonblocking(spawn, spawn.maxread)
+            except EOF as e:
+                index = expecter.eof(e)
+            else:
+                index = expecter.new_data(data)
+                if index is None:
+                    return
+        except EOF:
+            return self._finish(watch, None, sys.exc_info())
+        except Exception:
+            expecter.errored()
+            return self._finish(watch, None, sys.exc_info())
+        self._finish(watch, index, None)
+
+    def _timeout(self, watch):
+        try:
+            index = watch.expecter.timeout()
+        except TIMEOUT:
+            return self._finish(watch, None, sys.exc_info())
+        self._finish(watch, index, None)
+
+    def _finish(self, watch, index, error):
+        self.unwatch(watch.fd)
+        watch.callback(index, error)
@@ -5,7 +5,7 @@ import sys
 import re
 import errno
 from .exceptions import ExceptionPexpect, EOF, TIMEOUT
-from .expect import Expecter, searcher_string, searcher_re
+from .expect import Expecter, searcher_exact, searcher_string, searcher_re, searcher_combined
 
 PY3 = (sys.version_info[0] >= 3)
 text_type = str if PY3 else unicode
@@ -361,7 +361,7 @@ class SpawnBase(object):
         if kw:
             raise TypeError("Unknown keyword arguments: {}".format(kw))
 
-        exp = Expecter(self, searcher_re(pattern_list), searchwindowsize)
+        exp = Expecter(self, searcher_combined(pattern_list), searchwindowsize)
         if async_:
             from ._async import expect_async
             return expect_async(exp, timeout)
@@ -410,7 +410,7 @@ class SpawnBase(object):
             self._pattern_type_err(pattern_list)
         pattern_list = [prepare_pattern(p) for p in pattern_list]
 
-        exp = Expecter(self, searcher_string(pattern_list), searchwindowsize)
+        exp = Expecter(self, searcher_exact(pattern_list), searchwindowsize)
         if async_:
             from ._async import expect_async
             return expect_async(exp, timeout)
@@ -419,7 +419,8 @@ class SpawnBase(object):
 
     def expect_loop(self, searcher, timeout=-1, searchwindowsize=-1):
         '''This is the common loop used inside expect. The 'searcher' should be
-        an instance of searcher_re or searcher_string, which describes how and
+        an instance of searcher_re, searcher_combined, searcher_string or
+        searcher_ac, which describes how and
         what to search for in the input.
 
         See expect() for other arguments, return value and exceptions. '''
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+########################################################################################
+# For any questions or suggestions please contact : Ajmal Yusuf <ayusuf@hortonworks.com>
+########################################################################################
+
+'''
+Reads and writes the execution plans of remote.py: a config with all its variables resolved and its steps
+validated and expanded into hosts and commands, which can be applied later without resolving it again.
+
+A plan file has one JSON document per line. The first line is the header:
+    { "plan" : version, "run_id" : ..., "credentials" : { id : { "name", "username", "hosts" } } }
+followed by one line per step:
+    { "index" : position in main, "name" : step name, "action" : ..., ... }
+so the steps can be applied while the file is read.
+
+The values of the credential variables (password) are not written to the plan. Each distinct value is
+replaced by a reference like __RC_CREDENTIAL_1__, which is replaced by the value again when applied. So is
+the run_id, unless it was given, so that each apply of a plan has its own run_id.
+
+PlanCache keeps the plans of the configs run with --plan-cache, by the hash of everything they are resolved
+from, so that running an unchanged config again skips resolving it.
+'''
+
+import os
+import re
+import json
+import hashlib
+import tempfile
+
+version = 1
+
+run_id_reference = '__RC_RUN_ID__'
+
+# Variables whose values are written to a plan as references
+credential_names = ['password']
+credential_format = '__RC_CREDENTIAL_{0}__'
+credential_regex = re.compile('__RC_CREDENTIAL_(\d+)__')
+# The references inserted in one pass, so that a value inserted is not searched for references again
+reference_regex = re.compile('__RC_CREDENTIAL_(\d+)__|' + run_id_reference)
+
+class Credentials(object):
+    '''The references of the credentials of a plan: value -> id, and id -> description. The values known up
+    front are numbered in sorted order, so the same values always get the same ids'''
+    def __init__(self, values=()):
+        self.ids = {}
+        self.descriptions = {}
+        for value in sorted(set(values)):
+            self.reference(credential_names[0], value)
+
+    def get_values(self):
+        '''Returns { id : value }'''
+        return dict((credential_id, value) for value, credential_id in self.ids.items())
+
+    def reference(self, name, value, username=None):
+        '''Returns the reference of a credential value'''
+        if not isinstance(value, basestring) or credential_regex.match(value):
+            return value
+        if value not in self.ids:
+            credential_id = str(len(self.ids) + 1)
+            self.ids[value] = credential_id
+            self.descriptions[credential_id] = { 'name' : name, 'username' : None, 'hosts' : 0 }
+        description = self.descriptions[self.ids[value]]
+        if username and not description['username']:
+            description['username'] = username
+        return credential_format.format(self.ids[value])
+
+    def reference_variables(self, variables):
+        '''Replaces the credential values of the variables of remote.load_variables() ({ name : values },
+        where the values of a group are dicts) by references, before they are resolved into commands'''
+        usernames = variables.get('username', [])
+        plain_username = usernames[0] if len(usernames) == 1 and isinstance(usernames[0], basestring) else None
+        for name in variables:
+            for index, element in enumerate(variables[name]):
+                if isinstance(element, dict):
+                    for key in element:
+                        if key in credential_names:
+                            element[key] = self.reference(key, element[key], element.get('username'))
+                elif name in credential_names:
+                    variables[name][index] = self.reference(name, element, plain_username)
+
+    def reference_host(self, var):
+        '''Replaces the credential values of the resolved parameters of a host by references, and counts the
+        host for each of its credentials'''
+        for name in credential_names:
+            if name in var:
+                var[name] = self.reference(name, var[name], var.get('username'))
+                match = credential_regex.match(var[name])
+                if match:
+                    self.descriptions[match.group(1)]['hosts'] += 1
+        return var
+
+def insert_values(item, values, run_id):
+    '''Returns a copy of item (a step of a plan) with the credential references replaced by their values
+    from { id : value }, and the run_id reference by run_id'''
+    if isinstance(item, dict):
+        return dict((key, insert_values(value, values, run_id)) for key, value in item.items())
+    elif isinstance(item, list):
+        return [insert_values(value, values, run_id) for value in item]
+    elif isinstance(item, basestring) and '__RC_' in item:
+        return reference_regex.sub(lambda match: values[match.group(1)] if match.group(1) else run_id, item)
+    return item
+
+def write_plan(filename, run_id, credentials, steps):
+    '''Writes the header and the steps (an iterable of dicts) of a plan. Returns the number of steps'''
+    count = 0
+    with open(filename, 'w') as plan_file:
+        header = { 'plan' : version, 'run_id' : run_id, 'credentials' : credentials.descriptions }
+        plan_file.write(json.dumps(header, separators=(',', ':')) + '\n')
+        for step in steps:
+            plan_file.write(json.dumps(step, separators=(',', ':')) + '\n')
+            count += 1
+    return count
+
+def read_plan(filename):
+    '''Returns the header of a plan and a generator of its steps, which reads them as they are needed'''
+    plan_file = open(filename)
+    header = json.loads(plan_file.readline())
+    if not isinstance(header, dict) or header.get('plan') != version:
+        plan_file.close()
+        raise ValueError('Not a plan file of version {0}'.format(version))
+    def get_steps():
+        with plan_file:
+            for line in plan_file:
+                if line.strip():
+                    yield json.loads(line)
+    return header, get_steps()
+
+def get_cache_key(config, variables, credentials):
+    '''Returns the hash of what a plan is resolved from: the steps of the config and its variables, after the
+    defaults, the overrides and the prompts, with the credential values replaced by their references'''
+    def reference(name, value):
+        if name.rsplit('.', 1)[-1] not in credential_names:
+            return value
+        if isinstance(value, list):
+            return [reference(name, item) for item in value]
+        if isinstance(value, basestring) and value in credentials.ids:
+            return credential_format.format(credentials.ids[value])
+        return value
+    steps = dict((name, step) for name, step in config.items() if name != 'variables')
+    for name in steps:
+        if isinstance(steps[name], dict):
+            steps[name] = dict((key, reference(key, value)) for key, value in steps[name].items())
+    inputs = { 'plan' : version, 'steps' : steps,
+               'variables' : dict((name, reference(name, value)) for name, value in variables.items()) }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True)).hexdigest()
+
+class PlanCache(object):
+    '''Plan files in a directory, named by their cache key. Once they take more than max_bytes, the least
+    recently used ones are removed'''
+    def __init__(self, directory, max_bytes):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key + '.plan')
+
+    def get(self, key):
+        '''Returns the path of the plan of key, or None if it is not cached'''
+        path = self.get_path(key)
+        try:
+            os.utime(path, None) # The modification time is the last use
+            return path
+        except OSError:
+            return None
+
+    def put(self, key, run_id, credentials, steps):
+        '''Writes the plan of key and returns its path'''
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, 0o700)
+        handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        os.close(handle)
+        try:
+            write_plan(temp_path, run_id, credentials, steps)
+            os.rename(temp_path, self.get_path(key))
+        except:
+            os.remove(temp_path)
+            raise
+        self.evict(self.get_path(key))
+        return self.get_path(key)
+
+    def remove(self, key):
+        try:
+            os.remove(self.get_path(key))
+        except OSError:
+            pass
+
+    def evict(self, keep=None):
+        '''Removes the least recently used plans until they take at most max_bytes, except keep'''
+        plans = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.plan') and path != keep:
+                try:
+                    stat = os.stat(path)
+                    plans.append((stat.st_mtime, stat.st_size, path))
+                except OSError:
+                    pass
+        total = sum(size for mtime, size, path in plans)
+        if keep and os.path.exists(keep):
+            total += os.path.getsize(keep)
+        for mtime, size, path in sorted(plans):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+########################################################################################
+# For any questions or suggestions please contact : Ajmal Yusuf <ayusuf@hortonworks.com>
+########################################################################################
+
+'''
+Probes the ssh port of the hosts of an action at the same time, with non-blocking sockets and a short
+deadline, so that the hosts which are down are found at once instead of each of them holding up the run
+for timeout_secs. A host reached through a jump host is probed at its jump host, which is what ssh
+connects to.
+'''
+
+import os
+import re
+import time
+import errno
+import shlex
+import socket
+import select
+import collections
+import threading
+
+import admission
+
+DEFAULT_PORT = 22
+MAX_SOCKETS = 256    # Sockets connecting at the same time, to stay well within the limit of open files
+RESOLVE_THREADS = 32 # Threads resolving the hostnames, as getaddrinfo() blocks
+
+# -p 2222, -p2222, -o Port=2222, -oPort 2222
+port_regex = re.compile(r'(?:^|\s)(?:-p\s*|-o\s*Port[=\s]\s*)(\d+)(?:\s|$)', re.IGNORECASE)
+# -o ProxyCommand=..., -o ControlPath=...
+proxy_command_regex = re.compile(r'(?:^|\s)-o\s*ProxyCommand[=\s]\s*(\S+)', re.IGNORECASE)
+control_path_regex = re.compile(r'(?:^|\s)-o\s*ControlPath[=\s]\s*(\S+)', re.IGNORECASE)
+
+def get_port(options):
+    '''Returns the ssh port of the options of a host'''
+    match = port_regex.search(options or '')
+    return int(match.group(1)) if match else DEFAULT_PORT
+
+def get_target(hostname, options):
+    '''Returns the (hostname, port) which ssh connects to for a host with the options: its first jump host
+    (-J or -o ProxyJump) if it has one, else the host itself. Returns None if there is nothing to probe: the
+    connection goes through a ProxyCommand, or over a ControlMaster whose socket exists already'''
+    try:
+        # Without the quotes of the options, like -o "ProxyCommand=ssh -W %h:%p jump"
+        options = ' '.join(shlex.split(options or ''))
+    except ValueError:
+        options = options or ''
+    match = proxy_command_regex.search(options)
+    if match and match.group(1).lower() != 'none':
+        return None
+    match = control_path_regex.search(options)
+    if match and os.path.exists(os.path.expanduser(match.group(1))):
+        return None
+    jump = admission.get_jump(options)
+    if jump:
+        return jump[0], jump[1] or DEFAULT_PORT
+    return hostname, get_port(options)
+
+def resolve(targets, deadline):
+    '''Returns { (hostname, port) : sockaddr tuple, or the reason it could not be resolved }'''
+    addresses = {}
+    pending = list(set(targets))
+    lock = threading.Lock()
+    def worker():
+        while time.time() < deadline:
+            with lock:
+                if not pending:
+                    return
+                target = pending.pop()
+            try:
+                family, socktype, proto, name, address = socket.getaddrinfo(target[0], target[1], 0,
+                                                                            socket.SOCK_STREAM)[0]
+                result = (family, address)
+            except socket.gaierror as e:
+                result = 'Unknown host: {0}'.format(e.args[-1])
+            with lock:
+                addresses[target] = result
+    threads = [threading.Thread(target=worker) for index in range(min(RESOLVE_THREADS, len(pending)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join(max(deadline - time.time(), 0))
+    with lock:
+        return dict((target, addresses.get(target, 'Not resolved in time')) for target in set(targets))
+
+def probe(targets, timeout):
+    '''Connects to each (hostname, port) at the same time, upto MAX_SOCKETS at a time, each within timeout
+    seconds. Returns { (hostname, port) : None if it accepted the connection, else the reason it did not }'''
+    results = {}
+    connecting = []
+    for target, address in resolve(targets, time.time() + timeout).items():
+        if isinstance(address, tuple):
+            connecting.append((target, address))
+        else:
+            results[target] = address
+    results.update(probe_addresses(connecting, timeout))
+    return results
+
+def probe_addresses(connecting, timeout):
+    '''Keeps upto MAX_SOCKETS of the addresses connecting, starting the next one as soon as one is done. Each
+    has timeout seconds from its start, so the hosts which drop the connection do not use up the time of the
+    hosts after them'''
+    results = {}
+    sockets = {}
+    pending = collections.deque(connecting)
+    poller = select.poll()
+    try:
+        while pending or sockets:
+            while pending and len(sockets) < MAX_SOCKETS:
+                target, (family, address) = pending.popleft()
+                sock = socket.socket(family, socket.SOCK_STREAM)
+                sock.setblocking(0)
+                code = sock.connect_ex(address)
+                if code in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+                    sockets[sock.fileno()] = (target, sock, time.time() + timeout)
+                    poller.register(sock, select.POLLOUT | select.POLLERR | select.POLLHUP)
+                else:
+                    results[target] = os.strerror(code)
+                    sock.close()
+            now = time.time()
+            for fd, (target, sock, deadline) in list(sockets.items()):
+                if deadline <= now:
+                    del sockets[fd]
+                    poller.unregister(fd)
+                    results[target] = 'No response in time'
+                    sock.close()
+            if not sockets:
+                continue
+            remaining = min(deadline for target, sock, deadline in sockets.values()) - now
+            for fd, event in poller.poll(max(remaining, 0) * 1000):
+                target, sock, deadline = sockets.pop(fd)
+                poller.unregister(fd)
+                code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                results[target] = os.strerror(code) if code else None
+                sock.close()
+    finally:
+        for target, sock, deadline in sockets.values():
+            results[target] = 'No response in time'
+            sock.close()
+    return results
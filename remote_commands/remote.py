@@ -13,8 +13,29 @@ import logging
 import datetime
 import pexpect
 import getpass
+import timings
+import templates
+import plans
+import journal
+import preflight
+import admission
+import latency
 import argparse
 import itertools
+import collections
+import threading
+import Queue
+import select
+import errno
+import types
+import time
+import signal
+import shutil
+import tempfile
+import random
+import base64
+import shlex
+import subprocess
 
 '''
 sshuser@hn0-lazhuh:~$
@@ -26,6 +47,39 @@ new_patt =  '\[?(.+)@([^\]\:\$\#\~\s]+)[\]\:\$\#\~\s]+\s+'
 # ==================================================
 version = '1.1'
 default_live_run = False
+run_options = {
+    'parallel' : 1,     # Number of hosts an ssh action runs on at the same time. 0 means all hosts
+    'engine' : 'thread', # 'thread' runs each parallel host in a worker thread, 'async' runs all of them in one thread
+    'reuse_sessions' : False, # Keep the ssh connections open and reuse them in the later ssh actions of the run
+    'multiplex' : False, # Open one OpenSSH ControlMaster per host and run the ssh, scp and local actions over it
+    'completion' : 'sentinel', # How the end of a command is found. 'sentinel' or 'prompt' (the shell_prompt regex)
+    'batch' : False, # Send all the commands of a ssh action to a host at once, as one script
+    'exec' : False, # Run each command of a ssh action with 'ssh host command' without a pty (key or agent auth)
+    'timings' : False, # Print how long each phase (connecting, commands, transfers...) took, per host
+    'timings_file' : None, # Also write the timings as JSON to this file
+    'plan_cache' : False, # Keep the plan of each config and skip resolving it when it is run again unchanged
+    'plan_cache_dir' : '~/.remote_commands/plans', # Directory of the cached plans
+    'plan_cache_mb' : 100, # The least recently used plans are removed once the cache takes more than this
+    'journal' : None, # Record the outcome of each command and host of a live run in the journal of its run_id, to
+                      # resume it later. None records it for a resumed run only, which carries on its journal
+    'journal_dir' : '~/.remote_commands/journals', # Directory of the journals
+    'resume' : None, # run_id of a run to resume: the hosts and local commands it completed are skipped
+    'rerun_failed' : None, # run_id of a run whose failed hosts and local commands are run again
+    'preflight' : False, # Probe the ssh port of the hosts of each ssh and scp action at once and skip the dead ones
+    'preflight_secs' : 3, # Seconds the hosts have to accept the connection of the preflight
+    'connect_rate' : 0, # New ssh connections started per second, in bursts of upto connect_burst. 0 for no limit
+    'connect_burst' : 0, # New ssh connections started at once within connect_rate. 0 for connect_rate
+    'max_startups' : 10, # Handshakes in flight to the same host or jump host, like sshd MaxStartups. 0 for no limit
+    'connect_retries' : 3, # Retries of a ssh connection reset before the banner
+    'connect_backoff_secs' : 0.5, # Base of the jittered exponential backoff between the retries
+    'adaptive_timeouts' : False, # Learn the timeouts of connecting to each host from its history, extended upto timeout_secs
+    'latency_file' : '~/.remote_commands/latency.json', # History of how long each host took to connect
+    'min_timeout_secs' : 3, # Shortest timeout learned from the history
+    'prompt_tail_bytes' : 1024, # A prompt regex anchored at the end but of unknown length is looked for in this many last bytes
+    'echo_sync' : True # Send as soon as the tty has echo off (the shell or a password prompt is reading) instead of sleeping
+}
+engines = ['thread', 'async']
+completions = ['sentinel', 'prompt']
 default_variables = {
     'shell' : 'bash',
     'timeout_secs' : 60,
@@ -41,11 +95,52 @@ scp_format = {
     'send' : "{shell} -c 'scp -r {options} {source} {username}@{hostname}:{target_dir}'"
 }
 ssh_format = 'ssh {options} {username}@{hostname}'
+exec_format = 'ssh {options} -o BatchMode=yes {username}@{hostname}'
+master_format = 'ssh {options} -o ControlMaster=auto -o ControlPath={control_path} ' \
+                '-o ControlPersist={persist_secs} {username}@{hostname} true'
+master_exit_format = 'ssh -o ControlPath={control_path} -O exit {username}@{hostname}'
+# Makes ssh print established_marker on its stdout once it is authenticated, before the command of --exec starts
+established_marker = '__RC_established__'
+established_options = ['-o', 'PermitLocalCommand=yes', '-o', 'LocalCommand=echo ' + established_marker]
+# Makes bash count the commands and end its prompt with __RC_<token>_<count>_<exit status>__
+sentinel_format = "__rc_tok={token}; if [ -n \"$BASH_VERSION\" ]; then __rc_n=0; " \
+                  "PROMPT_COMMAND='__rc=$?; __rc_n=$((__rc_n+1))'\"${{PROMPT_COMMAND:+; $PROMPT_COMMAND}}\"; " \
+                  "PS1=\"$PS1\"'__RC_${{__rc_tok}}_${{__rc_n}}_${{__rc}}__'; echo __RC_ok_$__rc_tok; " \
+                  "else echo __RC_no_$__rc_tok; fi"
+# A batch of commands is sent base64 encoded and run in the login shell, keeping its state (like 'cd'). The
+# payload is sent in lines of BATCH_LINE_CHARS, as a tty in canonical mode drops what goes beyond its line
+# limit (4095 characters on Linux, 1024 on the BSDs), and is then eval'd from the variable it was added to
+batch_first_line_format = '__rc_batch={chunk}'
+batch_line_format = '__rc_batch=${{__rc_batch}}{chunk}'
+batch_format = 'eval "$(echo $__rc_batch | base64 -d)"'
+batch_start_format = "unset __rc_batch\nprintf '__RC_%s_start__\\n' {token}\n"
+batch_command_format = "{command}\nprintf '__RC_%s_%d_%d__\\n' {token} {index} $?\n"
 # ==================================================
 
 space_regex = re.compile('\s')
 var_regex = re.compile('({[ \t]*(\w+)[ \t]*})')
-NO_RECURSIONS = 10
+SESSION_CHECK_SECS = 5
+
+MASTER_PERSIST_SECS = 600
+
+BATCH_LINE_CHARS = 900 # Characters of the base64 batch per line sent to the shell, within any tty line limit
+
+# Set by execute() when connections are reused between the actions (--reuse-sessions)
+session_pool = None
+# Set by execute() when the connections are multiplexed over a ControlMaster per host (--multiplex)
+multiplexer = None
+# Set by execute() when the phases of the run are timed (--timings)
+phase_timings = None
+# Set by execute() to admit the new ssh connections (--connect-rate, --max-startups)
+admission_control = None
+# Set by execute() when the timeouts are learned (--adaptive-timeouts)
+latency_history = None
+# Set by execute() for a live run with --journal, or a resumed one
+run_journal = None
+# Set by execute() to the units of the journal of the run being resumed (--resume or --rerun-failed)
+journal_units = None
+# Name of the step being run, for the journal
+current_step = None
 
 action_mandatory_params = {
     "ssh" : ['timeout_secs', 'hostname', 'username', 'password', 'password_prompt',
@@ -57,6 +152,12 @@ action_mandatory_params = {
     "local" : ['shell']
 }
 
+# Optional step keys which control how an action is run. These are not resolved as variables
+step_options = {
+    "ssh" : ['parallel', 'batch', 'exec', 'preflight'],
+    "scp" : ['preflight']
+}
+
 params_error_messages = {
     "{username}" : "'username' not provided. You may pass it as -u/--username parameter OR " \
                    "\nconfigure 'username' in the 'default_properties.json' file.",
@@ -112,21 +213,33 @@ def dump_json(output, filename):
         double_colored_print('Unable to write JSON config file: ', filename, tcolors.FAIL, tcolors.WARNING)
         colored_print('Reason: {0}'.format(str(e)), tcolors.FAIL)
 
+# Output of a host running in a worker thread is collected here and printed in one piece
+output_buffer = threading.local()
+output_lock = threading.Lock()
+
+def write_output(message, flush=False):
+    buffered = getattr(output_buffer, 'messages', None)
+    if buffered is not None:
+        buffered.append(message)
+        return
+    sys.stdout.write(message)
+    if flush:
+        sys.stdout.flush()
+
 def colored_print_without_newline(message, color):
     if platform.system() == 'Windows':
         color = ''
-    sys.stdout.write(color + message + tcolors.ENDC)
-    sys.stdout.flush()
+    write_output(color + message + tcolors.ENDC, flush=True)
 
 def colored_print(message, color):
     if platform.system() == 'Windows':
         color = ''
-    sys.stdout.write(color + message + tcolors.ENDC + '\n')
+    write_output(color + message + tcolors.ENDC + '\n')
 
 def double_colored_print(f_msg, s_msg, f_color, s_color):
     if platform.system() == 'Windows':
         f_color, s_color  = '', ''
-    sys.stdout.write( f_color + f_msg + tcolors.ENDC + s_color + s_msg + tcolors.ENDC + '\n' )
+    write_output( f_color + f_msg + tcolors.ENDC + s_color + s_msg + tcolors.ENDC + '\n' )
 
 def load_config(config_json_file):
     try:
@@ -180,7 +293,7 @@ def get_timeout_secs(timeout_value):
                              '{0} secs...'.format(default_variables['timeout_secs']), tcolors.FAIL, tcolors.LGREEN)
         return default_variables['timeout_secs']
 
-def populate_defaults(config):
+def populate_defaults(config, prompt_credentials=True):
     def present(variable):
         for key in clean_variables:
             if key == variable or key.endswith('.' + variable):
@@ -195,6 +308,8 @@ def populate_defaults(config):
                     value = default_variables['password']
 
             if value.startswith((':p?', ':pp?')):
+                if not prompt_credentials and key.rsplit('.', 1)[-1] in plans.credential_names:
+                    return value # Asked for when the plan is applied
                 value = prompt(value, 'Enter the value for {0}{1}{2} [exit]: '.format(tcolors.BOLD, key, tcolors.NORMAL))
         return value 
     def insert_into_variables_if_not_present(key, value):
@@ -245,58 +360,125 @@ def generate_run_id():
     utc_datetime = datetime.datetime.utcnow()
     return utc_datetime.strftime('RID_%Y%m%d_%H%M%S_UTC')
 
-def load_variables(config):
-    run_id, variables = populate_defaults(config)
+def load_variables(config, prompt_credentials=True):
+    '''Returns the run id, the names of the variables, the variables as { name : list of values }, where the
+    values of a group are dicts, and their dependencies from get_dependencies(). The combinations of the
+    values are expanded per step by expand_variables()'''
+    run_id, variables = populate_defaults(config, prompt_credentials)
+    return (run_id,) + index_variables(variables)
+
+def index_variables(variables):
+    '''Returns the names, the values by variable or group and the dependencies of the variables of
+    populate_defaults()'''
     variable_names, dict_variables = convert_group_list_to_dict(variables)
-    variable_values = cartesian_product(dict_variables)
-
-    for variable in variable_values:
-        for value in variable:
-            if isinstance(variable[value], (str, unicode)):
-                depth = 0
-                while var_regex.search(variable[value]):
-                    if depth == NO_RECURSIONS:
-                        double_colored_print('Unable to resolve the parameter: ', variable[value], tcolors.FAIL, tcolors.WARNING)
-                        colored_print('Reason: Potential cyclic dependency.  Exiting...\n', tcolors.FAIL)
-                        sys.exit(1)
-                    try:
-                        variable[value] = format(variable[value], variable)
-                    except KeyError as ke:
-                        parameter_name = '{' + str(ke.args[0]) + '}'
-                        double_colored_print('Unable to resolve the variable: ', value + ' = "' + variable[value] + '"', tcolors.FAIL, tcolors.WARNING)
-                        double_colored_print('Undefined variable: ', parameter_name, tcolors.FAIL, tcolors.WARNING)
-                        if parameter_name in params_error_messages:
-                            colored_print(params_error_messages[parameter_name], tcolors.NORMAL)
-                        colored_print('Exiting...\n', tcolors.FAIL)
-                        sys.exit(1)
-                    depth += 1
-    return run_id, variable_names, variable_values
-
-def cartesian_product(variables):
-    keylist = []
-    valuelist = []
-    for i in variables:
-        keylist.append(i)
-        if isinstance(variables[i], list):
-            valuelist.append(variables[i])
-        else:
-            valuelist.append([ variables[i] ])
-    var_list = []
+    dependencies = get_dependencies(dict_variables, variable_names)
+    return variable_names, dict_variables, dependencies
+
+def get_providers(variables):
+    '''Returns { variable name : name of the variable or group providing its values }. A variable of a group
+    is preferred over a variable of the same name outside it'''
+    providers = {}
+    for name in variables:
+        if variables[name] and isinstance(variables[name][0], dict):
+            for key in variables[name][0]:
+                providers[key] = name
+        elif name not in providers:
+            providers[name] = name
+    return providers
+
+def get_values(variables, providers, key):
+    for element in variables[providers[key]]:
+        yield element[key] if isinstance(element, dict) else element
+
+def is_template(value):
+    return isinstance(value, (str, unicode)) and var_regex.search(value) is not None
+
+def get_dependencies(variables, variable_names):
+    '''Returns the variables referenced by the values of each variable, as an OrderedDict in the order they
+    are resolved: every variable after the ones it references. Exits on a reference to an undefined variable
+    or on a cycle, before any host is contacted'''
+    providers = get_providers(variables)
+    references = {}
+    for key in providers:
+        references[key] = []
+        for value in get_values(variables, providers, key):
+            if not is_template(value):
+                continue
+            for field in templates.get_fields(value):
+                if field not in variable_names:
+                    exit_unresolved(key, value, field)
+                if field not in references[key]:
+                    references[key].append(field)
+
+    dependencies = collections.OrderedDict()
+    path = []
+    def visit(key):
+        if key in dependencies:
+            return
+        if key in path:
+            cycle = path[path.index(key):] + [key]
+            double_colored_print('Unable to resolve the variables: ', ' -> '.join(cycle), tcolors.FAIL, tcolors.WARNING)
+            colored_print('Reason: Cyclic dependency.  Exiting...\n', tcolors.FAIL)
+            sys.exit(1)
+        path.append(key)
+        for field in references[key]:
+            visit(field)
+        path.pop()
+        dependencies[key] = references[key]
+    for key in sorted(references):
+        visit(key)
+    return dependencies
+
+def exit_unresolved(name, value, parameter):
+    parameter_name = '{' + parameter + '}'
+    double_colored_print('Unable to resolve the variable: ', name + ' = "' + value + '"', tcolors.FAIL, tcolors.WARNING)
+    double_colored_print('Undefined variable: ', parameter_name, tcolors.FAIL, tcolors.WARNING)
+    if parameter_name in params_error_messages:
+        colored_print(params_error_messages[parameter_name], tcolors.NORMAL)
+    colored_print('Exiting...\n', tcolors.FAIL)
+    sys.exit(1)
+
+def get_projection(params, variables, dependencies):
+    '''Returns the names of the variables (or groups) to expand for params, and the variables to resolve, in
+    the order to resolve them: params and every variable they reference, transitively'''
+    providers = get_providers(variables)
+    keys = set()
+    pending = [param for param in params if param in dependencies]
+    while pending:
+        key = pending.pop()
+        if key not in keys:
+            keys.add(key)
+            pending.extend(dependencies[key])
+    names = set(providers[key] for key in keys)
+    return [name for name in variables if name in names], [key for key in dependencies if key in keys]
+
+def expand_variables(params, variables, dependencies):
+    '''Lazily yields the resolved combinations of the values needed by params. Only the variables params
+    depend on are expanded, so the other variables do not multiply the combinations of a step. The values
+    are resolved in one pass, in the order of dependencies'''
+    names, keys = get_projection(params, variables, dependencies)
+    templated = [key for key in keys if dependencies[key]]
+    valuelist = [variables[name] for name in names]
     for elements in itertools.product(*valuelist):
         item = {}
         for index, element in enumerate(elements):
             if isinstance(element, dict):
-                for key in element:
-                    item[key] = element[key]
+                for key in keys:
+                    if key in element:
+                        item[key] = element[key]
             else:
-                if keylist[index] not in item: # Give preference to item in dict
-                    item[keylist[index]] = element
-        var_list.append(item)
-    return var_list
+                item[names[index]] = element
+        for key in templated:
+            if is_template(item[key]):
+                try:
+                    item[key] = format(item[key], item)
+                except KeyError as ke:
+                    exit_unresolved(key, item[key], str(ke.args[0]))
+        yield item
 
 # If you need to change the str formatting later
 def format(format_str, variables):
-    return format_str.format(**variables)
+    return templates.render(format_str, variables)
 
 def trim_cr(input_str):
     if isinstance(input_str, str):
@@ -310,14 +492,23 @@ def remote_scp(var, timeout):
     if not default_live_run:
         double_colored_print('Command: ', command, tcolors.BOLD, tcolors.WARNING)
         return
+    if multiplexer:
+        run_session(open_master_session(var, timeout))
+        var = multiplexer.connected(var)
+        command = format(scp_format[var['direction'].lower()], var)
     double_colored_print('Transferring... ', command, tcolors.BOLD, tcolors.WARNING)
+    started = timings.monotonic()
     try:
-        connection = pexpect.spawn(command, timeout=timeout)
-        connection.expect(var['password_prompt'])
-        connection.sendline(var['password'])
+        connection = pexpect.spawn(command, timeout=timeout, echo_sync=is_true(run_options['echo_sync']))
+        # No password is asked when the transfer runs over a master connection
+        patterns = [var['progress_prompt'], pexpect.EOF, pexpect.TIMEOUT, var['password_prompt']]
         while True:
-            ret = connection.expect([var['progress_prompt'], pexpect.EOF, pexpect.TIMEOUT], timeout=timeout)
-            if ret == 0:
+            ret = connection.expect(patterns, timeout=timeout)
+            if ret == 3:
+                connection.sendline(var['password'])
+                patterns = patterns[:3]
+                continue
+            elif ret == 0:
                 colored_print_without_newline('\r{0}{1}'.format(connection.before, connection.after), tcolors.LCYAN)
                 continue
             elif ret == 1:
@@ -330,36 +521,445 @@ def remote_scp(var, timeout):
     except Exception as e:
         colored_print('Unable to scp: {0}'.format(str(e)), tcolors.FAIL)
         return False
+    finally:
+        record_phase(var['hostname'], 'scp', started)
 
-def expect_spawn(var, timeout):
+def record_phase(hostname, phase, started):
+    '''Records the time since started (from timings.monotonic()) for the phase, if the run is timed, and in
+    the latency history of the host'''
+    seconds = timings.monotonic() - started
+    if phase_timings:
+        phase_timings.record(hostname, phase, seconds)
+    if latency_history and phase in latency.phases:
+        latency_history.record(hostname, phase, seconds)
+
+def get_phase_timeout(hostname, phase, timeout):
+    '''Returns the timeout of a phase of connecting to the host, learned from its latency history within
+    timeout (timeout_secs)'''
+    if not latency_history:
+        return timeout
+    return latency_history.get_timeout(hostname, phase, float(run_options['min_timeout_secs']), timeout)
+
+def expect_phase_session(connection, patterns, hostname, phase_timeout, timeout):
+    '''Expects the patterns of a phase of connecting within its timeout learned from the history of the host.
+    Once that expires the host is only slower than usual, so the expect goes on upto timeout (timeout_secs)
+    before the host is given up on. Returns the index of the pattern matched'''
+    try:
+        ret = yield Expect(connection, patterns, timeout=phase_timeout)
+    except pexpect.TIMEOUT:
+        if phase_timeout >= timeout:
+            raise
+        colored_print('No answer after {0:.1f} seconds, learned from the history of {1}. Waiting upto {2} '
+                      'seconds'.format(phase_timeout, hostname, timeout), tcolors.WARNING)
+        ret = yield Expect(connection, patterns, timeout=timeout - phase_timeout)
+    yield Return(ret)
+
+def record_phase_timeout(hostname, phase, started, phase_timeout, timeout):
+    '''Adds the time a phase waited before it timed out to the history of the host, if its timeout was learned,
+    so that the next run waits longer'''
+    if latency_history and phase_timeout < timeout:
+        record_phase(hostname, phase, started)
+
+def mask_credentials(command, var):
+    '''Returns the command with the password of the host masked, as written to the journal'''
+    command = command[0] if isinstance(command, list) else command
+    password = var.get('password')
+    if password and isinstance(password, (str, unicode)):
+        return command.replace(password, '********')
+    return command
+
+def journal_command(var, command, status, ok, started):
+    if run_journal:
+        run_journal.record('command', current_step, var['hostname'], mask_credentials(command, var), status, ok,
+                           timings.monotonic() - started)
+
+def journal_unit(host, command, status, ok, started):
+    if run_journal:
+        run_journal.record('unit', current_step, host, command, status, ok, timings.monotonic() - started)
+
+def is_journaled(host, command=None):
+    '''Returns True if the unit (the current step on a host, or a local command) is skipped: it completed in
+    the run being resumed, or it did not fail in the run whose failures are run again'''
+    if journal_units is None:
+        return False
+    state = journal_units.get((current_step, host, command))
+    if run_options['rerun_failed']:
+        return not state or (state['done'] and not state['failed'])
+    return bool(state and state['done'])
+
+def journaled_session(var, session):
+    '''Runs the session of a host and records its outcome in the journal'''
+    started = timings.monotonic()
+    success = yield session
+    journal_unit(var['hostname'], None, None, bool(success), started)
+    yield Return(success)
+
+class Expect(object):
+    '''Yielded by a session coroutine to wait for one of the patterns on a connection. The coroutine is
+    resumed with the index of the matched pattern, same as connection.expect(). With exact=True the
+    patterns are plain strings, same as connection.expect_exact()'''
+    def __init__(self, connection, patterns, timeout=-1, exact=False):
+        self.connection = connection
+        self.patterns = patterns
+        self.timeout = timeout
+        self.exact = exact
+
+class Send(object):
+    '''Yielded by a session coroutine to send a line to a connection'''
+    def __init__(self, connection, line):
+        self.connection = connection
+        self.line = line
+
+class Close(object):
+    '''Yielded by a session coroutine to close a connection'''
+    def __init__(self, connection):
+        self.connection = connection
+
+class Return(object):
+    '''Yielded by a session coroutine to return a value to its caller. A coroutine can call another one by
+    yielding it'''
+    def __init__(self, value=None):
+        self.value = value
+
+class Run(object):
+    '''Yielded by a session coroutine to run a command without a pty. The coroutine is resumed with
+    (exit status, stdout, stderr), where the exit status is None if the command timed out. established is
+    called once the stdout starts with a line of established_marker, which is left out of the stdout'''
+    def __init__(self, args, timeout=None, established=None):
+        self.args = args
+        self.timeout = timeout
+        self.established = established
+
+class Sleep(object):
+    '''Yielded by a session coroutine to wait for some seconds without holding up the other sessions'''
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+class Process(object):
+    '''A command started for a Run request, collecting its stdout and stderr from pipes'''
+    def __init__(self, args, established=None):
+        with open(os.devnull) as devnull:
+            self.popen = subprocess.Popen(args, stdin=devnull, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                          close_fds=True)
+        self.stdout_fd, self.stderr_fd = self.popen.stdout.fileno(), self.popen.stderr.fileno()
+        self.output = { self.stdout_fd : [], self.stderr_fd : [] }
+        self.open = set(self.output)
+        self.established = established
+
+    def read(self, fd):
+        '''Reads what is available on one of the pipes. Returns False once the pipe is closed'''
+        data = os.read(fd, 65536)
+        if data:
+            self.output[fd].append(data)
+            if self.established and fd == self.stdout_fd:
+                self.check_established()
+        else:
+            self.open.discard(fd)
+        return bool(data)
+
+    def check_established(self):
+        '''Calls established once the stdout starts with the line of established_marker, which is taken out of
+        it. Stops looking as soon as the stdout starts with anything else'''
+        marker = established_marker + '\n'
+        stdout = ''.join(self.output[self.stdout_fd])
+        if len(stdout) < len(marker) and marker.startswith(stdout):
+            return # Not all of the marker is read yet
+        established, self.established = self.established, None
+        if stdout.startswith(marker):
+            self.output[self.stdout_fd] = [stdout[len(marker):]]
+            established()
+
+    def result(self, timed_out=False):
+        if timed_out and self.popen.poll() is None:
+            self.popen.kill()
+        status = self.popen.wait()
+        self.popen.stdout.close()
+        self.popen.stderr.close()
+        return (None if timed_out else status, ''.join(self.output[self.stdout_fd]),
+                ''.join(self.output[self.stderr_fd]))
+
+def run_process(args, timeout=None, established=None):
+    '''Runs a command without a pty and returns (exit status, stdout, stderr), same as a Run request'''
+    process = Process(args, established)
+    due = time.time() + timeout if timeout is not None else None
+    while process.open:
+        wait = max(0, due - time.time()) if due is not None else None
+        try:
+            ready = select.select(list(process.open), [], [], wait)[0]
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            continue
+        if not ready:
+            return process.result(timed_out=True)
+        for fd in ready:
+            process.read(fd)
+    return process.result()
+
+class Session(object):
+    '''A stack of session coroutines for one host, driven by run_session() or run_async()'''
+    def __init__(self, coroutine):
+        self.stack = [coroutine]
+        self.result = None
+        self.messages = None
+
+    def advance(self, value=None, error=None):
+        '''Resumes the coroutine with value (or raises error inside it) and returns the next Expect, Send,
+        Close or Run request. Returns None once the outermost coroutine has completed'''
+        while self.stack:
+            coroutine = self.stack[-1]
+            try:
+                if error:
+                    request = coroutine.throw(*error)
+                    error = None
+                else:
+                    request = coroutine.send(value)
+            except StopIteration:
+                self.stack.pop()
+                value = None
+                continue
+            except Exception:
+                self.stack.pop()
+                if not self.stack:
+                    raise
+                error = sys.exc_info()
+                continue
+            if isinstance(request, Return):
+                coroutine.close()
+                self.stack.pop()
+                value = request.value
+            elif isinstance(request, types.GeneratorType):
+                self.stack.append(request)
+                value = None
+            else:
+                return request
+        self.result = value
+        return None
+
+def get_searcher(request):
+    '''Returns the pexpect searcher of an Expect request. The regex patterns are searched as one alternation,
+    and the prompts (anchored at the end of the output) only at the end of it, so that waiting for the prompt
+    of a command costs the same per read however much the command prints'''
+    connection = request.connection
+    if request.exact:
+        patterns = request.patterns if isinstance(request.patterns, list) else [request.patterns]
+        return pexpect.searcher_exact([pattern if pattern in (pexpect.EOF, pexpect.TIMEOUT)
+                                       else connection._coerce_expect_string(pattern) for pattern in patterns])
+    return pexpect.searcher_combined(connection.compile_pattern_list(request.patterns),
+                                     tail=run_options['prompt_tail_bytes'])
+
+def run_session(coroutine):
+    '''Runs a session coroutine to completion with blocking expect() calls'''
+    session = Session(coroutine)
+    request = session.advance()
+    while request:
+        value, error = None, None
+        try:
+            if isinstance(request, Expect):
+                timeout = request.connection.timeout if request.timeout == -1 else request.timeout
+                value = request.connection.expect_loop(get_searcher(request), timeout)
+            elif isinstance(request, Send):
+                value = request.connection.sendline(request.line)
+            elif isinstance(request, Run):
+                value = run_process(request.args, request.timeout, request.established)
+            elif isinstance(request, Sleep):
+                time.sleep(request.seconds)
+            else:
+                request.connection.close()
+        except Exception:
+            error = sys.exc_info()
+        request = session.advance(value, error)
+    return session.result
+
+def admit_session(var):
+    '''Waits until a new connection to the host is admitted. Returns the target to release() once the
+    handshake is over'''
+    target = admission.get_target(var['hostname'], var.get('options'))
+    if admission_control:
+        wait = admission_control.acquire(target)
+        while wait:
+            yield Sleep(wait)
+            wait = admission_control.acquire(target)
+    yield Return(target)
+
+def release(target):
+    if admission_control:
+        admission_control.release(target)
+
+def get_retry_wait(attempt):
+    '''Returns the seconds to wait before retrying a connection reset before the banner, or None if the
+    retries are used up'''
+    if attempt >= int(run_options['connect_retries']):
+        return None
+    wait = admission.get_backoff(attempt, float(run_options['connect_backoff_secs']))
+    colored_print('Connection reset before the banner. Retrying in {0:.2f} seconds'.format(wait), tcolors.FAIL)
+    return wait
+
+def expect_spawn_session(var, timeout):
+    if multiplexer:
+        yield open_master_session(var, timeout)
+        var = multiplexer.connected(var)
     command = format(ssh_format, var)
-    double_colored_print('Connecting... ', command, tcolors.BOLD, tcolors.WARNING)
+    attempt = 0
+    while True:
+        double_colored_print('Connecting... ', command, tcolors.BOLD, tcolors.WARNING)
+        target = yield admit_session(var)
+        try:
+            result = yield spawn_session(command, var, timeout)
+        finally:
+            release(target)
+        wait = get_retry_wait(attempt) if result is None else None
+        if wait is None:
+            yield Return(result or (None, None))
+        yield Sleep(wait)
+        attempt += 1
+
+def spawn_session(command, var, timeout):
+    '''Connects to the host. Returns (connection, response), or None if the connection was reset before the
+    banner'''
+    connection = None
+    prompted = False
+    phase, phase_timeout = 'first_prompt', get_phase_timeout(var['hostname'], 'first_prompt', timeout)
     try:
-        connection = pexpect.spawn(command, timeout=timeout)
-        connection.setecho(False)
-        ret = connection.expect([var['password_prompt'], var['shell_prompt']])
+        started = timings.monotonic()
+        connection = pexpect.spawn(command, timeout=timeout, echo_sync=is_true(run_options['echo_sync']))
+        if not connection.echo_sync:
+            # With echo_sync the echo is left to ssh, which turns it off to read the password and for the
+            # session, as it is what tells that ssh is reading
+            connection.setecho(False)
+        record_phase(var['hostname'], 'spawn', started)
+        started = timings.monotonic()
+        ret = yield expect_phase_session(connection, [var['password_prompt'], var['shell_prompt']], var['hostname'],
+                                         phase_timeout, timeout)
+        prompted = True
+        record_phase(var['hostname'], 'first_prompt', started)
         if ret == 0:
             colored_print_without_newline('Sending password ... ', tcolors.BOLD)
-            connection.sendline(var['password'])
-            connection.expect(var['shell_prompt'])
+            phase, phase_timeout = 'auth', get_phase_timeout(var['hostname'], 'auth', timeout)
+            started = timings.monotonic()
+            yield Send(connection, var['password'])
+            yield expect_phase_session(connection, var['shell_prompt'], var['hostname'], phase_timeout, timeout)
+            record_phase(var['hostname'], 'auth', started)
         colored_print('Connection established', tcolors.LGREEN)
         response = trim_cr(connection.before) + trim_cr(connection.after)
         #if default_live_run:
         #    colored_print_without_newline(response, tcolors.NORMAL)
-        return connection, response
+        yield Return((connection, response))
     except Exception as e:
+        if isinstance(e, pexpect.EOF) and not prompted and admission.is_reset(connection.before):
+            yield Close(connection)
+            yield Return(None)
+        if isinstance(e, pexpect.TIMEOUT):
+            record_phase_timeout(var['hostname'], phase, started, phase_timeout, timeout)
         msg = "Timed out waiting for the prompt: '{0}'\n".format(var['shell_prompt'])
         double_colored_print('\nUnable to ssh : ', msg, tcolors.BOLD, tcolors.FAIL)
         double_colored_print('Exception : ', str(e) + '\n', tcolors.BOLD, tcolors.FAIL)
-        return None, None
+        yield Return((None, None))
 
-def run_ssh_command(connection, command, var):
+def open_master_session(var, timeout):
+    '''Starts the ControlMaster for the host unless it is already running. Returns False if it could not
+    be started, in which case the connections to the host are made without it'''
+    if multiplexer.connected(var) is not var:
+        yield Return(True)
+    control_path = multiplexer.new_control_path()
+    command = format(master_format, dict(var, control_path=control_path, persist_secs=MASTER_PERSIST_SECS))
+    double_colored_print('Opening master connection... ', format(ssh_format, var), tcolors.BOLD, tcolors.WARNING)
+    connection = None
+    target = yield admit_session(var)
+    master_timeout = get_phase_timeout(var['hostname'], 'master', timeout)
+    started = timings.monotonic()
+    try:
+        connection = pexpect.spawn(command, timeout=timeout, echo_sync=is_true(run_options['echo_sync']))
+        ret = yield expect_phase_session(connection, [var['password_prompt'], pexpect.EOF], var['hostname'],
+                                         master_timeout, timeout)
+        if ret == 0:
+            yield Send(connection, var['password'])
+            yield expect_phase_session(connection, pexpect.EOF, var['hostname'], master_timeout, timeout)
+    except Exception as e:
+        double_colored_print('Unable to open master connection : ', str(e), tcolors.BOLD, tcolors.FAIL)
+    finally:
+        release(target)
+    record_phase(var['hostname'], 'master', started)
+    if connection:
+        yield Close(connection)
+    if not os.path.exists(control_path):
+        colored_print('No master connection. Connecting without multiplexing', tcolors.FAIL)
+        yield Return(False)
+    multiplexer.add(var, control_path)
+    yield Return(True)
+
+def expect_spawn(var, timeout):
+    return run_session(expect_spawn_session(var, timeout))
+
+def connect_session(var, timeout):
+    '''Returns an idle connection from the session pool if it still answers with a prompt, otherwise
+    connects to the host'''
+    connection = session_pool.take(var) if session_pool else None
+    if connection and not connection.closed and connection.isalive():
+        double_colored_print('Reusing connection... ', format(ssh_format, var), tcolors.BOLD, tcolors.WARNING)
+        try:
+            yield send_line(connection, '')
+            ret, response, status = yield completion_session(connection, var, min(SESSION_CHECK_SECS, timeout))
+        except Exception:
+            ret = None
+        if ret == 0:
+            yield Return((connection, response))
+        colored_print('Connection is not responding. Connecting again', tcolors.FAIL)
+    if connection:
+        yield Close(connection)
+    connection, response = yield expect_spawn_session(var, timeout)
+    if connection and default_live_run and run_options['completion'] == 'sentinel':
+        yield sentinel_setup_session(connection, var)
+    yield Return((connection, response))
+
+def sentinel_setup_session(connection, var):
+    '''Makes the shell end its prompt with a sentinel carrying a random token, the count of the lines run so
+    far and the exit status of the last command, so that a command is complete on an exact match of its
+    sentinel. The output of a command can not end it early by looking like a prompt. Shells other than bash
+    keep their prompt and the shell_prompt regex is used for them'''
+    token = '{0:012x}'.format(random.getrandbits(48))
+    yield Send(connection, format(sentinel_format, { 'token' : token }))
+    ret = yield Expect(connection, ['__RC_ok_' + token, '__RC_no_' + token, pexpect.EOF, pexpect.TIMEOUT], exact=True)
+    if ret == 0:
+        connection.sentinel, connection.sentinel_count = '__RC_{0}_'.format(token), 1
+        ret, response, status = yield completion_session(connection, var)
+    else:
+        yield Expect(connection, [var['shell_prompt'], pexpect.EOF, pexpect.TIMEOUT])
+
+def send_line(connection, line):
+    '''Returns the Send request for a line run by the shell, or for lines separated by newlines, counting the
+    lines if the shell prints sentinels'''
+    if getattr(connection, 'sentinel', None):
+        connection.sentinel_count += line.count('\n') + 1
+    return Send(connection, line)
+
+def completion_session(connection, var, timeout=-1, sudo=False):
+    '''Waits for the line sent last to complete. Returns (index, response, exit status), where the index is
+    of the match in [prompt, EOF, TIMEOUT, sudo_password_prompt]. The exit status is None unless the shell
+    prints sentinels, in which case the sudo_password_prompt is matched as plain text'''
+    sentinel = getattr(connection, 'sentinel', None)
+    if not sentinel:
+        patterns = [var['shell_prompt'], pexpect.EOF, pexpect.TIMEOUT] + ([var['sudo_password_prompt']] if sudo else [])
+        ret = yield Expect(connection, patterns, timeout=timeout)
+        yield Return((ret, trim_cr(connection.before) + trim_cr(connection.after), None))
+    patterns = ['{0}{1}_'.format(sentinel, connection.sentinel_count), pexpect.EOF, pexpect.TIMEOUT]
+    ret = yield Expect(connection, patterns + ([var['sudo_password_prompt']] if sudo else []), timeout=timeout, exact=True)
+    response, status = trim_cr(connection.before), None
+    if ret == 3:
+        response += trim_cr(connection.after)
+    elif ret == 0:
+        yield Expect(connection, '__', timeout=timeout, exact=True)
+        if connection.before.isdigit():
+            status = int(connection.before)
+    yield Return((ret, response, status))
+
+def ssh_command_session(connection, command, var):
     if not default_live_run:
         double_colored_print('Command: ', command, tcolors.BOLD, tcolors.WARNING)
-        return True
+        yield Return(True)
     if not connection:
         double_colored_print('No connection. Unable to run the command: ', command, tcolors.FAIL, tcolors.WARNING)
-        return True
+        yield Return(True)
 
     if isinstance(command, list):
         command, wait = command
@@ -367,22 +967,179 @@ def run_ssh_command(connection, command, var):
     else:
         extra_info = ''
     double_colored_print(command, extra_info, tcolors.WARNING, tcolors.BOLD)
-    connection.sendline(command)
+    started = timings.monotonic()
+    yield send_line(connection, command)
 
-    ret = connection.expect([var['shell_prompt'], pexpect.EOF, pexpect.TIMEOUT, var['sudo_password_prompt']])
+    ret, response, status = yield completion_session(connection, var, sudo=True)
     if ret == 3:
         colored_print_without_newline('Sending password ... ', tcolors.BOLD)
-        connection.sendline(var['password'])
+        yield Send(connection, var['password'])
         colored_print('Done', tcolors.LGREEN)
-        ret = connection.expect([var['shell_prompt'], pexpect.EOF, pexpect.TIMEOUT])
+        ret, response, status = yield completion_session(connection, var)
+    record_phase(var['hostname'], 'command', started)
+    # An EOF is not a failure of the command itself, like for an 'exit'
+    journal_command(var, command, status, ret in (0, 1) and not status, started)
 
-    response = trim_cr(connection.before) + trim_cr(connection.after)
     #if response.startswith(command):
     #    response = response[len(command):].lstrip()
-    colored_print_without_newline(response, tcolors.NORMAL)
+    print_response(response, status)
     if ret == 1: # pexpect.EOF
-        return False
-    return True
+        yield Return(False)
+    yield Return(True)
+
+def run_ssh_command(connection, command, var):
+    return run_session(ssh_command_session(connection, command, var))
+
+def print_response(response, status, prompt=True):
+    if status and '\n' in response and prompt:
+        # The exit status goes between the output and the prompt
+        output, prompt = response.rsplit('\n', 1)
+        colored_print(output, tcolors.NORMAL)
+        colored_print('Exit status: {0}'.format(status), tcolors.FAIL)
+        colored_print_without_newline(prompt, tcolors.NORMAL)
+    else:
+        colored_print_without_newline(response, tcolors.NORMAL)
+        if status:
+            colored_print('Exit status: {0}'.format(status), tcolors.FAIL)
+
+def ssh_batch_session(connection, commands, var):
+    '''Runs all the commands in one round trip. The commands are sent as one base64 encoded script, in lines
+    short enough for the tty, which is eval'd by the shell so that they still share its state. The script
+    prints a delimiter once it starts and one with the exit status after each command, which splits the
+    output back per command. The sudo_password_prompt is matched as plain text. Returns (the number of
+    commands run, True if the connection was lost), as it can be lost on the last command (like an 'exit')'''
+    commands = [command[0] if isinstance(command, list) else command for command in commands]
+    if not default_live_run:
+        for command in commands:
+            double_colored_print('Command: ', command, tcolors.BOLD, tcolors.WARNING)
+        yield Return((len(commands), False))
+    token = '{0:012x}'.format(random.getrandbits(48))
+    script = format(batch_start_format, { 'token' : token }) + ''.join(
+        format(batch_command_format, { 'command' : command, 'token' : token, 'index' : index })
+        for index, command in enumerate(commands))
+    payload = base64.b64encode(script)
+    lines = [format(batch_line_format if start else batch_first_line_format,
+                    { 'chunk' : payload[start:start + BATCH_LINE_CHARS] })
+             for start in range(0, len(payload), BATCH_LINE_CHARS)]
+    colored_print('(batch of {0} commands)'.format(len(commands)), tcolors.BOLD)
+    started = timings.monotonic()
+    # All the lines go at once: the shell reads them one after the other
+    yield send_line(connection, '\n'.join(lines + [batch_format]))
+    # Leaving out the echo of the lines, and their prompts
+    start = yield Expect(connection, ['__RC_{0}_start__'.format(token), pexpect.EOF, pexpect.TIMEOUT], exact=True)
+    for index, command in enumerate(commands):
+        double_colored_print(command, '', tcolors.WARNING, tcolors.BOLD)
+        patterns = ['__RC_{0}_{1}_'.format(token, index), pexpect.EOF, pexpect.TIMEOUT]
+        if index == 0 and start != 0:
+            ret, response = start, trim_cr(connection.before)
+        else:
+            ret = yield Expect(connection, patterns + [var['sudo_password_prompt']], exact=True)
+            response = trim_cr(connection.before)
+        if ret == 3:
+            colored_print_without_newline(response + trim_cr(connection.after), tcolors.NORMAL)
+            colored_print_without_newline('Sending password ... ', tcolors.BOLD)
+            yield Send(connection, var['password'])
+            colored_print('Done', tcolors.LGREEN)
+            ret = yield Expect(connection, patterns, exact=True)
+            response = trim_cr(connection.before)
+        elif index == 0 and start == 0:
+            # Leaving out the end of the line of the start delimiter
+            response = response[1:] if response.startswith('\n') else response
+        # The time of a command in a batch is from the delimiter of the previous command
+        record_phase(var['hostname'], 'command', started)
+        status = None
+        if ret == 0:
+            yield Expect(connection, '__', exact=True)
+            status = int(connection.before) if connection.before.isdigit() else None
+            response = response[:-1] if response.endswith('\n') else response
+        journal_command(var, command, status, ret in (0, 1) and not status, started)
+        started = timings.monotonic()
+        print_response(response + '\n' if response else '', status, prompt=False)
+        if ret == 1: # pexpect.EOF
+            for command in commands[index + 1:]:
+                double_colored_print('No connection. Unable to run the command: ', command, tcolors.FAIL, tcolors.WARNING)
+            yield Return((index + 1, True))
+    ret, response, status = yield completion_session(connection, var)
+    colored_print_without_newline(response.lstrip('\n'), tcolors.NORMAL)
+    yield Return((len(commands), ret == 1))
+
+def ssh_exec_session(step, var, command_groups):
+    '''Runs each command with its own 'ssh -o BatchMode=yes host command' over pipes, without a pty, a shell
+    prompt or a password prompt. The stdout, the stderr and the exit status of each command are printed
+    separately. The commands do not share a shell, so a 'cd' does not apply to the later commands. Returns
+    False if ssh could not connect (exit status 255) before all the commands were run'''
+    timeout = get_timeout_secs(var['timeout_secs'])
+    multiplexed = False
+    if multiplexer and default_live_run:
+        # A master connection lets the commands run without the keys or the agent
+        yield open_master_session(var, timeout)
+        multiplexed = multiplexer.connected(var) is not var
+        var = multiplexer.connected(var)
+    args = shlex.split(format(exec_format, var))
+    connected = True
+    for commands in command_groups:
+        for command in commands:
+            command = command[0] if isinstance(command, list) else command
+            if not default_live_run:
+                double_colored_print('Command: ', command, tcolors.BOLD, tcolors.WARNING)
+                continue
+            if not connected:
+                double_colored_print('No connection. Unable to run the command: ', command, tcolors.FAIL, tcolors.WARNING)
+                continue
+            double_colored_print('{0}@{1}: '.format(var['username'], var['hostname']), command,
+                                 tcolors.BOLD, tcolors.WARNING)
+            started = timings.monotonic()
+            status, stdout, stderr = yield exec_command_session(var, args + [command], timeout, multiplexed)
+            record_phase(var['hostname'], 'command', started)
+            journal_command(var, command, status, status == 0, started)
+            if stdout:
+                colored_print(stdout.rstrip('\n'), tcolors.NORMAL)
+            if stderr:
+                colored_print(stderr.rstrip('\n'), tcolors.FAIL)
+            if status is None:
+                colored_print('Timed out after {0} seconds'.format(timeout), tcolors.FAIL)
+            elif status == 255:
+                colored_print('Unable to ssh (exit status 255)', tcolors.FAIL)
+                connected = False
+            elif status:
+                colored_print('Exit status: {0}'.format(status), tcolors.FAIL)
+        colored_print('', tcolors.NORMAL)
+    yield Return(connected)
+
+def exec_command_session(var, args, timeout, multiplexed):
+    '''Runs a command of ssh_exec_session(). Unless it runs over a master connection, its connection is
+    admitted first and retried if it is reset before the banner. ssh prints established_marker (with
+    LocalCommand) once it is authenticated, which ends the handshake in flight while the command runs on'''
+    if multiplexed:
+        result = yield Run(args, timeout)
+        yield Return(result)
+    args = args[:1] + established_options + args[1:]
+    attempt = 0
+    while True:
+        target = yield admit_session(var)
+        admitted = [target]
+        def established(admitted=admitted):
+            if admitted:
+                release(admitted.pop())
+        try:
+            status, stdout, stderr = yield Run(args, timeout, established)
+        finally:
+            established()
+        wait = get_retry_wait(attempt) if status == 255 and admission.is_reset(stderr) else None
+        if wait is None:
+            yield Return((status, stdout, stderr))
+        yield Sleep(wait)
+        attempt += 1
+
+def is_true(value):
+    return (isinstance(value, bool) and value) or (isinstance(value, (str, unicode)) and value.upper() == 'TRUE')
+
+def get_batch(step):
+    return is_true(step.get('batch', run_options['batch']))
+
+def get_host_session(step):
+    '''Returns the session coroutine function which runs the commands of a ssh action on one host'''
+    return ssh_exec_session if is_true(step.get('exec', run_options['exec'])) else ssh_host_session
 
 def clean_and_split_params(step):
     action_params = set()
@@ -391,7 +1148,7 @@ def clean_and_split_params(step):
         if param.startswith(('#', '-')):
             del(step[param])
             continue
-        if not (param == 'action' or param == 'commands'):
+        if not (param == 'action' or param == 'commands' or param in step_options.get(step['action'], [])):
             if isinstance(step[param], (str,unicode)):
                 matches = var_regex.finditer(step[param])
                 for match in matches:
@@ -414,31 +1171,30 @@ def clean_and_split_params(step):
     combined_params.update(commands_params)
     return list(action_params), list(commands_params), list(combined_params)
 
+def get_key(params, variable):
+    return tuple(variable[param] for param in params)
+
 def get_distinct_subset(params, variables):
+    '''Returns the distinct selections of params from variables, in the order they are first seen'''
     distinct_variables = []
+    seen = set()
     for variable in variables:
-        selection = {}
-        for param in params:
-            selection[param] = variable[param]
-        if selection not in distinct_variables:
-            distinct_variables.append(selection)
+        key = get_key(params, variable)
+        if key not in seen:
+            seen.add(key)
+            distinct_variables.append(dict(zip(params, key)))
     return distinct_variables
 
-def get_filtered_variables(filter_dict, variables):
-    filtered_variables = []
+def group_variables(params, variables):
+    '''Returns { tuple of the values of params : list of the variables with those values }'''
+    groups = {}
     for variable in variables:
-        filtered = True
-        for filt in filter_dict:
-            if filt in variable and variable[filt] != filter_dict[filt]:
-                filtered = False
-                break
-        if filtered:
-            filtered_variables.append(variable)
-    return filtered_variables
+        groups.setdefault(get_key(params, variable), []).append(variable)
+    return groups
 
 def validate_action_parameters(step, mandatory_params, variable_names):
     step_keys = list(step.keys())
-    mandatory_keys = mandatory_params + ['action', 'commands']
+    mandatory_keys = mandatory_params + ['action', 'commands'] + step_options.get(step['action'], [])
     for key in step_keys:
         if key not in mandatory_keys:
             del step[key]
@@ -475,121 +1231,596 @@ def resolve_all_variables(step, variable):
         new_step[p] = format(step[p], variable)
     return new_step
 
-def execute_action(action, step, variable_names, variable_values):
+def get_parallel(step):
+    value = step.get('parallel', run_options['parallel'])
+    try:
+        parallel = int(value)
+        if parallel < 0:
+            raise ValueError(value)
+        return parallel
+    except:
+        double_colored_print("WARNING: 'parallel' should be a number >= 0. Running hosts one at a time: ",
+                             str(value), tcolors.FAIL, tcolors.LGREEN)
+        return 1
+
+def run_parallel(function, items, parallel):
+    '''Calls function(*item) for each item using upto "parallel" worker threads (0 for all items at once).
+    The output of each call is buffered and printed as one block when the call completes, so the output of
+    a host is never mixed with the output of other hosts. Returns the results in the same order as items'''
+    results = [None] * len(items)
+    pending = Queue.Queue()
+    for index, item in enumerate(items):
+        pending.put((index, item))
+
+    def worker():
+        while True:
+            try:
+                index, item = pending.get_nowait()
+            except Queue.Empty:
+                return
+            output_buffer.messages = []
+            try:
+                results[index] = function(*item)
+            except Exception as e:
+                colored_print('Unexpected error: {0}'.format(str(e)), tcolors.FAIL)
+                results[index] = False
+            finally:
+                messages, output_buffer.messages = output_buffer.messages, None
+                with output_lock:
+                    sys.stdout.write(''.join(messages))
+                    sys.stdout.flush()
+
+    if parallel == 0 or parallel > len(items):
+        parallel = len(items)
+    workers = []
+    for i in range(parallel):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        workers.append(thread)
+    for thread in workers:
+        while thread.is_alive():
+            thread.join(0.5) # join() with a timeout keeps Ctrl-C working
+    return results
+
+def ssh_host_session(step, var, command_groups):
+    '''Connects to a host and runs each group of resolved commands. Returns False if the host could
+    not be connected or the connection was lost before all the commands were run'''
+    connection, response = yield connect_session(var, get_timeout_secs(var['timeout_secs']))
+    if not connection:
+        yield Return(False)
+    success = True
+    if default_live_run:
+        if '\n' in response:
+            split_res = response.rsplit('\n', 1)[0]
+            if split_res:
+                response = '\n' + response.rsplit('\n', 1)[-1]
+        colored_print_without_newline(response, tcolors.NORMAL)
+    else:
+        colored_print('', tcolors.NORMAL)
+    remaining = sum(len(commands) for commands in command_groups)
+    batch = get_batch(step)
+    for commands in command_groups:
+        if batch and connection and len(commands) > 1:
+            run, lost = yield ssh_batch_session(connection, commands, var)
+            remaining -= run
+            if lost:
+                yield Close(connection)
+                connection = None
+                success = success and remaining == 0
+                remaining -= len(commands) - run
+            colored_print('', tcolors.NORMAL)
+            continue
+        for command in commands:
+            ret = yield ssh_command_session(connection, command, var)
+            remaining -= 1
+            if not ret:
+                yield Close(connection)
+                connection = None
+                # Losing the connection after the last command (like an 'exit') is not a failure
+                success = success and remaining == 0
+        colored_print('', tcolors.NORMAL)
+    if default_live_run:
+        colored_print('', tcolors.NORMAL)
+    if connection and session_pool:
+        session_pool.put(var, connection)
+    elif connection:
+        yield Close(connection)
+    yield Return(success)
+
+def run_ssh_host(step, var, command_groups):
+    return run_session(journaled_session(var, get_host_session(step)(step, var, command_groups)))
+
+def hangup(connection):
+    '''Closes the pty of a connection and hangs up the child without waiting for it to exit, which is
+    what connection.close() does. Returns True if the child is still running and has to be reaped'''
+    if connection.closed:
+        return False
+    connection.ptyproc.fileobj.close()
+    connection.ptyproc.fd, connection.ptyproc.closed = -1, True
+    connection.child_fd, connection.closed = -1, True
+    if connection.isalive():
+        os.kill(connection.pid, signal.SIGHUP)
+        return True
+    return False
+
+def reap(closing, now):
+    '''Reaps the children in closing (connection -> kill time) which have exited, killing the ones which
+    are still running after their kill time'''
+    for connection, kill_time in list(closing.items()):
+        if not connection.isalive():
+            del closing[connection]
+        elif kill_time <= now:
+            os.kill(connection.pid, signal.SIGKILL)
+
+class SessionPool(object):
+    '''Keeps authenticated ssh connections open between the actions of a run, so that the next ssh action
+    on the same (hostname, username, options) reuses the shell instead of connecting again'''
+    def __init__(self):
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def key(self, var):
+        return (var['hostname'], var['username'], var['options'])
+
+    def take(self, var):
+        with self.lock:
+            idle = self.connections.get(self.key(var))
+            return idle.pop() if idle else None
+
+    def put(self, var, connection):
+        with self.lock:
+            self.connections.setdefault(self.key(var), []).append(connection)
+
+    def close_all(self):
+        with self.lock:
+            closing = {}
+            for idle in self.connections.values():
+                for connection in idle:
+                    if hangup(connection):
+                        closing[connection] = time.time() + 5
+            self.connections = {}
+        while closing:
+            time.sleep(0.05)
+            reap(closing, time.time())
+
+class Multiplexer(object):
+    '''Keeps one authenticated OpenSSH ControlMaster per (hostname, username, options) for the run. The
+    ssh, scp and local actions add its ControlPath to their options, so they neither connect nor
+    authenticate again'''
+    def __init__(self):
+        self.control_dir = tempfile.mkdtemp(prefix='remote_ssh_')
+        self.masters = {}
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def key(self, var):
+        return (var['hostname'], var['username'], var['options'])
+
+    def new_control_path(self):
+        # Short socket names, as the path of a unix socket is limited to about 100 characters
+        with self.lock:
+            self.count += 1
+            return os.path.join(self.control_dir, 'cm{0}'.format(self.count))
+
+    def add(self, var, control_path):
+        with self.lock:
+            self.masters[self.key(var)] = control_path
+
+    def connected(self, var):
+        '''Returns a copy of var with the options to use the master of its host, or var itself if there
+        is no master for the host'''
+        if not all(isinstance(var.get(name), basestring) for name in ('hostname', 'username', 'options')):
+            return var
+        with self.lock:
+            control_path = self.masters.get(self.key(var))
+        if not control_path:
+            return var
+        var = dict(var)
+        var['options'] = '{0} -o ControlPath={1} -o ControlMaster=no'.format(var['options'], control_path)
+        return var
+
+    def close_all(self):
+        with self.lock:
+            masters, self.masters = self.masters, {}
+        for (hostname, username, options), control_path in masters.items():
+            pexpect.run(format(master_exit_format, { 'control_path' : control_path, 'username' : username,
+                                                     'hostname' : hostname }))
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+
+ECHO_POLL_SECS = 0.002 # How often run_async() checks whether a connection with echo_sync is reading
+
+def run_async(coroutines, parallel):
+    '''Runs the session coroutines of many hosts in this one thread, upto "parallel" sessions at a time
+    (0 for all at once). A pexpect Reactor waits on the connections of every session with a single
+    epoll_wait() and each session is resumed only when its pattern matches, its expect times out or its send
+    is due. Connections are closed without waiting for the child to exit; the children are reaped by the loop
+    later on. Same as run_parallel(), the output of a host is printed as one block when its session
+    completes. A Run request is watched on the pipes of its process the same way'''
+    results = [None] * len(coroutines)
+    if parallel == 0 or parallel > len(coroutines):
+        parallel = len(coroutines)
+    buffered = parallel > 1
+    pending = list(reversed(list(enumerate(coroutines))))
+    active = {}   # session -> (index, request, process or latest send time, due time)
+    closing = {}  # connection -> time to kill the child if it has not exited yet
+    reactor = pexpect.Reactor()
+
+    def resume(session, value=None, error=None):
+        index = active[session][0]
+        # Requests which need no waiting (a Close, or a Run which failed to start) resume the session in this
+        # loop rather than recursively
+        while True:
+            output_buffer.messages = session.messages
+            try:
+                request = session.advance(value, error)
+            except Exception as e:
+                colored_print('Unexpected error: {0}'.format(str(e)), tcolors.FAIL)
+                request, session.result = None, False
+            finally:
+                output_buffer.messages = None
+            value, error = None, None
+            if request is None:
+                del active[session]
+                results[index] = session.result
+                if buffered:
+                    sys.stdout.write(''.join(session.messages))
+                    sys.stdout.flush()
+                return
+            if isinstance(request, Send):
+                # With echo_sync, the send is due as soon as the connection is reading, at the latest after the delay
+                latest = time.time() + (request.connection.delaybeforesend or 0)
+                active[session] = (index, request, latest, time.time() if request.connection.echo_sync else latest)
+                return
+            if isinstance(request, Sleep):
+                active[session] = (index, request, None, time.time() + request.seconds)
+                return
+            if isinstance(request, Close):
+                if hangup(request.connection):
+                    closing[request.connection] = time.time() + 5
+                continue
+            if isinstance(request, Run):
+                process, error = call(Process, request.args, request.established)
+                if error:
+                    continue
+                active[session] = (index, request, process,
+                                   time.time() + request.timeout if request.timeout is not None else None)
+                for fd in process.open:
+                    reactor.watch(fd, lambda fd, session=session, process=process: read_run(session, process, fd))
+                return
+            # The reactor times the expect out, so it has no due time here. An expect which matches the output
+            # read already is called back by the next poll()
+            active[session] = (index, request, None, None)
+            reactor.expect(request.connection, get_searcher(request),
+                           lambda value, error, session=session: resume(session, value, error), request.timeout)
+            return
+
+    def read_run(session, process, fd):
+        if not process.read(fd):
+            reactor.unwatch(fd)
+            if not process.open:
+                finish_run(session, process)
+
+    def finish_run(session, process, timed_out=False):
+        for fd in process.open:
+            reactor.unwatch(fd)
+        resume(session, *call(process.result, timed_out))
+
+    def call(function, *args):
+        try:
+            return function(*args), None
+        except Exception:
+            return None, sys.exc_info()
+
+    while pending or active or closing:
+        while pending and len(active) < parallel:
+            index, coroutine = pending.pop()
+            session = Session(coroutine)
+            if buffered:
+                session.messages = []
+            active[session] = (index, None, None, None)
+            resume(session)
+
+        due_times = [due for (index, request, process, due) in active.values() if due is not None]
+        if closing:
+            due_times.append(time.time() + 0.1)
+        expect_wait = reactor.get_wait()
+        if expect_wait is not None:
+            due_times.append(time.time() + expect_wait)
+        wait = None
+        if due_times:
+            wait = max(0, min(due_times) - time.time())
+        # Reads the connections which are ready and resumes the sessions whose expect is over
+        reactor.poll(wait)
+
+        now = time.time()
+        for session, (index, request, process, due) in list(active.items()):
+            if due is None or due > now or session not in active or active[session][1] is not request:
+                continue
+            if isinstance(request, Run):
+                finish_run(session, process, timed_out=True)
+                continue
+            if isinstance(request, Sleep):
+                resume(session)
+                continue
+            connection = request.connection
+            if isinstance(request, Send):
+                latest = process # For a Send, the latest time to send
+                if connection.echo_sync and now < latest and not connection.is_reading():
+                    active[session] = (index, request, latest, min(latest, now + ECHO_POLL_SECS))
+                    continue
+                delay, connection.delaybeforesend = connection.delaybeforesend, None
+                try:
+                    value, error = call(connection.sendline, request.line)
+                finally:
+                    connection.delaybeforesend = delay
+                resume(session, value, error)
+
+        reap(closing, now)
+    reactor.close()
+    return results
+
+def print_host_summary(hostnames, results):
+    failed = [hostname for hostname, result in zip(hostnames, results) if not result]
+    message = '{0} of {1} host(s) completed'.format(len(hostnames) - len(failed), len(hostnames))
+    if failed:
+        double_colored_print(message + '. Failed: ', ', '.join(failed), tcolors.BOLD, tcolors.FAIL)
+    else:
+        colored_print(message, tcolors.LGREEN)
+
+def get_ssh_hosts(step, action_params, dist_action_variables, dist_combined_variables):
+    '''Returns [resolved action parameters, command groups] of each host of a ssh action'''
+    hosts = []
+    # The command variables of each action variable, grouped once instead of filtered per action variable
+    grouped_variables = group_variables(action_params, dist_combined_variables)
+    for act_variable in dist_action_variables:
+        var = resolve_all_variables(step, act_variable)
+        if not var:
+            continue
+        dist_commands_variables = grouped_variables.get(get_key(action_params, act_variable), [])
+        command_groups = []
+        for cmd_variable in dist_commands_variables:
+            command_groups.append([command if isinstance(command, list) else format(command, cmd_variable)
+                                   for command in step['commands']])
+        hosts.append([var, command_groups])
+    return hosts
+
+def skip_journaled(hosts, get_hostname):
+    if journal_units is None:
+        return hosts
+    remaining = [host for host in hosts if not is_journaled(get_hostname(host))]
+    if len(remaining) < len(hosts):
+        colored_print('Skipping {0} host(s) {1} in run {2}\n'.format(len(hosts) - len(remaining),
+                      'without failures' if run_options['rerun_failed'] else 'completed',
+                      run_options['rerun_failed'] or run_options['resume']), tcolors.BOLD)
+    return remaining
+
+def preflight_hosts(step, hosts, get_var):
+    '''Probes the ssh port of all the hosts at once (--preflight, unless the step has "preflight" : "false")
+    and returns the hosts which accepted the connection. The others are reported, and failed in the journal.
+    A host reached through a jump host is probed at its jump host, and one reached through a ProxyCommand or
+    a master connection is not probed'''
+    if not hosts or not is_true(step.get('preflight', run_options['preflight'])):
+        return hosts
+    targets = []
+    for host in hosts:
+        var = multiplexer.connected(get_var(host)) if multiplexer else get_var(host)
+        targets.append(preflight.get_target(var['hostname'], var.get('options')))
+    started = timings.monotonic()
+    results = preflight.probe([target for target in targets if target], float(run_options['preflight_secs']))
+    reachable = []
+    for host, target in zip(hosts, targets):
+        if not target or results[target] is None:
+            reachable.append(host)
+            continue
+        hostname = get_var(host)['hostname']
+        where = '{0}:{1}'.format(*target)
+        if target[0] != hostname:
+            where = '{0} through {1}'.format(hostname, where)
+        double_colored_print('Unreachable host: ', '{0} ({1})'.format(where, results[target]),
+                             tcolors.FAIL, tcolors.WARNING)
+        journal_unit(hostname, None, None, False, started)
+    if len(reachable) < len(hosts):
+        colored_print('Skipping {0} unreachable host(s) of {1}\n'.format(len(hosts) - len(reachable), len(hosts)),
+                      tcolors.BOLD)
+    return reachable
+
+def run_ssh_hosts(step, hosts):
+    hosts = skip_journaled(hosts, lambda host: host[0]['hostname'])
+    hosts = preflight_hosts(step, hosts, lambda host: host[0])
+    parallel = get_parallel(step)
+    if parallel != 1:
+        colored_print('Running on {0} host(s), {1} at a time\n'.format(len(hosts),
+                      parallel if parallel else len(hosts)), tcolors.BOLD)
+    if run_options['engine'] == 'async':
+        results = run_async([journaled_session(var, get_host_session(step)(step, var, command_groups))
+                             for var, command_groups in hosts], parallel)
+    elif parallel == 1:
+        results = [run_ssh_host(step, var, command_groups) for var, command_groups in hosts]
+    else:
+        results = run_parallel(run_ssh_host, [(step, var, command_groups) for var, command_groups in hosts],
+                               parallel)
+    print_host_summary([var['hostname'] for var, command_groups in hosts], results)
+
+def run_interactive_ssh(step, dist_action_variables):
+    '''Runs an interactive ssh on the hosts one by one. Once the user chooses to run the same commands on
+    the rest of the hosts, the step is changed into a ssh action and the remaining hosts are returned'''
+    for index, act_variable in enumerate(dist_action_variables):
+        var = resolve_all_variables(step, act_variable)
+        if not var:
+            continue
+        connection, response = expect_spawn(var, get_timeout_secs(var['timeout_secs']))
+        if connection:
+            commands = []
+            timeout = 10
+            colored_print_without_newline(response, tcolors.NORMAL)
+            extra_prompt = "('exit' to end interactive ssh) > "
+            colored_print_without_newline(extra_prompt, tcolors.BOLD)
+            while True:
+                command = raw_input()
+                if '\x1b' in command:
+                    colored_print('Ignoring command ...', tcolors.BOLD)
+                    command = ''
+                command = command.strip()
+                connection.sendline(command)
+
+                ret = connection.expect([var['shell_prompt'], pexpect.EOF, pexpect.TIMEOUT, var['sudo_password_prompt']], timeout=timeout)
+                if ret == 3:
+                    colored_print_without_newline('Sending password ... ', tcolors.BOLD)
+                    connection.sendline(var['password'])
+                    colored_print('Done', tcolors.LGREEN)
+                    ret = connection.expect([var['shell_prompt'], pexpect.EOF, pexpect.TIMEOUT], timeout=timeout)
+
+                response = trim_cr(connection.before) + trim_cr(connection.after)
+                #if response.startswith(command):
+                #    response = response[len(command):].lstrip()
+                colored_print_without_newline(response, tcolors.NORMAL)
+                if ret == 1:
+                    commands.append(command)
+                    colored_print('Exiting interative ssh ...\n', tcolors.BOLD)
+                    break
+                elif ret == 2:
+                    command = [command, 'wait']
+                else:
+                    res = response.rsplit('\n',1)
+                    if res:
+                        prompt = res[-1]
+                        if '{0}@'.format(var['username']) in prompt:
+                            colored_print_without_newline(extra_prompt, tcolors.BOLD)
+                commands.append(command)
+            if len(dist_action_variables) > 1 and commands:
+                res = raw_input('Run all these commands on rest of the hosts? [y]/n : ')
+                colored_print('', tcolors.NORMAL)
+                if not res or not (res.upper() == 'N' or res.upper() == 'NO'):
+                    step['action'] = 'ssh'
+                    step['commands'] = commands
+                    config_out = { "main" : [ "interative_ssh" ], "interative_ssh" : step }
+                    dump_json(config_out, 'interactive.json')
+            connection.close()
+            if step['action'] == 'ssh':
+                return dist_action_variables[index + 1:]
+    return []
+
+def plan_action(action, step, variable_names, dict_variables, dependencies):
+    '''Validates a step and resolves it into the plan of its action, which run_action() runs:
+        local   : { "shell", "commands", "variables" : [ resolved variables of the commands ] }
+        scp     : { "options" : { preflight }, "hosts" : [ resolved action parameters ] }
+        ssh     : { "options" : { parallel, batch, exec, preflight }, "hosts" : [ [ resolved action parameters, command groups ] ] }
+        ssh-int : { "step", "action_params", "variables" : [ resolved action variables ] }
+    Returns None if the step is skipped'''
     if not validate_action_parameters(step, action_mandatory_params[action], variable_names):
-        return
+        return None
     action_params, commands_params, combined_params = clean_and_split_params(step)
     if not validate_all_variables(combined_params, variable_names):
-        return
-    dist_combined_variables = get_distinct_subset(combined_params, variable_values)
+        return None
+    dist_combined_variables = get_distinct_subset(combined_params,
+                                                  expand_variables(combined_params, dict_variables, dependencies))
 
     if step['action'] == 'local':
+        return { 'action' : 'local', 'shell' : step['shell'], 'commands' : step['commands'],
+                 'variables' : dist_combined_variables }
+    elif step['action'] == 'scp':
+        hosts = []
         for variable in dist_combined_variables:
-            shell = format(step['shell'], variable)
-            for command in step['commands']:
+            var = resolve_all_variables(step, variable)
+            if not var:
+                continue
+            if var['direction'].lower() not in scp_format.keys():
+                double_colored_print('Skipping this action...\nReason: Unsupported direction for scp: ',
+                                        var['direction'], tcolors.FAIL, tcolors.WARNING)
+                double_colored_print('Should be one of ', str(scp_format.keys()), tcolors.FAIL, tcolors.WARNING)
+                return None
+            hosts.append(var)
+        return { 'action' : 'scp', 'options' : dict((option, step[option]) for option in step_options['scp'] if option in step),
+                 'hosts' : hosts }
+    elif step['action'] == 'ssh':
+        dist_action_variables = get_distinct_subset(action_params, dist_combined_variables)
+        return { 'action' : 'ssh', 'options' : dict((option, step[option]) for option in step_options['ssh'] if option in step),
+                 'hosts' : get_ssh_hosts(step, action_params, dist_action_variables, dist_combined_variables) }
+    elif step['action'] == 'ssh-int':
+        return { 'action' : 'ssh-int', 'step' : step, 'action_params' : action_params,
+                 'variables' : get_distinct_subset(action_params, dist_combined_variables) }
+
+def run_action(action_plan):
+    '''Runs the plan of an action from plan_action()'''
+    if action_plan['action'] == 'local':
+        for variable in action_plan['variables']:
+            if multiplexer:
+                # ssh and scp in the local commands with the same {options} ride the master of the host
+                variable = multiplexer.connected(variable)
+            shell = format(action_plan['shell'], variable)
+            for command in action_plan['commands']:
                 command = format('{0} -c "{1}"'.format(shell, command), variable)
 
                 if not default_live_run:
                     double_colored_print('Command: ', command, tcolors.BOLD, tcolors.WARNING)
                     continue
+                if is_journaled('localhost', mask_credentials(command, variable)):
+                    double_colored_print('Skipping command: ', command, tcolors.BOLD, tcolors.WARNING)
+                    continue
 
                 double_colored_print('Running command: ', command, tcolors.BOLD, tcolors.WARNING)
+                started = timings.monotonic()
                 (command_output, exitstatus) = pexpect.run(command, withexitstatus=1)
+                record_phase('localhost', 'local', started)
+                journal_unit('localhost', mask_credentials(command, variable), exitstatus, exitstatus == 0, started)
                 if command_output:
                     colored_print('{0}'.format(command_output.rstrip()), tcolors.NORMAL)
                 if exitstatus == 0:
                     colored_print('Exit status: {0}'.format(exitstatus), tcolors.LGREEN)
                 else:
                     colored_print('Exit status: {0}'.format(exitstatus), tcolors.FAIL)
-    elif step['action'] == 'scp':
-        for variable in dist_combined_variables:
-            var = resolve_all_variables(step, variable)
-            if not var:
-                continue
-            if var['direction'].lower() not in scp_format.keys():
-                double_colored_print('Skipping this action...\nReason: Unsupported direction for scp: ',
-                                        var['direction'], tcolors.FAIL, tcolors.WARNING)
-                double_colored_print('Should be one of ', str(scp_format.keys()), tcolors.FAIL, tcolors.WARNING)
-                return
-            remote_scp(var, get_timeout_secs(var['timeout_secs']))
-    elif step['action'] == 'ssh' or step['action'] == 'ssh-int':
-        dist_action_variables = get_distinct_subset(action_params, variable_values)
-        for index, act_variable in enumerate(dist_action_variables):
-            var = resolve_all_variables(step, act_variable)
-            if not var:
-                continue
-            connection, response = expect_spawn(var, get_timeout_secs(var['timeout_secs']))
-            if connection:
-                if step['action'] == 'ssh':
-                    if default_live_run:
-                        if '\n' in response:
-                            split_res = response.rsplit('\n', 1)[0]
-                            if split_res:
-                                response = '\n' + response.rsplit('\n', 1)[-1]
-                        colored_print_without_newline(response, tcolors.NORMAL)
-                    else:
-                        colored_print('', tcolors.NORMAL)
-                    # Below filtering is needed to filter in only variables matching the loop action variable
-                    dist_commands_variables = get_filtered_variables(act_variable, dist_combined_variables)
-                    for cmd_variable in dist_commands_variables:
-                        for command in step['commands']:
-                            if not isinstance(command, list):
-                                command = format(command, cmd_variable)
-                            ret = run_ssh_command(connection, command, var)
-                            if not ret:
-                                connection.close()
-                                connection = None
-                        colored_print('', tcolors.NORMAL)
-                    if default_live_run:
-                        colored_print('', tcolors.NORMAL)
-                else: # step['action'] == 'ssh-int'
-                    commands = []
-                    timeout = 10
-                    colored_print_without_newline(response, tcolors.NORMAL)
-                    extra_prompt = "('exit' to end interactive ssh) > "
-                    colored_print_without_newline(extra_prompt, tcolors.BOLD)
-                    while True:
-                        command = raw_input()
-                        if '\x1b' in command:
-                            colored_print('Ignoring command ...', tcolors.BOLD)
-                            command = ''
-                        command = command.strip()
-                        connection.sendline(command)
-
-                        ret = connection.expect([var['shell_prompt'], pexpect.EOF, pexpect.TIMEOUT, var['sudo_password_prompt']], timeout=timeout)
-                        if ret == 3:
-                            colored_print_without_newline('Sending password ... ', tcolors.BOLD)
-                            connection.sendline(var['password'])
-                            colored_print('Done', tcolors.LGREEN)
-                            ret = connection.expect([var['shell_prompt'], pexpect.EOF, pexpect.TIMEOUT], timeout=timeout)
-
-                        response = trim_cr(connection.before) + trim_cr(connection.after)
-                        #if response.startswith(command):
-                        #    response = response[len(command):].lstrip()
-                        colored_print_without_newline(response, tcolors.NORMAL)
-                        if ret == 1:
-                            commands.append(command)
-                            colored_print('Exiting interative ssh ...\n', tcolors.BOLD)
-                            break
-                        elif ret == 2:
-                            command = [command, 'wait']
-                        else:
-                            res = response.rsplit('\n',1)
-                            if res:
-                                prompt = res[-1]
-                                if '{0}@'.format(var['username']) in prompt:
-                                    colored_print_without_newline(extra_prompt, tcolors.BOLD)
-                        commands.append(command)
-                    if len(dist_action_variables) > 1 and commands:
-                        res = raw_input('Run all these commands on rest of the hosts? [y]/n : ')
-                        colored_print('', tcolors.NORMAL)
-                        if not res or not (res.upper() == 'N' or res.upper() == 'NO'):
-                            step['action'] = 'ssh'
-                            step['commands'] = commands
-                            config_out = { "main" : [ "interative_ssh" ], "interative_ssh" : step }
-                            dump_json(config_out, 'interactive.json')
-                if connection:
-                    connection.close()
+    elif action_plan['action'] == 'scp':
+        hosts = skip_journaled(action_plan['hosts'], lambda var: var['hostname'])
+        if default_live_run:
+            hosts = preflight_hosts(action_plan.get('options', {}), hosts, lambda var: var)
+        for var in hosts:
+            started = timings.monotonic()
+            result = remote_scp(var, get_timeout_secs(var['timeout_secs']))
+            if result is not None:
+                journal_unit(var['hostname'], None, None, result, started)
+    elif action_plan['action'] == 'ssh':
+        run_ssh_hosts(dict(action_plan['options'], action='ssh'), action_plan['hosts'])
+    elif action_plan['action'] == 'ssh-int':
+        step = action_plan['step']
+        dist_action_variables = run_interactive_ssh(step, action_plan['variables'])
+        if step['action'] == 'ssh':
+            run_ssh_hosts(step, get_ssh_hosts(step, action_plan['action_params'], dist_action_variables,
+                                              dist_action_variables))
+
+def execute_action(action, step, variable_names, dict_variables, dependencies):
+    action_plan = plan_action(action, step, variable_names, dict_variables, dependencies)
+    if action_plan:
+        run_action(action_plan)
+
+def print_timings(summary):
+    '''Prints the stats of timings.Timings.summary() as a table per host, followed by all the hosts'''
+    row_format = '{0:<32} {1:<13} {2:>6} {3:>10} {4:>9} {5:>9} {6:>9} {7:>9}'
+    colored_print('\nTimings (seconds)', tcolors.BOLDHEADER)
+    colored_print(row_format.format('Host', 'Phase', 'Count', 'Total', 'p50', 'p95', 'p99', 'Max'), tcolors.BOLD)
+    rows = [(hostname, summary['hosts'][hostname]) for hostname in sorted(summary['hosts'])]
+    rows.append(('All hosts', summary['phases']))
+    for hostname, host_phases in rows:
+        for phase in sorted(host_phases, key=timings.phase_order):
+            stats = host_phases[phase]
+            colored_print(row_format.format(hostname, phase, stats['count'],
+                          '{0:.3f}'.format(stats['total']), '{0:.3f}'.format(stats['p50']),
+                          '{0:.3f}'.format(stats['p95']), '{0:.3f}'.format(stats['p99']),
+                          '{0:.3f}'.format(stats['max'])),
+                          tcolors.BOLD if hostname == 'All hosts' else tcolors.NORMAL)
+    if 'templates' in summary:
+        double_colored_print('\nTemplate cache: ', '{hits} hits, {misses} misses, {size} cached'.format(
+                             **summary['templates']), tcolors.BOLD, tcolors.NORMAL)
+
+def write_timings(summary, run_id, filename):
+    try:
+        with open(filename, 'w') as outfile:
+            double_colored_print('Writing timings: ', filename, tcolors.BOLD, tcolors.BOLDLGREEN)
+            json.dump({ 'run_id' : run_id, 'phases' : summary['phases'], 'hosts' : summary['hosts'],
+                        'templates' : summary.get('templates') }, outfile, indent=4, sort_keys=True)
+    except Exception as e:
+        double_colored_print('Unable to write the timings file: ', filename, tcolors.FAIL, tcolors.WARNING)
+        colored_print('Reason: {0}'.format(str(e)), tcolors.FAIL)
 
 def override_defaults_from_defaults_ini_file(live_run):
     global default_live_run
@@ -605,6 +1836,9 @@ def override_defaults_from_defaults_ini_file(live_run):
                 default_variables['username'] = def_prop['username']
             if 'password' in def_prop:
                 default_variables['password'] = def_prop['password']
+            for item in run_options:
+                if item in def_prop:
+                    run_options[item] = def_prop[item]
             if live_run:
                 default_live_run = True
             elif 'default_live_run' in def_prop:
@@ -616,6 +1850,13 @@ def override_defaults_from_defaults_ini_file(live_run):
         colored_print('Reason: {0}'.format(str(e)), tcolors.FAIL)
         colored_print('Proceeding with hard coded defaults.', tcolors.NORMAL)
 
+def override_run_options(options):
+    if not isinstance(options, dict):
+        return
+    for item in options:
+        if item in run_options and options[item] is not None:
+            run_options[item] = options[item]
+
 def replace_config_variables(config, new_variables):
     if not isinstance(new_variables, dict):
         return
@@ -633,14 +1874,104 @@ def replace_config_variables(config, new_variables):
             variables[org_key] = new_variables[org_key]
     config['variables'] = variables
 
-def execute(config, live_run, override_variables = None):
+def setup_run(live_run, options):
+    global session_pool
+    global multiplexer
+    global phase_timings
+    global admission_control
+    global latency_history
+    override_defaults_from_defaults_ini_file(live_run)
+    override_run_options(options)
+    if run_options['engine'] not in engines:
+        double_colored_print('Unsupported engine: ', str(run_options['engine']), tcolors.FAIL, tcolors.WARNING)
+        double_colored_print('Should be one of ', str(engines), tcolors.FAIL, tcolors.WARNING)
+        sys.exit(1)
+    if run_options['completion'] not in completions:
+        double_colored_print('Unsupported completion: ', str(run_options['completion']), tcolors.FAIL, tcolors.WARNING)
+        double_colored_print('Should be one of ', str(completions), tcolors.FAIL, tcolors.WARNING)
+        sys.exit(1)
+    if is_true(run_options['reuse_sessions']):
+        session_pool = SessionPool()
+    if is_true(run_options['multiplex']):
+        multiplexer = Multiplexer()
+    if is_true(run_options['timings']) or run_options['timings_file']:
+        phase_timings = timings.Timings()
+    admission_control = admission.Admission(run_options['connect_rate'], run_options['connect_burst'],
+                                            run_options['max_startups'])
+    if is_true(run_options['adaptive_timeouts']):
+        latency_history = latency.LatencyHistory(run_options['latency_file'])
+
+def open_journal(run_id):
+    '''Loads the journal of the run being resumed, if any, and opens the journal of a live run'''
+    global run_journal
+    global journal_units
+    path = journal.get_path(run_options['journal_dir'], run_id)
+    if run_options['resume'] or run_options['rerun_failed']:
+        try:
+            journal_units = journal.load(path)
+        except (IOError, OSError) as e:
+            double_colored_print('Unable to read the journal of the run: ', run_id, tcolors.FAIL, tcolors.WARNING)
+            colored_print('Reason: {0}'.format(str(e)), tcolors.FAIL)
+            sys.exit(1)
+    enabled = run_options['journal']
+    if enabled is None:
+        enabled = bool(run_options['resume'] or run_options['rerun_failed'])
+    if default_live_run and is_true(enabled):
+        try:
+            run_journal = journal.Journal(path)
+        except (IOError, OSError) as e:
+            double_colored_print('Unable to write the journal: ', path, tcolors.FAIL, tcolors.WARNING)
+            colored_print('Reason: {0}'.format(str(e)), tcolors.FAIL)
+
+def close_run():
+    if session_pool:
+        session_pool.close_all()
+    if multiplexer:
+        multiplexer.close_all()
+    if run_journal:
+        run_journal.close()
+    if latency_history:
+        try:
+            latency_history.save()
+        except (IOError, OSError) as e:
+            double_colored_print('Unable to write the latency history: ', latency_history.path, tcolors.FAIL,
+                                 tcolors.WARNING)
+            colored_print('Reason: {0}'.format(str(e)), tcolors.FAIL)
+
+def complete_run(run_id):
+    if phase_timings:
+        summary = phase_timings.summary()
+        summary['templates'] = templates.get_stats()
+        print_timings(summary)
+        if run_options['timings_file']:
+            write_timings(summary, run_id, run_options['timings_file'])
+    double_colored_print('\nCompleted with RUN ID : ', run_id, tcolors.BOLD, tcolors.BOLDLGREEN)
+    colored_print('', tcolors.BOLD)
+
+def execute(config, live_run, override_variables = None, options = None):
     if not config or 'main' not in config:
         colored_print('Nothing configured to execute. Could not find "main" in the config.', tcolors.FAIL)
         sys.exit(1)
-    override_defaults_from_defaults_ini_file(live_run)
+    setup_run(live_run, options)
+    previous_run = run_options['resume'] or run_options['rerun_failed']
+    if previous_run:
+        # Resolved with the same run_id, the commands are the same as in the journal
+        override_variables = dict(override_variables or {}, run_id=previous_run)
     replace_config_variables(config, override_variables)
+    if is_true(run_options['plan_cache']):
+        execute_cached(config)
+        return
+
+    run_id, variable_names, dict_variables, dependencies = load_variables(config)
+    open_journal(run_id)
+    try:
+        execute_steps(config, variable_names, dict_variables, dependencies)
+    finally:
+        close_run()
+    complete_run(run_id)
 
-    run_id, variable_names, variable_values = load_variables(config)
+def get_steps(config):
+    '''Yields (index, name, step) of each step of main which can be run'''
     for index, step_name in enumerate(config['main']):
         if not step_name.strip():
             colored_print("\n{0}. Skipping action... '{1}' : Blank action name not supported".format(index+1, step_name), tcolors.HEADER)
@@ -658,16 +1989,252 @@ def execute(config, live_run, override_variables = None):
         if action not in action_mandatory_params.keys():
             colored_print("\n{0}. Skipping action... '{1}' : Unsupported action type '{2}'".format(index+1, step_name, action), tcolors.HEADER)
             continue
+        yield index, step_name, step
 
-        message1 = '\n{0}. Running action... '.format(index + 1)
-        message2 = '{0} ({1})'.format(step_name, action)
-        double_colored_print(message1, message2, tcolors.HEADER, tcolors.BOLDHEADER)
-        colored_print('{0}\n'.format('-'*(len(message1 + message2)-1)), tcolors.HEADER)
+def print_step_header(index, step_name, action, doing='Running'):
+    message1 = '\n{0}. {1} action... '.format(index + 1, doing)
+    message2 = '{0} ({1})'.format(step_name, action)
+    double_colored_print(message1, message2, tcolors.HEADER, tcolors.BOLDHEADER)
+    colored_print('{0}\n'.format('-'*(len(message1 + message2)-1)), tcolors.HEADER)
 
-        execute_action(action, step, variable_names, variable_values)
-    double_colored_print('\nCompleted with RUN ID : ', run_id, tcolors.BOLD, tcolors.BOLDLGREEN)
+def execute_steps(config, variable_names, dict_variables, dependencies):
+    global current_step
+    for index, step_name, step in get_steps(config):
+        current_step = step_name
+        print_step_header(index, step_name, step['action'])
+        execute_action(step['action'], step, variable_names, dict_variables, dependencies)
+
+def load_plan_variables(config, prompt_credentials):
+    '''Returns the run id, the variables of populate_defaults() and the plans.Credentials of a plan of the
+    config. Unless a run_id is given, the plan has a reference to the run_id, which is set when it is run'''
+    variables = config.setdefault('variables', {})
+    if not any(key == 'run_id' or key.endswith('.run_id') for key in variables):
+        variables['run_id'] = plans.run_id_reference
+    run_id, variables = populate_defaults(config, prompt_credentials)
+    values = []
+    for name in variables:
+        if name.rsplit('.', 1)[-1] in plans.credential_names:
+            values.extend(value for value in (variables[name] if isinstance(variables[name], list)
+                                              else [variables[name]]) if isinstance(value, (str, unicode)))
+    for step in config.values():
+        if isinstance(step, dict):
+            values.extend(step[name] for name in plans.credential_names if isinstance(step.get(name), (str, unicode)))
+    return run_id, variables, plans.Credentials(value for value in values if not var_regex.search(value))
+
+def build_plan(config, variables, credentials, print_headers=True):
+    '''Returns the plans of the steps of the config, with the credentials as references'''
+    variable_names, dict_variables, dependencies = index_variables(variables)
+    credentials.reference_variables(dict_variables)
+    steps = []
+    for index, step_name, step in get_steps(config):
+        if print_headers:
+            print_step_header(index, step_name, step['action'], 'Planning')
+        action_plan = plan_action(step['action'], step, variable_names, dict_variables, dependencies)
+        if not action_plan:
+            continue
+        for var in action_plan.get('hosts', []):
+            credentials.reference_host(var[0] if isinstance(var, list) else var)
+        for var in action_plan.get('variables', []) if action_plan['action'] == 'ssh-int' else []:
+            credentials.reference_host(var)
+        if print_headers:
+            colored_print('{0} host(s)'.format(len(action_plan.get('hosts', action_plan.get('variables', [])))),
+                          tcolors.NORMAL)
+        steps.append(dict(action_plan, index=index, name=step_name))
+    return steps
+
+def compile_plan(config, plan_file, override_variables = None):
+    '''Resolves the variables of the config and validates and expands its steps into a plan file, which
+    apply_plan() runs without resolving the config again. The credentials are written as references'''
+    if not config or 'main' not in config:
+        colored_print('Nothing configured to plan. Could not find "main" in the config.', tcolors.FAIL)
+        sys.exit(1)
+    override_defaults_from_defaults_ini_file(False)
+    replace_config_variables(config, override_variables)
+    run_id, variables, credentials = load_plan_variables(config, prompt_credentials=False)
+    steps = build_plan(config, variables, credentials)
+    try:
+        plans.write_plan(plan_file, run_id, credentials, steps)
+    except (IOError, OSError) as e:
+        double_colored_print('Unable to write the plan file: ', plan_file, tcolors.FAIL, tcolors.WARNING)
+        colored_print('Reason: {0}'.format(str(e)), tcolors.FAIL)
+        sys.exit(1)
+    double_colored_print('\nPlan of {0} action(s) written to: '.format(len(steps)), plan_file, tcolors.BOLD,
+                         tcolors.BOLDLGREEN)
     colored_print('', tcolors.BOLD)
 
+def run_plan_steps(steps, credential_values, run_id):
+    global current_step
+    for action_plan in steps:
+        current_step = action_plan['name']
+        print_step_header(action_plan['index'], action_plan['name'], action_plan['action'])
+        run_action(plans.insert_values(action_plan, credential_values, run_id))
+
+def execute_cached(config):
+    '''Runs the config from its plan in the plan cache. The plan is built and cached when the config, its
+    variables (after default_properties.json, the overrides and the prompts) or the structure of its
+    credentials changed'''
+    run_id, variables, credentials = load_plan_variables(config, prompt_credentials=True)
+    cache = plans.PlanCache(run_options['plan_cache_dir'], float(run_options['plan_cache_mb']) * 1024 * 1024)
+    key = plans.get_cache_key(config, variables, credentials)
+    credential_values = credentials.get_values()
+    steps = None
+    plan_file = cache.get(key)
+    if plan_file:
+        try:
+            header, steps = plans.read_plan(plan_file)
+            if any(credential_id not in credential_values for credential_id in header['credentials']):
+                steps = None
+        except (IOError, OSError, ValueError):
+            steps = None
+        if steps is None:
+            cache.remove(key)
+        else:
+            double_colored_print('Using the cached plan: ', plan_file, tcolors.BOLD, tcolors.LGREEN)
+    if steps is None:
+        steps = build_plan(config, variables, credentials, print_headers=False)
+        credential_values = credentials.get_values()
+        try:
+            plan_file = cache.put(key, run_id, credentials, steps)
+            double_colored_print('Cached the plan: ', plan_file, tcolors.BOLD, tcolors.LGREEN)
+        except (IOError, OSError) as e:
+            double_colored_print('Unable to cache the plan in: ', run_options['plan_cache_dir'], tcolors.FAIL,
+                                 tcolors.WARNING)
+            colored_print('Reason: {0}'.format(str(e)), tcolors.FAIL)
+    if run_id == plans.run_id_reference:
+        run_id = generate_run_id()
+    open_journal(run_id)
+    try:
+        run_plan_steps(steps, credential_values, run_id)
+    finally:
+        close_run()
+    complete_run(run_id)
+
+def get_credential_values(descriptions, password = None):
+    '''Returns the value of each credential referenced by a plan: the password given, else the password of
+    default_properties.json, else the one entered by the user'''
+    values = {}
+    default_password = default_variables.get('password')
+    for credential_id in sorted(descriptions, key=int):
+        description = descriptions[credential_id]
+        if password:
+            values[credential_id] = password
+        elif isinstance(default_password, (str, unicode)) and default_password and \
+                not default_password.startswith((':p?', ':pp?')):
+            values[credential_id] = default_password
+        else:
+            values[credential_id] = prompt(':pp?', 'Enter the {0} of {1}{2}{3} for {4} host(s) [exit]: '.format(
+                                           description['name'], tcolors.BOLD, description['username'] or '',
+                                           tcolors.NORMAL, description['hosts']))
+    return values
+
+def apply_plan(plan_file, live_run, options = None, password = None):
+    '''Runs the steps of a plan file from compile_plan(), as they are read'''
+    try:
+        header, steps = plans.read_plan(plan_file)
+    except (IOError, OSError, ValueError) as e:
+        double_colored_print('Unable to read the plan file: ', plan_file, tcolors.FAIL, tcolors.WARNING)
+        colored_print('Reason: {0}'.format(str(e)), tcolors.FAIL)
+        sys.exit(1)
+    double_colored_print('\nApplying plan: ', plan_file + '\n', tcolors.BOLD, tcolors.BOLDLGREEN)
+    setup_run(live_run, options)
+    credential_values = get_credential_values(header['credentials'], password)
+    run_id = header['run_id']
+    if run_options['resume'] or run_options['rerun_failed']:
+        run_id = run_options['resume'] or run_options['rerun_failed']
+    elif run_id == plans.run_id_reference:
+        run_id = generate_run_id()
+    open_journal(run_id)
+    try:
+        run_plan_steps(steps, credential_values, run_id)
+    finally:
+        close_run()
+    complete_run(run_id)
+
+def add_run_arguments(parser, plan_cache=True):
+    '''Adds the arguments of the run options to parser. Shared by main() and the subcommands of run_remote.py,
+    which pass the parsed arguments to get_run_options()'''
+    parser.add_argument('--parallel', dest='parallel', type=int, help='Number of hosts a ssh action runs on at ' \
+                        'the same time. Default: 1. Use 0 to run on all the hosts at once')
+    parser.add_argument('--engine', dest='engine', choices=engines, help='How parallel hosts are run. "thread" ' \
+                        'uses a worker thread per host, "async" drives all the ssh sessions from a single thread. ' \
+                        'Default: thread')
+    parser.add_argument('--reuse-sessions', dest='reuse_sessions', action='store_true', default=None,
+                        help='Keep the ssh connections open between the actions and reuse them for the later ssh ' \
+                        'actions on the same host. The shell state (like the current directory) is kept between ' \
+                        'the actions')
+    parser.add_argument('--multiplex', dest='multiplex', action='store_true', default=None,
+                        help='Open one OpenSSH ControlMaster connection per host and run the ssh, scp and local ' \
+                        'actions over it, without connecting and sending the password again')
+    parser.add_argument('--completion', dest='completion', choices=completions, help='How the end of a ssh ' \
+                        'command is found. "sentinel" makes bash print a unique sentinel with the exit status ' \
+                        'after each command, "prompt" waits for the shell_prompt regex. Default: sentinel')
+    parser.add_argument('--batch', dest='batch', action='store_true', default=None,
+                        help='Send all the commands of a ssh action to each host at once, as one script, instead ' \
+                        'of waiting for each command to complete before sending the next')
+    parser.add_argument('--exec', dest='exec_mode', action='store_true', default=None,
+                        help='Run each command of a ssh action with "ssh -o BatchMode=yes host command" without ' \
+                        'a pty, for the hosts which authenticate with keys or an agent (or over --multiplex). The ' \
+                        'commands do not share a shell')
+    parser.add_argument('--timings', dest='timings', action='store_true', default=None,
+                        help='Print how long each phase (spawn, first_prompt, auth, master, command, scp and ' \
+                        'local) took, per host and for all the hosts: count, total, p50, p95, p99 and max in ' \
+                        'seconds, and the hits and misses of the template cache')
+    parser.add_argument('--timings-file', dest='timings_file', help='Write the timings of the phases as JSON to ' \
+                        'this file')
+    if plan_cache:
+        parser.add_argument('--plan-cache', dest='plan_cache', action='store_true', default=None,
+                            help='Keep the plan of the config in the plan cache (plan_cache_dir of ' \
+                            'default_properties.json, default ~/.remote_commands/plans) and skip resolving the ' \
+                            'config when it is run again with the same variables')
+    journal_group = parser.add_mutually_exclusive_group()
+    journal_group.add_argument('--journal', dest='journal', action='store_true', default=None,
+                               help='Record the outcome of each command and host of a live run in the journal of ' \
+                               'its run_id (journal_dir of default_properties.json, default ' \
+                               '~/.remote_commands/journals), so that it can be resumed with --resume or ' \
+                               '--rerun-failed. A resumed run carries on its journal')
+    journal_group.add_argument('--no-journal', dest='journal', action='store_false', default=None,
+                               help='Do not record the journal, even for a resumed run')
+    parser.add_argument('--preflight', dest='preflight', action='store_true', default=None,
+                        help='Before each ssh and scp action, probe the ssh port of all its hosts at once and skip ' \
+                        'the hosts which do not accept the connection within preflight_secs (default 3) instead ' \
+                        'of waiting timeout_secs for each of them. A step can opt out with "preflight" : "false"')
+    parser.add_argument('--connect-rate', dest='connect_rate', type=float, help='New ssh connections started ' \
+                        'per second, across all the hosts. Default: 0 (no limit)')
+    parser.add_argument('--max-startups', dest='max_startups', type=int, help='Handshakes in flight at the same ' \
+                        'time to the same host, or to the same jump host (-J or ProxyJump in the options), to stay ' \
+                        'within sshd MaxStartups. Default: 10, 0 for no limit')
+    parser.add_argument('--connect-retries', dest='connect_retries', type=int, help='Retries of a ssh connection ' \
+                        'reset before the banner, after a jittered exponential backoff from connect_backoff_secs ' \
+                        '(default 0.5). Default: 3')
+    timeouts_group = parser.add_mutually_exclusive_group()
+    timeouts_group.add_argument('--adaptive-timeouts', dest='adaptive_timeouts', action='store_true', default=None,
+                                help='Learn how long each host takes to connect, in the history of latency_file of ' \
+                                'default_properties.json (default ~/.remote_commands/latency.json), and connect ' \
+                                'with the timeouts learned from it, reporting the hosts slower than their history')
+    timeouts_group.add_argument('--fixed-timeouts', dest='adaptive_timeouts', action='store_false', default=None,
+                                help='Wait timeout_secs for every host, even with "adaptive_timeouts" : "true" in ' \
+                                'default_properties.json')
+    parser.add_argument('--fixed-send-delay', dest='echo_sync', action='store_false', default=None,
+                        help='Sleep 50 ms before each send (the password and every command), instead of sending ' \
+                        'as soon as the tty of the connection has echo off')
+    resume_group = parser.add_mutually_exclusive_group()
+    resume_group.add_argument('--resume', dest='resume', metavar='RUN_ID', help='Run again with the run_id of a ' \
+                              'run which was stopped, skipping the hosts (and local commands) of each action which ' \
+                              'it completed')
+    resume_group.add_argument('--rerun-failed', dest='rerun_failed', metavar='RUN_ID', help='Run again with the ' \
+                              'run_id of a run, only on the hosts (and local commands) of each action which failed ' \
+                              'or did not complete')
+
+def get_run_options(args):
+    '''Returns the run options of the arguments added by add_run_arguments(), None for the ones not given'''
+    return { 'parallel' : args.parallel, 'engine' : args.engine, 'reuse_sessions' : args.reuse_sessions,
+             'multiplex' : args.multiplex, 'completion' : args.completion, 'batch' : args.batch,
+             'exec' : args.exec_mode, 'timings' : args.timings, 'timings_file' : args.timings_file,
+             'plan_cache' : getattr(args, 'plan_cache', None), 'journal' : args.journal, 'resume' : args.resume,
+             'rerun_failed' : args.rerun_failed, 'preflight' : args.preflight, 'connect_rate' : args.connect_rate,
+             'max_startups' : args.max_startups, 'connect_retries' : args.connect_retries,
+             'adaptive_timeouts' : args.adaptive_timeouts, 'echo_sync' : args.echo_sync }
+
 def main():
     live_run_desc = 'The program is capable of running any UNIX command on any host with credentials. ' \
                     'To AVOID any unwanted consequences of running certain non-recoverable commands like "rm -fr", ' \
@@ -675,9 +2242,17 @@ def main():
                     'will ONLY output all the resolved commands.'
     description = 'Version %s. \nScript to execute configured commands in local and remote hosts. ' \
                   'The program is capable of running any UNIX command on any host with credentials.' % version
+    plan_desc = 'Resolve the config into this plan file instead of running it. The plan has the commands of ' \
+                'every step and host, with the passwords as references, and is run with --apply'
+    apply_desc = 'Run a plan file written by --plan, without resolving the config again. The passwords come ' \
+                 'from default_properties.json or are asked for'
     parser = argparse.ArgumentParser(description=description)
-    parser.add_argument('-f', '--conf-file', dest='conf_file', help='Name of the config file in JSON format', required=True)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('-f', '--conf-file', dest='conf_file', help='Name of the config file in JSON format')
+    group.add_argument('--apply', dest='apply_file', help=apply_desc)
+    parser.add_argument('--plan', dest='plan_file', help=plan_desc)
     parser.add_argument('--live-run', dest='live_run', help=live_run_desc, action='store_true')
+    add_run_arguments(parser)
     args = parser.parse_args()
 
     '''  TO BE IMPLEMENTED
@@ -697,9 +2272,15 @@ def main():
     logger.critical("This is critical")
     '''
 
+    options = get_run_options(args)
+    if args.apply_file:
+        apply_plan(args.apply_file, args.live_run, options)
+        return
     config = load_config(args.conf_file)
-    if config:
-        execute(config, args.live_run)
+    if config and args.plan_file:
+        compile_plan(config, args.plan_file)
+    elif config:
+        execute(config, args.live_run, options=options)
 
 if __name__ == "__main__":
 	main()
@@ -20,19 +20,26 @@ import ambari
 version = '2.0'
 
 def main():
-    def add_common_arguments(subparser):
+    def add_run_arguments(subparser, plan_cache=True):
         description = 'The program is capable of running any UNIX command on any host with credentials. ' \
                       'To AVOID any unwanted consequences of running certain non-recoverable commands ' \
                       'like "rm -fr", the program will EXECUTE the commands only if this flag is enabled. ' \
                       'If False, the program will ONLY print all the resolved commands.'
 
+        subparser.add_argument('--live-run', dest='live_run', help=description, action='store_true')
+        remote.add_run_arguments(subparser, plan_cache)
+
+    def add_common_arguments(subparser):
         subparser.add_argument('-u', '--username', dest='username', help='SSH username to connect to hosts', required=False)
         subparser.add_argument('-p', '--password', dest='password', help='SSH password to connect to hosts', required=False)
         subparser.add_argument('--run-id', dest='run_id', help='Unique RUN ID. Default: Will be automatically ' \
                                'generated in the format RID_YYYYMMDD_HHMISS_UTC. "run_id" can be used inside the ' \
                                'config file as a variable to create unique directories/filenames etc to uniquely ' \
                                'identify a run instance', required=False)
-        subparser.add_argument('--live-run', dest='live_run', help=description, action='store_true')
+        add_run_arguments(subparser)
+        subparser.add_argument('--plan', dest='plan_file', help='Resolve the config into this plan file instead ' \
+                               'of running it. The plan has the commands of every step and host, with the ' \
+                               'passwords as references, and is run with the apply subcommand', required=False)
         or_group = subparser.add_argument_group(title='only one or the other')
         group = or_group.add_mutually_exclusive_group(required=False)
         group.add_argument('-f', '--conf-file', dest='conf_file', help='Name of the config file in JSON format')
@@ -90,8 +97,23 @@ def main():
     ambari_group.add_argument('-s', '--service', help='Service Name', required=False)
     ambari_group.add_argument('-c', '--component', help='Component Name', required=False)
 
+    description = 'Runs a plan file written with --plan, without resolving the config again'
+    apply_parser = subparsers.add_parser('apply', help=description)
+    apply_parser.add_argument('plan_file', help='Plan file written with --plan')
+    apply_parser.add_argument('-p', '--password', dest='password', help='SSH password of all the hosts of the ' \
+                              'plan. Default: the password of default_properties.json, else asked for each ' \
+                              'password of the plan', required=False)
+    add_run_arguments(apply_parser, plan_cache=False)
+
     args = parser.parse_args()
 
+    options = remote.get_run_options(args)
+    if args.command == 'apply':
+        if args.password and args.password.startswith((':p', ':pp?')):
+            args.password = remote.prompt(args.password, 'Enter ssh password [exit]: ')
+        remote.apply_plan(args.plan_file, args.live_run, options, args.password)
+        sys.exit(0)
+
     if args.username and args.username.startswith((':p', ':pp?')):
         args.username = remote.prompt(args.username, 'Enter ssh username [exit]: ')
 
@@ -123,7 +145,10 @@ def main():
         remote.print_json( { 'variables' : variables }, 'variables (json)' )
         sys.exit(0)
 
-    remote.execute(config, args.live_run, variables)
+    if args.plan_file:
+        remote.compile_plan(config, args.plan_file, variables)
+    else:
+        remote.execute(config, args.live_run, variables, options)
 
 #### Program Start ####
 
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+########################################################################################
+# For any questions or suggestions please contact : Ajmal Yusuf <ayusuf@hortonworks.com>
+########################################################################################
+
+'''
+Compiles the {variable} templates of the config once and renders them with a join, instead of parsing
+them with str.format() on every call.
+'''
+
+import string
+import threading
+
+# Compiled templates kept before the cache is emptied, as every host can add its own resolved commands
+CACHE_SIZE = 10000
+
+formatter = string.Formatter()
+
+class Template(object):
+    '''A template parsed by string.Formatter().parse(). The names of the {fields} it references are in
+    fields. A template with only plain {name} fields is rendered by joining its literals with the values;
+    any other field ({0}, {a.b}, {a!r}, {a:>10}) is rendered by str.format()'''
+    def __init__(self, text):
+        self.text = text
+        self.parts = []
+        self.fields = []
+        self.simple = True
+        for literal, field_name, format_spec, conversion in formatter.parse(text):
+            if literal:
+                self.parts.append((literal, None))
+            if field_name is None:
+                continue
+            name = field_name.split('.', 1)[0].split('[', 1)[0]
+            if name and name not in self.fields:
+                self.fields.append(name)
+            # A format_spec can reference fields too, like {a:{width}}
+            for name in (Template(format_spec).fields if '{' in format_spec else []):
+                if name not in self.fields:
+                    self.fields.append(name)
+            if format_spec or conversion or name != field_name or not name or name.isdigit():
+                self.simple = False
+            self.parts.append((None, field_name))
+
+    def render(self, variables):
+        if not self.simple:
+            return self.text.format(**variables)
+        values = []
+        for literal, name in self.parts:
+            if name is None:
+                values.append(literal)
+            else:
+                value = variables[name]
+                if not isinstance(value, basestring):
+                    value = format(value, '')
+                # Like str.format(), a str template renders str and a unicode template renders unicode
+                values.append(value if isinstance(value, type(self.text)) else type(self.text)(value))
+        return ''.join(values)
+
+cache = {}
+stats = { 'hits' : 0, 'misses' : 0 }
+cache_lock = threading.Lock()
+
+def compile_template(text):
+    '''Returns the compiled Template of text, from the cache if it was compiled before'''
+    # str and unicode templates are equal but render different types
+    key = (type(text), text)
+    with cache_lock:
+        template = cache.get(key)
+        if template is not None:
+            stats['hits'] += 1
+            return template
+        stats['misses'] += 1
+    template = Template(text)
+    with cache_lock:
+        if len(cache) >= CACHE_SIZE:
+            cache.clear()
+        cache[key] = template
+    return template
+
+def render(text, variables):
+    return compile_template(text).render(variables)
+
+def get_fields(text):
+    '''Returns the names of the variables referenced by text'''
+    return compile_template(text).fields
+
+def get_stats():
+    with cache_lock:
+        return { 'hits' : stats['hits'], 'misses' : stats['misses'], 'size' : len(cache) }
@@ -0,0 +1,122 @@
+'''Tests of the admission control of the new connections, with a clock moved
+by the tests'''
+
+import random
+import unittest
+
+import admission
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class AdmissionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+
+    def admission(self, **kwargs):
+        return admission.Admission(clock=self.clock, **kwargs)
+
+    def test_no_limit(self):
+        control = self.admission()
+        self.assertEqual([control.acquire('h') for index in range(100)], [0] * 100)
+
+    def test_rate(self):
+        control = self.admission(rate=4, burst=1)
+        self.assertEqual(control.acquire('h1'), 0)
+        self.assertEqual(control.acquire('h2'), 0.25)
+        self.clock.now += 0.125
+        self.assertEqual(control.acquire('h2'), 0.125)
+        self.clock.now += 0.125
+        self.assertEqual(control.acquire('h2'), 0)
+        self.assertEqual(control.acquire('h3'), 0.25)
+
+    def test_burst(self):
+        control = self.admission(rate=2, burst=3)
+        self.assertEqual([control.acquire('h') for index in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(control.acquire('h'), 0.5)
+        # The tokens do not pile up beyond the burst
+        self.clock.now += 60
+        self.assertEqual([control.acquire('h') for index in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(control.acquire('h'), 0.5)
+
+    def test_burst_defaults_to_rate(self):
+        control = self.admission(rate=5)
+        self.assertEqual([control.acquire('h') for index in range(5)], [0] * 5)
+        self.assertAlmostEqual(control.acquire('h'), 0.2)
+        self.assertEqual(self.admission(rate=0.5).burst, 1)
+
+    def test_per_target(self):
+        control = self.admission(per_target=2)
+        self.assertEqual([control.acquire('h1') for index in range(2)], [0, 0])
+        self.assertEqual(control.acquire('h1'), admission.RETRY_SECS)
+        self.assertEqual(control.acquire('jump'), 0)
+        control.release('h1')
+        self.assertEqual(control.acquire('h1'), 0)
+        self.assertEqual(control.acquire('h1'), admission.RETRY_SECS)
+
+    def test_release(self):
+        control = self.admission(per_target=1)
+        control.acquire('h1')
+        control.release('h1')
+        control.release('h1')
+        self.assertEqual(control.in_flight, {})
+        self.assertEqual(control.acquire('h1'), 0)
+        self.assertEqual(control.acquire('h1'), admission.RETRY_SECS)
+
+    def test_refused_target_takes_no_token(self):
+        control = self.admission(rate=1, burst=2, per_target=1)
+        self.assertEqual(control.acquire('h1'), 0)
+        self.assertEqual(control.acquire('h1'), admission.RETRY_SECS)
+        self.assertEqual(control.acquire('h2'), 0)
+        self.assertAlmostEqual(control.acquire('h3'), 1)
+
+
+class BackoffTest(unittest.TestCase):
+
+    def test_bounds(self):
+        random.seed(1)
+        for attempt in range(12):
+            limit = min(admission.MAX_BACKOFF_SECS, 0.5 * 2 ** attempt)
+            waits = [admission.get_backoff(attempt, 0.5) for index in range(200)]
+            self.assertTrue(min(waits) >= 0)
+            self.assertTrue(max(waits) <= limit)
+            # Spread over the whole range, so the retries do not come back together
+            self.assertTrue(min(waits) < limit * 0.1, (attempt, min(waits)))
+            self.assertTrue(max(waits) > limit * 0.9, (attempt, max(waits)))
+
+
+class JumpTest(unittest.TestCase):
+
+    def test_get_jump(self):
+        cases = [
+            ('', None),
+            (None, None),
+            ('-o CheckHostIP=no', None),
+            ('-J jump', ('jump', None)),
+            ('-Juser@jump:2222', ('jump', 2222)),
+            ('-J jump1:22,jump2:23', ('jump1', 22)),
+            ('-o ProxyJump=ssh://user@jump:2200', ('jump', 2200)),
+            ('-oProxyJump jump', ('jump', None)),
+            ('-o proxyjump=[::1]:2222', ('::1', 2222)),
+            ('-J [fe80::1]', ('fe80::1', None)),
+            ('-o ProxyJump=none', None),
+            ('-p 2222 -J a@b@jump', ('jump', None)),
+        ]
+        for options, jump in cases:
+            self.assertEqual(admission.get_jump(options), jump, options)
+
+    def test_get_target(self):
+        self.assertEqual(admission.get_target('h1', '-p 22'), 'h1')
+        self.assertEqual(admission.get_target('h1', '-J user@jump:22'), 'jump')
+
+
+if __name__ == '__main__':
+    unittest.main()
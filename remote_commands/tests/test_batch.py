@@ -0,0 +1,92 @@
+'''Tests of the batches of commands, run in a local bash instead of over ssh'''
+
+import os
+import unittest
+
+import pexpect
+import remote
+
+
+class FakePool(object):
+
+    def __init__(self):
+        self.connections = []
+
+    def put(self, var, connection):
+        self.connections.append(connection)
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connections = []
+        self.live_run = remote.default_live_run
+        self.connect_session = remote.connect_session
+        remote.default_live_run = True
+        remote.connect_session = self.connect_bash
+        remote.session_pool = FakePool()
+        remote.output_buffer.messages = []
+        self.var = dict(remote.default_variables, hostname='localhost',
+                        username='user', password='password')
+
+    def tearDown(self):
+        remote.default_live_run = self.live_run
+        remote.connect_session = self.connect_session
+        remote.session_pool = None
+        remote.output_buffer.messages = None
+        for connection in self.connections:
+            connection.close()
+
+    def connect_bash(self, var, timeout):
+        env = dict(os.environ, PS1='$ ')
+        connection = pexpect.spawn('bash', ['--norc', '--noprofile', '--noediting', '-i'],
+                                   env=env, echo=False, timeout=5)
+        self.connections.append(connection)
+        yield remote.Expect(connection, var['shell_prompt'])
+        yield remote.sentinel_setup_session(connection, var)
+        yield remote.Return((connection, ''))
+
+    def connect(self):
+        return remote.run_session(self.connect_bash(self.var, 5))[0]
+
+    def run_batch(self, connection, commands):
+        return remote.run_session(remote.ssh_batch_session(connection, commands, self.var))
+
+    def run_host(self, command_groups):
+        step = {'batch': 'true'}
+        return remote.run_session(remote.ssh_host_session(step, self.var, command_groups))
+
+    def test_batch(self):
+        connection = self.connect()
+        self.assertEqual(self.run_batch(connection, ['cd /', 'pwd', 'false']), (3, False))
+        self.assertTrue('/\n' in ''.join(remote.output_buffer.messages))
+        self.assertTrue(connection.isalive())
+        # The sentinels are still counted right after the batch
+        self.assertEqual(self.run_batch(connection, ['echo a', 'echo b']), (2, False))
+
+    def test_lost_on_the_last_command(self):
+        connection = self.connect()
+        self.assertEqual(self.run_batch(connection, ['echo a', 'exit']), (2, True))
+
+    def test_lost_before_the_last_command(self):
+        connection = self.connect()
+        self.assertEqual(self.run_batch(connection, ['exit', 'echo a']), (1, True))
+
+    def test_host_connection_lost_on_the_last_command(self):
+        # Not a failure, but the connection is not reused
+        self.assertTrue(self.run_host([['echo a', 'exit']]))
+        self.assertEqual(remote.session_pool.connections, [])
+        self.assertTrue(self.connections[0].closed)
+
+    def test_host_connection_lost_before_a_later_group(self):
+        self.assertFalse(self.run_host([['echo a', 'exit'], ['echo b', 'echo c']]))
+        self.assertEqual(remote.session_pool.connections, [])
+        self.assertTrue('No connection' in ''.join(remote.output_buffer.messages))
+
+    def test_host_connection_kept(self):
+        self.assertTrue(self.run_host([['echo a', 'echo b'], ['echo c', 'echo d']]))
+        self.assertEqual(remote.session_pool.connections, self.connections)
+
+
+if __name__ == '__main__':
+    unittest.main()
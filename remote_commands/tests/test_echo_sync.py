@@ -0,0 +1,80 @@
+'''Tests of spawn(echo_sync=True), with a child which turns echo off late'''
+
+import sys
+import time
+import unittest
+
+import pexpect
+
+# Prints its prompt, then turns echo off (flushing the input) after 'delay'
+# seconds, like a program which asks for a password the careless way
+reader = '''
+import sys, termios, time
+sys.stdout.write('Password: ')
+sys.stdout.flush()
+time.sleep(float(sys.argv[1]))
+fd = sys.stdin.fileno()
+attrs = termios.tcgetattr(fd)
+attrs[3] &= ~termios.ECHO
+termios.tcsetattr(fd, termios.TCSAFLUSH, attrs)
+sys.stdout.write('reading\\n')
+sys.stdout.flush()
+sys.stdout.write('got ' + sys.stdin.readline())
+sys.stdout.flush()
+'''
+
+
+class EchoSyncTest(unittest.TestCase):
+
+    def spawn(self, delay, **kwargs):
+        child = pexpect.spawn(sys.executable, ['-c', reader, str(delay)],
+                              timeout=5, **kwargs)
+        self.addCleanup(child.close)
+        child.expect('Password: ')
+        return child
+
+    def test_send_waits_for_echo_off(self):
+        child = self.spawn(0.3, echo_sync=True)
+        child.delaybeforesend = 3
+        self.assertFalse(child.is_reading())
+        started = time.time()
+        child.sendline('secret')
+        waited = time.time() - started
+        self.assertTrue(child.is_reading())
+        self.assertTrue(0.2 < waited < 2, waited)
+        child.expect('got (.*)\r\n')
+        self.assertEqual(child.match.group(1), b'secret')
+        # Not echoed
+        self.assertFalse(b'secret' in child.before)
+
+    def test_send_at_once_once_echo_is_off(self):
+        child = self.spawn(0, echo_sync=True)
+        child.delaybeforesend = 3
+        child.expect('reading')
+        started = time.time()
+        child.sendline('secret')
+        self.assertTrue(time.time() - started < 1)
+        child.expect('got (.*)\r\n')
+        self.assertEqual(child.match.group(1), b'secret')
+
+    def test_send_after_the_delay_if_echo_stays_on(self):
+        child = pexpect.spawn(sys.executable, ['-c', 'import sys; sys.stdin.readline()'],
+                              timeout=5, echo_sync=True)
+        self.addCleanup(child.close)
+        child.delaybeforesend = 0.3
+        started = time.time()
+        child.sendline('line')
+        self.assertTrue(time.time() - started >= 0.3)
+
+    def test_without_echo_sync_the_password_is_flushed(self):
+        child = self.spawn(0.3)
+        child.delaybeforesend = None
+        child.sendline('lost')
+        child.expect('reading')
+        child.sendline('secret')
+        child.expect('got (.*)\r\n')
+        self.assertEqual(child.match.group(1), b'secret')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+'''Tests of the journal of a run and of the units skipped when it is resumed'''
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+import journal
+import remote
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = journal.get_path(os.path.join(self.directory, 'journals'), 'RID_1')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, entries):
+        run_journal = journal.Journal(self.path)
+        for entry in entries:
+            run_journal.record(*entry)
+        run_journal.close()
+
+    def test_path(self):
+        self.assertEqual(journal.get_path('/tmp/j', 'RID_1'), '/tmp/j/RID_1.journal')
+        self.assertEqual(journal.get_path('~/j', 'RID_1'), os.path.expanduser('~/j/RID_1.journal'))
+
+    def test_directory_is_private(self):
+        self.write([])
+        mode = os.stat(os.path.dirname(self.path)).st_mode
+        self.assertEqual(stat.S_IMODE(mode) & 0o077, 0)
+
+    def test_load(self):
+        self.write([
+            ('command', 'step', 'h1', 'ls', 0, True, 0.1),
+            ('unit', 'step', 'h1', None, None, True, 0.2),
+            ('command', 'step', 'h2', 'ls', 2, False, 0.1),
+            ('unit', 'step', 'h2', None, None, True, 0.2),
+            ('command', 'step', 'h3', 'ls', 0, True, 0.1),
+            ('unit', 'local', 'localhost', 'date', 0, True, 0.1),
+        ])
+        self.assertEqual(journal.load(self.path), {
+            ('step', 'h1', None): {'done': True, 'failed': False},
+            ('step', 'h2', None): {'done': True, 'failed': True},
+            # Its commands started, but it did not complete
+            ('step', 'h3', None): {'done': False, 'failed': False},
+            ('local', 'localhost', 'date'): {'done': True, 'failed': False},
+        })
+
+    def test_last_attempt_counts(self):
+        self.write([
+            ('command', 'step', 'h1', 'ls', 2, False, 0.1),
+            ('unit', 'step', 'h1', None, None, False, 0.2),
+            ('command', 'step', 'h1', 'ls', 0, True, 0.1),
+            ('unit', 'step', 'h1', None, None, True, 0.2),
+            ('unit', 'step', 'h2', None, None, True, 0.2),
+            ('command', 'step', 'h2', 'ls', 1, False, 0.1),
+        ])
+        units = journal.load(self.path)
+        self.assertEqual(units[('step', 'h1', None)], {'done': True, 'failed': False})
+        # Rerun and failed again, before it completed
+        self.assertEqual(units[('step', 'h2', None)], {'done': False, 'failed': True})
+
+    def test_appended(self):
+        self.write([('unit', 'step', 'h1', None, None, False, 0.2)])
+        self.write([('unit', 'step', 'h1', None, None, True, 0.2)])
+        self.assertEqual(journal.load(self.path), {('step', 'h1', None): {'done': True, 'failed': False}})
+
+    def test_truncated_last_record(self):
+        self.write([('unit', 'step', 'h1', None, None, True, 0.2),
+                    ('unit', 'step', 'h2', None, None, True, 0.2)])
+        with open(self.path) as journal_file:
+            data = journal_file.read()
+        with open(self.path, 'w') as journal_file:
+            journal_file.write(data[:-20])
+        self.assertEqual(journal.load(self.path), {('step', 'h1', None): {'done': True, 'failed': False}})
+
+    def test_synced_in_batches(self):
+        run_journal = journal.Journal(self.path)
+        try:
+            for index in range(journal.BATCH_SIZE - 1):
+                run_journal.synced = float('inf') # Not synced on time
+                run_journal.record('unit', 'step', 'h{0}'.format(index), None, None, True, 0.1)
+            self.assertEqual(run_journal.pending, journal.BATCH_SIZE - 1)
+            run_journal.record('unit', 'step', 'last', None, None, True, 0.1)
+            self.assertEqual(run_journal.pending, 0)
+            self.assertEqual(len(journal.load(self.path)), journal.BATCH_SIZE)
+        finally:
+            run_journal.close()
+
+    def test_synced_on_time(self):
+        run_journal = journal.Journal(self.path)
+        try:
+            run_journal.synced = float('inf')
+            run_journal.record('unit', 'step', 'h1', None, None, True, 0.1)
+            self.assertEqual(run_journal.pending, 1)
+            run_journal.synced = 0
+            run_journal.record('unit', 'step', 'h2', None, None, True, 0.1)
+            self.assertEqual(run_journal.pending, 0)
+            self.assertEqual(len(journal.load(self.path)), 2)
+        finally:
+            run_journal.close()
+
+
+class ResumeTest(unittest.TestCase):
+
+    units = {
+        ('step', 'done', None): {'done': True, 'failed': False},
+        ('step', 'failed', None): {'done': True, 'failed': True},
+        ('step', 'started', None): {'done': False, 'failed': False},
+        ('local', 'localhost', 'date'): {'done': True, 'failed': False},
+    }
+
+    def setUp(self):
+        self.run_options = dict(remote.run_options)
+        self.live_run = remote.default_live_run
+        remote.journal_units = self.units
+        remote.current_step = 'step'
+        remote.output_buffer.messages = []
+        self.directory = tempfile.mkdtemp()
+        remote.run_options['journal_dir'] = self.directory
+
+    def tearDown(self):
+        remote.run_options.clear()
+        remote.run_options.update(self.run_options)
+        remote.default_live_run = self.live_run
+        remote.journal_units = None
+        remote.current_step = None
+        remote.output_buffer.messages = None
+        if remote.run_journal:
+            remote.run_journal.close()
+            remote.run_journal = None
+        shutil.rmtree(self.directory)
+
+    def skipped(self):
+        hosts = ['done', 'failed', 'started', 'new']
+        return [host for host in hosts if host not in remote.skip_journaled(hosts, lambda host: host)]
+
+    def test_resume(self):
+        # A unit which failed completed too
+        remote.run_options['resume'] = 'RID_1'
+        self.assertEqual(self.skipped(), ['done', 'failed'])
+
+    def test_rerun_failed(self):
+        remote.run_options['rerun_failed'] = 'RID_1'
+        self.assertEqual(self.skipped(), ['done', 'new'])
+
+    def test_local_commands(self):
+        remote.run_options['resume'] = 'RID_1'
+        remote.current_step = 'local'
+        self.assertTrue(remote.is_journaled('localhost', 'date'))
+        self.assertFalse(remote.is_journaled('localhost', 'uptime'))
+
+    def test_not_resumed(self):
+        remote.journal_units = None
+        self.assertEqual(self.skipped(), [])
+
+    def open_journal(self, **options):
+        remote.run_options.update(options)
+        remote.default_live_run = True
+        remote.open_journal('RID_2')
+        return os.path.exists(journal.get_path(self.directory, 'RID_2'))
+
+    def test_journal_is_opt_in(self):
+        self.assertFalse(self.open_journal())
+        self.assertFalse(remote.run_journal)
+        self.assertTrue(self.open_journal(journal=True))
+
+    def test_resumed_run_carries_on_its_journal(self):
+        open(journal.get_path(self.directory, 'RID_2'), 'w').close()
+        self.assertTrue(self.open_journal(resume='RID_2'))
+        self.assertTrue(remote.run_journal)
+
+    def test_no_journal_for_a_resumed_run(self):
+        open(journal.get_path(self.directory, 'RID_2'), 'w').close()
+        self.open_journal(rerun_failed='RID_2', journal=False)
+        self.assertFalse(remote.run_journal)
+        self.assertEqual(remote.journal_units, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
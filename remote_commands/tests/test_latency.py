@@ -0,0 +1,112 @@
+'''Tests of the timeouts learned from the latency history of the hosts, and of the history kept between runs'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import latency
+import remote
+
+
+class LatencyHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'history', 'latency.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_history(self, samples, hostname='h1', phase='auth'):
+        history = latency.LatencyHistory(self.path)
+        for seconds in samples:
+            history.record(hostname, phase, seconds)
+        return history
+
+    def test_no_history(self):
+        history = latency.LatencyHistory(self.path)
+        self.assertEqual(history.get_timeout('h1', 'auth', 3.0, 60), 60)
+
+    def test_too_few_samples(self):
+        history = self.get_history([1.0] * (latency.MIN_SAMPLES - 1))
+        self.assertEqual(history.get_timeout('h1', 'auth', 0.5, 60), 60)
+        history.record('h1', 'auth', 1.0)
+        self.assertEqual(history.get_timeout('h1', 'auth', 0.5, 60), 1.0 * latency.FACTOR + latency.MARGIN_SECS)
+
+    def test_learned_timeout(self):
+        # Upto SAMPLES samples, the 99th percentile is the slowest of them
+        history = self.get_history([2.0, 5.0, 1.0, 3.0, 4.0, 2.5])
+        self.assertEqual(history.get_timeout('h1', 'auth', 3.0, 60), 5.0 * 1.5 + 1.0)
+        self.assertEqual(history.get_timeout('h1', 'first_prompt', 3.0, 60), 60)
+        self.assertEqual(history.get_timeout('h2', 'auth', 3.0, 60), 60)
+
+    def test_floor(self):
+        history = self.get_history([0.1] * 10)
+        self.assertEqual(history.get_timeout('h1', 'auth', 3.0, 60), 3.0)
+
+    def test_cap(self):
+        history = self.get_history([50.0] * 10)
+        self.assertEqual(history.get_timeout('h1', 'auth', 3.0, 60), 60)
+
+    def test_last_samples_kept(self):
+        history = self.get_history([100.0] * latency.SAMPLES + [2.0] * latency.SAMPLES)
+        self.assertEqual(history.history['h1']['auth'], [2.0] * latency.SAMPLES)
+        self.assertEqual(history.get_timeout('h1', 'auth', 3.0, 60), 2.0 * latency.FACTOR + latency.MARGIN_SECS)
+
+    def test_save_and_load(self):
+        history = self.get_history([2.0] * 10)
+        history.save()
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['latency.json'])
+        loaded = latency.LatencyHistory(self.path)
+        self.assertEqual(loaded.history, {'h1' : {'auth' : [2.0] * 10}})
+        self.assertEqual(loaded.get_timeout('h1', 'auth', 3.0, 60), history.get_timeout('h1', 'auth', 3.0, 60))
+
+    def test_save_unchanged(self):
+        latency.LatencyHistory(self.path).save()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_load_cut_short(self):
+        self.get_history([2.0] * 10).save()
+        with open(self.path) as history_file:
+            data = history_file.read()
+        with open(self.path, 'w') as history_file:
+            history_file.write(data[:len(data) // 2])
+        history = latency.LatencyHistory(self.path)
+        self.assertEqual(history.history, {})
+        self.assertEqual(history.get_timeout('h1', 'auth', 3.0, 60), 60)
+
+
+class PhaseTimeoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.latency_history = remote.latency_history
+        self.min_timeout_secs = remote.run_options['min_timeout_secs']
+
+    def tearDown(self):
+        remote.latency_history = self.latency_history
+        remote.run_options['min_timeout_secs'] = self.min_timeout_secs
+        shutil.rmtree(self.directory)
+
+    def test_opt_in(self):
+        self.assertFalse(remote.is_true(remote.run_options['adaptive_timeouts']))
+
+    def test_fixed_timeouts(self):
+        remote.latency_history = None
+        self.assertEqual(remote.get_phase_timeout('h1', 'auth', 60), 60)
+
+    def test_learned_timeouts(self):
+        history = latency.LatencyHistory(os.path.join(self.directory, 'latency.json'))
+        for _ in range(10):
+            history.record('h1', 'auth', 4.0)
+        remote.latency_history = history
+        remote.run_options['min_timeout_secs'] = '3'
+        self.assertEqual(remote.get_phase_timeout('h1', 'auth', 60), 4.0 * latency.FACTOR + latency.MARGIN_SECS)
+        self.assertEqual(remote.get_phase_timeout('h2', 'auth', 60), 60)
+        remote.run_options['min_timeout_secs'] = '10'
+        self.assertEqual(remote.get_phase_timeout('h1', 'auth', 60), 10.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+'''Tests of the plans: the credential references, the cache keys and the
+plan cache'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import plans
+
+
+class InsertValuesTest(unittest.TestCase):
+
+    def test_values(self):
+        step = {'command': 'echo __RC_CREDENTIAL_1__:__RC_CREDENTIAL_2__ __RC_RUN_ID__',
+                'hosts': [{'password': '__RC_CREDENTIAL_2__', 'port': 22}], 'parallel': None}
+        inserted = plans.insert_values(step, {'1': 'one', '2': 'two'}, 'RID_1')
+        self.assertEqual(inserted, {'command': 'echo one:two RID_1',
+                                    'hosts': [{'password': 'two', 'port': 22}], 'parallel': None})
+        # A copy, the plan is not changed
+        self.assertEqual(step['hosts'][0]['password'], '__RC_CREDENTIAL_2__')
+
+    def test_plain_values_are_kept(self):
+        step = {'command': 'echo __RC_other__ {password}', 'count': 3}
+        self.assertEqual(plans.insert_values(step, {}, 'RID_1'), step)
+
+    def test_value_with_a_reference_in_it(self):
+        # A value is inserted as it is, not searched for references again
+        inserted = plans.insert_values('__RC_CREDENTIAL_1__', {'1': '__RC_RUN_ID__\\1'}, 'RID_1')
+        self.assertEqual(inserted, '__RC_RUN_ID__\\1')
+
+    def test_unknown_reference(self):
+        self.assertRaises(KeyError, plans.insert_values, '__RC_CREDENTIAL_3__', {'1': 'one'}, 'RID_1')
+
+    def test_round_trip(self):
+        credentials = plans.Credentials(['secret', 'other'])
+        var = credentials.reference_host({'hostname': 'h1', 'username': 'u', 'password': 'secret'})
+        self.assertEqual(var['password'], '__RC_CREDENTIAL_2__')
+        self.assertEqual(credentials.descriptions['2'], {'name': 'password', 'username': 'u', 'hosts': 1})
+        self.assertEqual(plans.insert_values(var, credentials.get_values(), 'RID_1')['password'], 'secret')
+
+
+class CacheKeyTest(unittest.TestCase):
+
+    config = {'variables': {'password': 'ignored'}, 'main': ['step'],
+              'step': {'action': 'ssh', 'commands': ['echo {hostname}'], 'password': 'secret'}}
+
+    def get_key(self, config=None, variables=None):
+        '''Returns the key of the plan, with the credentials referenced like
+        remote.load_plan_variables() does'''
+        config = config or self.config
+        variables = variables or {'hostname': ['h1', 'h2'], 'username': 'u', 'password': 'secret'}
+        values = [config['step']['password']]
+        for name, value in variables.items():
+            if name.rsplit('.', 1)[-1] == 'password':
+                values.extend(value if isinstance(value, list) else [value])
+        return plans.get_cache_key(config, variables, plans.Credentials(values))
+
+    def test_stable(self):
+        key = self.get_key()
+        self.assertEqual(len(key), 64)
+        self.assertEqual(self.get_key(), key)
+        variables = {}
+        for name in ['password', 'username', 'hostname']:
+            variables[name] = {'hostname': ['h1', 'h2'], 'username': 'u', 'password': 'secret'}[name]
+        self.assertEqual(self.get_key(variables=variables), key)
+
+    def test_password_value_is_not_hashed(self):
+        # The plan has the reference of the password, so it is the same plan
+        config = dict(self.config, step=dict(self.config['step'], password='changed'))
+        self.assertEqual(self.get_key(config, {'hostname': ['h1', 'h2'], 'username': 'u', 'password': 'changed'}),
+                         self.get_key())
+
+    def test_shared_passwords_change_the_key(self):
+        same = self.get_key(variables={'host.hostname': ['h1', 'h2'], 'host.password': ['a', 'a']})
+        different = self.get_key(variables={'host.hostname': ['h1', 'h2'], 'host.password': ['a', 'b']})
+        self.assertNotEqual(same, different)
+
+    def test_changes(self):
+        key = self.get_key()
+        step = dict(self.config['step'], commands=['echo {hostname}', 'pwd'])
+        self.assertNotEqual(self.get_key(dict(self.config, step=step)), key)
+        self.assertNotEqual(self.get_key(dict(self.config, main=['step', 'step'])), key)
+        self.assertNotEqual(self.get_key(variables={'hostname': ['h1'], 'username': 'u', 'password': 'secret'}), key)
+        self.assertNotEqual(self.get_key(variables={'hostname': ['h2', 'h1'], 'username': 'u', 'password': 'secret'}),
+                            key)
+
+    def test_variables_of_the_config_are_not_hashed(self):
+        # They are hashed once resolved, with the defaults and the overrides, as variables
+        config = dict(self.config, variables={'password': 'other'})
+        self.assertEqual(self.get_key(config), self.get_key())
+
+    def test_version(self):
+        key = self.get_key()
+        version = plans.version
+        plans.version = version + 1
+        try:
+            self.assertNotEqual(self.get_key(), key)
+        finally:
+            plans.version = version
+
+
+class PlanCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = plans.PlanCache(self.directory, 0)
+        self.size = None
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def put(self, key, used):
+        '''Caches a plan of one step, last used at the time used'''
+        path = self.cache.put(key, 'RID_1', plans.Credentials(), [{'index': 0, 'name': key}])
+        os.utime(path, (used, used))
+        self.size = os.path.getsize(path)
+        return path
+
+    def keys(self):
+        return sorted(name[:-len('.plan')] for name in os.listdir(self.directory))
+
+    def test_get(self):
+        path = self.put('a', 1000)
+        self.assertEqual(self.cache.get('a'), path)
+        self.assertEqual(self.cache.get('b'), None)
+        header, steps = plans.read_plan(path)
+        self.assertEqual((header['run_id'], list(steps)), ('RID_1', [{'index': 0, 'name': 'a'}]))
+
+    def test_least_recently_used_are_removed(self):
+        self.cache.max_bytes = 10 ** 6
+        for key, used in [('c', 3000), ('a', 1000), ('b', 2000), ('d', 4000)]:
+            self.put(key, used)
+        self.cache.max_bytes = 2 * self.size
+        self.cache.evict()
+        self.assertEqual(self.keys(), ['c', 'd'])
+
+    def test_get_is_a_use(self):
+        self.cache.max_bytes = 10 ** 6
+        self.put('a', 1000)
+        self.put('b', 2000)
+        self.cache.get('a')
+        self.cache.max_bytes = self.size
+        self.cache.evict()
+        self.assertEqual(self.keys(), ['a'])
+
+    def test_put_evicts(self):
+        self.cache.max_bytes = 10 ** 6
+        self.put('a', 1000)
+        self.put('b', 2000)
+        self.cache.max_bytes = 2 * self.size
+        self.put('c', 3000)
+        self.assertEqual(self.keys(), ['b', 'c'])
+
+    def test_put_keeps_the_plan_written(self):
+        # Even once it alone takes more than max_bytes
+        self.put('a', 1000)
+        self.put('b', 2000)
+        self.assertEqual(self.keys(), ['b'])
+
+    def test_other_files_are_left(self):
+        open(os.path.join(self.directory, 'notes.txt'), 'w').close()
+        self.put('a', 1000)
+        self.put('b', 2000)
+        self.assertEqual(sorted(os.listdir(self.directory)), ['b.plan', 'notes.txt'])
+
+    def test_remove(self):
+        self.put('a', 1000)
+        self.cache.remove('a')
+        self.cache.remove('a')
+        self.assertEqual(self.cache.get('a'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
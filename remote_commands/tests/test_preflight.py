@@ -0,0 +1,149 @@
+'''Tests of the preflight: the targets probed for the options of a host, and
+the probe against listening sockets on the loopback'''
+
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+import preflight
+
+
+def listen(backlog=16):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(backlog)
+    return sock
+
+
+def fill_backlog(sock):
+    '''Connects to the listening sock, which never accepts, until its backlog
+    is full and it drops the connections. Returns the clients to close'''
+    clients = []
+    while True:
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.settimeout(0.2)
+        clients.append(client)
+        try:
+            client.connect(sock.getsockname())
+        except socket.timeout:
+            return clients
+
+
+class GetTargetTest(unittest.TestCase):
+
+    def test_port(self):
+        cases = [
+            (None, 22),
+            ('', 22),
+            ('-o CheckHostIP=no', 22),
+            ('-p 2222', 2222),
+            ('-p2222', 2222),
+            ('-o Port=2222', 2222),
+            ('-oPort 2222', 2222),
+            ('-o port=2222 -o CheckHostIP=no', 2222),
+            ('-o ProxyJump=jump -p 2222', 2222),
+        ]
+        for options, port in cases:
+            self.assertEqual(preflight.get_port(options), port, options)
+
+    def test_host(self):
+        self.assertEqual(preflight.get_target('h1', None), ('h1', 22))
+        self.assertEqual(preflight.get_target('h1', '-p 2200 -o CheckHostIP=no'), ('h1', 2200))
+
+    def test_jump_host(self):
+        cases = [
+            ('-J jump', ('jump', 22)),
+            ('-J user@jump:2222', ('jump', 2222)),
+            ('-J jump1,jump2:2222', ('jump1', 22)),
+            ('-o ProxyJump=ssh://user@[::1]:2200', ('::1', 2200)),
+            # The port of the host is not the port of its jump host
+            ('-p 2200 -J jump', ('jump', 22)),
+            ('-o ProxyJump=none -p 2200', ('h1', 2200)),
+            ('-o "ProxyJump=user@jump:2222"', ('jump', 2222)),
+            # Unbalanced quotes are left as they are
+            ('-J jump -o "Port', ('jump', 22)),
+        ]
+        for options, target in cases:
+            self.assertEqual(preflight.get_target('h1', options), target, options)
+
+    def test_proxy_command(self):
+        self.assertEqual(preflight.get_target('h1', '-o ProxyCommand=nc'), None)
+        self.assertEqual(preflight.get_target('h1', '-o "ProxyCommand=ssh -W %h:%p jump"'), None)
+        self.assertEqual(preflight.get_target('h1', "-o 'ProxyCommand=nc %h %p'"), None)
+        self.assertEqual(preflight.get_target('h1', '-o ProxyCommand=none'), ('h1', 22))
+        self.assertEqual(preflight.get_target('h1', '-o "ProxyCommand=none" -o "Port 2200"'), ('h1', 2200))
+        # Before the jump host, like ssh
+        self.assertEqual(preflight.get_target('h1', '-o ProxyCommand=nc -J jump'), None)
+
+    def test_control_path(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'master')
+        options = '-o ControlPath={0} -J jump'.format(path)
+        self.assertEqual(preflight.get_target('h1', options), ('jump', 22))
+        open(path, 'w').close()
+        self.assertEqual(preflight.get_target('h1', options), None)
+
+
+class ProbeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sockets = []
+        self.max_sockets = preflight.MAX_SOCKETS
+
+    def tearDown(self):
+        preflight.MAX_SOCKETS = self.max_sockets
+        for sock in self.sockets:
+            sock.close()
+
+    def target(self, sock):
+        self.sockets.append(sock)
+        return ('127.0.0.1', sock.getsockname()[1])
+
+    def test_accepted(self):
+        target = self.target(listen())
+        self.assertEqual(preflight.probe([target], 1), {target: None})
+
+    def test_refused(self):
+        sock = listen()
+        target = ('127.0.0.1', sock.getsockname()[1])
+        sock.close()
+        results = preflight.probe([target], 1)
+        self.assertTrue(results[target])
+
+    def test_unknown_host(self):
+        target = ('no-such-host.invalid', 22)
+        self.assertTrue(preflight.probe([target], 1)[target])
+
+    def test_dead_host_does_not_hold_up_the_others(self):
+        # More targets than sockets at a time, the dead one in the first
+        preflight.MAX_SOCKETS = 4
+        dead = listen(0)
+        self.sockets.extend(fill_backlog(dead))
+        dead_target = self.target(dead)
+        live_targets = [self.target(listen()) for index in range(15)]
+        started = time.time()
+        results = preflight.probe([dead_target] + live_targets, 0.5)
+        self.assertEqual(results.pop(dead_target), 'No response in time')
+        self.assertEqual(results, dict((target, None) for target in live_targets))
+        self.assertTrue(time.time() - started < 2)
+
+    def test_each_target_has_its_own_timeout(self):
+        preflight.MAX_SOCKETS = 2
+        dead_targets = []
+        for index in range(4):
+            dead = listen(0)
+            self.sockets.extend(fill_backlog(dead))
+            dead_targets.append(self.target(dead))
+        live_target = self.target(listen())
+        results = preflight.probe(dead_targets + [live_target], 0.3)
+        self.assertEqual(results[live_target], None)
+        for target in dead_targets:
+            self.assertEqual(results[target], 'No response in time')
+
+
+if __name__ == '__main__':
+    unittest.main()
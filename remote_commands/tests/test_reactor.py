@@ -0,0 +1,146 @@
+'''Tests of the pexpect Reactor, over pipes read with fdspawn'''
+
+import os
+import time
+import unittest
+
+import pexpect
+from pexpect import fdpexpect
+
+
+class ReactorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reactor = pexpect.Reactor()
+        self.read_fd, self.write_fd = os.pipe()
+        self.spawn = fdpexpect.fdspawn(self.read_fd, maxread=65536)
+
+    def tearDown(self):
+        self.reactor.close()
+        if self.write_fd is not None:
+            os.close(self.write_fd)
+        os.close(self.read_fd)
+
+    def write(self, data, close=False):
+        os.write(self.write_fd, data)
+        if close:
+            os.close(self.write_fd)
+            self.write_fd = None
+
+    def run_reactor(self):
+        while self.reactor:
+            self.reactor.poll(self.reactor.get_wait())
+
+    def test_chained_expects_over_one_read(self):
+        count = 5000
+        searcher = pexpect.searcher_string([b'x'])
+        matches = []
+
+        def on_match(index, error):
+            self.assertEqual(error, None)
+            matches.append(index)
+            if len(matches) < count:
+                self.reactor.expect(self.spawn, searcher, on_match, timeout=5)
+
+        self.write(b'x' * count + b'end')
+        self.reactor.expect(self.spawn, searcher, on_match, timeout=5)
+        self.run_reactor()
+        self.assertEqual(matches, [0] * count)
+        self.assertEqual(self.spawn.buffer, b'end')
+
+    def test_buffered_match_is_called_back_by_poll(self):
+        self.write(b'one two')
+        calls = []
+        self.reactor.expect(self.spawn, pexpect.searcher_string([b'one']),
+                            lambda index, error: calls.append(index), timeout=5)
+        self.run_reactor()
+        self.assertEqual(calls, [0])
+        self.reactor.expect(self.spawn, pexpect.searcher_string([b'two']),
+                            lambda index, error: calls.append(index), timeout=5)
+        self.assertEqual(calls, [0])
+        self.assertEqual(self.reactor.get_wait(), 0)
+        self.reactor.poll(5)
+        self.assertEqual(calls, [0, 0])
+        self.assertFalse(self.reactor)
+
+    def expect(self, patterns, timeout=5):
+        '''Runs one expect of searcher_string(patterns) and returns its
+        (index, class of the exception raised)'''
+        results = []
+        self.reactor.expect(
+            self.spawn, pexpect.searcher_string(patterns),
+            lambda index, error: results.append(
+                (index, error[0] if error else None)),
+            timeout=timeout)
+        self.run_reactor()
+        self.assertEqual(len(results), 1)
+        return results[0]
+
+    def test_timeout(self):
+        self.write(b'partial')
+        started = time.time()
+        self.assertEqual(self.expect([b'done'], timeout=0.2),
+                         (None, pexpect.TIMEOUT))
+        self.assertTrue(0.2 <= time.time() - started < 2)
+        self.assertEqual(self.spawn.before, b'partial')
+        # The data read is kept for the next expect
+        self.write(b' done')
+        self.assertEqual(self.expect([b'done']), (0, None))
+        self.assertEqual(self.spawn.before, b'partial ')
+
+    def test_timeout_in_patterns(self):
+        self.assertEqual(self.expect([b'done', pexpect.TIMEOUT], timeout=0.1),
+                         (1, None))
+        self.assertEqual(self.spawn.after, pexpect.TIMEOUT)
+
+    def test_eof(self):
+        self.write(b'last words', close=True)
+        self.assertEqual(self.expect([b'done']), (None, pexpect.EOF))
+        self.assertEqual(self.spawn.before, b'last words')
+
+    def test_eof_in_patterns(self):
+        self.write(b'last words', close=True)
+        self.assertEqual(self.expect([pexpect.EOF, b'done']), (0, None))
+        self.assertEqual(self.spawn.before, b'last words')
+        self.assertEqual(self.spawn.after, pexpect.EOF)
+
+    def test_get_wait(self):
+        self.assertEqual(self.reactor.get_wait(), None)
+        self.reactor.expect(self.spawn, pexpect.searcher_string([b'x']),
+                            lambda index, error: None, timeout=10)
+        self.assertTrue(9 < self.reactor.get_wait() <= 10)
+        self.reactor.unwatch(self.read_fd)
+        self.assertFalse(self.reactor)
+
+    def test_watch(self):
+        calls = []
+
+        def on_ready(fd):
+            calls.append(os.read(fd, 100))
+            self.reactor.unwatch(fd)
+
+        self.reactor.watch(self.read_fd, on_ready)
+        self.assertEqual(self.reactor.poll(0), 0)
+        self.write(b'ready')
+        self.run_reactor()
+        self.assertEqual(calls, [b'ready'])
+
+    def test_spawns(self):
+        # Children on a pty, read until they exit
+        children = [pexpect.spawn('echo', ['child %d' % n], timeout=5)
+                    for n in range(3)]
+        results = []
+        for n, child in enumerate(children):
+            self.reactor.expect(
+                child, pexpect.searcher_string([pexpect.EOF]),
+                lambda index, error, n=n: results.append((n, index)))
+        self.run_reactor()
+        self.assertEqual(sorted(results), [(0, 0), (1, 0), (2, 0)])
+        for n, child in enumerate(children):
+            self.assertEqual(child.before.strip(),
+                             ('child %d' % n).encode('ascii'))
+            child.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
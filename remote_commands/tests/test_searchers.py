@@ -0,0 +1,264 @@
+'''Tests of the searchers of pexpect, fed the data of an expect read by read'''
+
+import random
+import re
+import unittest
+
+from pexpect import EOF, TIMEOUT
+from pexpect.expect import (Expecter, searcher_string, searcher_ac,
+                            searcher_exact, searcher_re, searcher_combined,
+                            AC_MIN_STRINGS, sre_parse)
+from pexpect.spawnbase import SpawnBase
+
+
+def expect_reads(searcher, reads, searchwindowsize=None, end=None,
+                 chunked=True):
+    '''Feeds the reads to an Expecter of 'searcher' like spawn.expect() does,
+    and returns (index, before, after, buffer left) once one matches. If none
+    does, the expect ends with 'end': 'eof' or 'timeout' give the same, with
+    the class of the exception as index if it is raised, and None gives
+    (None, buffer). Without 'chunked', the Expecter searches all the buffer
+    on each read, as it does for a searcher without a lookback.'''
+    spawn = SpawnBase(searchwindowsize=searchwindowsize)
+    expecter = Expecter(spawn, searcher)
+    if not chunked:
+        expecter.lookback = None
+    spawn._buffer = spawn.buffer_type()
+    spawn._before = spawn.buffer_type()
+    for data in reads:
+        index = expecter.new_data(data)
+        if index is not None:
+            return index, spawn.before, spawn.after, spawn.buffer
+    if end is None:
+        expecter.errored()
+        return None, spawn.buffer
+    try:
+        index = getattr(expecter, end)()
+    except (EOF, TIMEOUT) as e:
+        index = type(e)
+    return index, spawn.before, spawn.after, spawn.buffer
+
+
+def split(data, rnd, reads):
+    '''Cuts 'data' into upto 'reads' reads at random, some of them empty'''
+    cuts = sorted(rnd.randint(0, len(data)) for n in range(reads - 1))
+    return [data[start:stop]
+            for start, stop in zip([0] + cuts, cuts + [len(data)])]
+
+
+def random_bytes(rnd, alphabet, size):
+    return b''.join(rnd.choice(alphabet) for n in range(size))
+
+
+class ExpecterChunksTest(unittest.TestCase):
+    '''The Expecter keeps the reads of a searcher with a lookback as chunks,
+    and has to give the same before, after and buffer as searching all the
+    buffer on every read'''
+
+    alphabet = [b'a', b'b', b'c', b'\n']
+
+    def assertSameAsBuffer(self, searcher, reads, **kw):
+        self.assertEqual(expect_reads(searcher, reads, **kw),
+                         expect_reads(searcher, reads, chunked=False, **kw))
+
+    def test_match_split_over_reads(self):
+        searcher = searcher_string([b'password:', b'$ '])
+        reads = [b'Last login\npass', b'wor', b'd:', b' left']
+        self.assertEqual(expect_reads(searcher, reads),
+                         (0, b'Last login\n', b'password:', b''))
+        self.assertSameAsBuffer(searcher, reads)
+
+    def test_buffer_left_after_the_match(self):
+        searcher = searcher_string([b'$ '])
+        reads = [b'one\n$ ', b'two\n$ three']
+        self.assertEqual(expect_reads(searcher, reads),
+                         (0, b'one\n', b'$ ', b''))
+        self.assertEqual(expect_reads(searcher, [b'one\n$ two\n$ three']),
+                         (0, b'one\n', b'$ ', b'two\n$ three'))
+
+    def test_eof_and_timeout_in_patterns(self):
+        # The data read is kept for the next expect after a TIMEOUT
+        for end, exception, left in (('eof', EOF, b''),
+                                     ('timeout', TIMEOUT, b'don')):
+            searcher = searcher_string([b'done', exception])
+            self.assertEqual(expect_reads(searcher, [b'do', b'ne'], end=end),
+                             (0, b'', b'done', b''))
+            self.assertEqual(expect_reads(searcher, [b'do', b'n'], end=end),
+                             (1, b'don', exception, left))
+            searcher = searcher_string([b'done'])
+            self.assertEqual(expect_reads(searcher, [b'do', b'n'], end=end),
+                             (exception, b'don', exception, left))
+
+    def test_same_as_searching_the_buffer(self):
+        rnd = random.Random(21)
+        for n in range(3000):
+            strings = [random_bytes(rnd, self.alphabet, rnd.randint(1, 4))
+                       for m in range(rnd.randint(1, 4))]
+            if rnd.random() < 0.3:
+                strings.insert(rnd.randint(0, len(strings)), EOF)
+            if rnd.random() < 0.3:
+                strings.insert(rnd.randint(0, len(strings)), TIMEOUT)
+            data = random_bytes(rnd, self.alphabet, rnd.randint(0, 40))
+            reads = split(data, rnd, rnd.randint(1, 8))
+            end = rnd.choice([None, 'eof', 'timeout'])
+            self.assertSameAsBuffer(searcher_string(strings), reads, end=end)
+            # A searchwindowsize searches the window of each read instead
+            window = rnd.randint(1, 8)
+            self.assertEqual(
+                expect_reads(searcher_string(strings), reads,
+                             searchwindowsize=window, end=end),
+                expect_reads(searcher_string(strings), reads,
+                             searchwindowsize=window, end=end, chunked=False))
+
+
+class SearcherAcTest(unittest.TestCase):
+    '''searcher_ac has to find the same match as searcher_string'''
+
+    alphabet = [b'a', b'b', b'c']
+
+    def random_strings(self, rnd, count):
+        # Strings which share their prefixes and suffixes, and some twice
+        strings = [random_bytes(rnd, self.alphabet, rnd.randint(1, 5))
+                   for n in range(count)]
+        if rnd.random() < 0.3:
+            strings.append(rnd.choice(strings))
+        if rnd.random() < 0.3:
+            strings.insert(rnd.randint(0, len(strings)), EOF)
+        if rnd.random() < 0.3:
+            strings.insert(rnd.randint(0, len(strings)), TIMEOUT)
+        return strings
+
+    def test_overlapping_strings(self):
+        strings = [b'abcd', b'bc', b'abc', b'cd']
+        self.assertEqual(expect_reads(searcher_ac(strings), [b'xab', b'cd']),
+                         (0, b'x', b'abcd', b''))
+        strings = [b'bcd', b'ab']
+        self.assertEqual(expect_reads(searcher_ac(strings), [b'abcd']),
+                         (1, b'', b'ab', b'cd'))
+
+    def test_state_kept_between_reads(self):
+        searcher = searcher_ac([b'password:'])
+        reads = [b'pa', b'ss', b'wo', b'rd', b':']
+        self.assertEqual(expect_reads(searcher, reads),
+                         (0, b'', b'password:', b''))
+        # The next expect starts over, without the state of the last one
+        self.assertEqual(expect_reads(searcher, [b'word:']), (None, b'word:'))
+
+    def test_same_as_searcher_string(self):
+        rnd = random.Random(22)
+        for n in range(2000):
+            strings = self.random_strings(rnd, rnd.randint(1, 12))
+            data = random_bytes(rnd, self.alphabet, rnd.randint(0, 40))
+            reads = split(data, rnd, rnd.randint(1, 8))
+            end = rnd.choice([None, 'eof', 'timeout'])
+            window = rnd.choice([None, rnd.randint(1, 8)])
+            self.assertEqual(
+                expect_reads(searcher_ac(strings), reads,
+                             searchwindowsize=window, end=end),
+                expect_reads(searcher_string(strings), reads,
+                             searchwindowsize=window, end=end))
+
+    def test_searcher_exact(self):
+        strings = [str(n).encode('ascii') for n in range(AC_MIN_STRINGS)]
+        self.assertTrue(isinstance(searcher_exact(strings), searcher_ac))
+        self.assertTrue(isinstance(searcher_exact(strings[1:] + [EOF]),
+                                   searcher_string))
+        self.assertTrue(isinstance(searcher_exact(strings + [b'']),
+                                   searcher_string))
+        rnd = random.Random(48)
+        strings = self.random_strings(rnd, AC_MIN_STRINGS)
+        data = random_bytes(rnd, self.alphabet, 400)
+        reads = split(data, rnd, 20)
+        self.assertEqual(expect_reads(searcher_exact(strings), reads),
+                         expect_reads(searcher_string(strings), reads))
+
+
+class SearcherCombinedTest(unittest.TestCase):
+    '''searcher_combined has to find the same match as searcher_re, while it
+    searches one alternation, and only a window of the buffer'''
+
+    # Pieces of the random patterns: of known and unknown length, anchors,
+    # lookaheads and lookbehinds, and a backreference
+    atoms = [b'a', b'b', b'c', b'[ab]', b'a?', b'b+', b'c*', b'.', b'\\n',
+             b'(?:ab|c)', b'[^a]{1,3}', b'$', b'\\Z', b'^', b'\\b',
+             b'(?=b)', b'(?!a)', b'(?=bc)', b'(?!$)', b'(?<=a)', b'(a)\\1']
+    alphabet = [b'a', b'b', b'c', b'\n', b'$', b' ']
+
+    def random_patterns(self, rnd):
+        patterns = []
+        flags = rnd.choice([0, re.MULTILINE, re.IGNORECASE])
+        while len(patterns) < rnd.randint(1, 4):
+            source = b''.join(rnd.choice(self.atoms)
+                              for n in range(rnd.randint(1, 4)))
+            if rnd.random() < 0.3:
+                source += rnd.choice([b'\\$ $', b'[$#] $', b'.*[$#] $'])
+            # An empty match at the end of the buffer gets the before of
+            # searcher_re wrong, in the Expecter which searches all of it
+            if sre_parse.parse(source.decode('ascii')).getwidth()[0] == 0:
+                continue
+            patterns.append(re.compile(source,
+                                       flags if rnd.random() < 0.8 else 0))
+        if rnd.random() < 0.3:
+            patterns.insert(rnd.randint(0, len(patterns)), EOF)
+        if rnd.random() < 0.3:
+            patterns.insert(rnd.randint(0, len(patterns)), TIMEOUT)
+        return patterns
+
+    def test_same_as_searcher_re(self):
+        rnd = random.Random(23)
+        for n in range(3000):
+            patterns = self.random_patterns(rnd)
+            data = random_bytes(rnd, self.alphabet, rnd.randint(0, 40))
+            reads = split(data, rnd, rnd.randint(1, 8))
+            end = rnd.choice([None, 'eof', 'timeout'])
+            window = rnd.choice([None, None, rnd.randint(1, 12)])
+            # A tail as long as the data cuts no match short
+            tail = rnd.choice([None, 64])
+            self.assertEqual(
+                expect_reads(searcher_combined(patterns, tail), reads,
+                             searchwindowsize=window, end=end),
+                expect_reads(searcher_re(patterns), reads,
+                             searchwindowsize=window, end=end),
+                [p if p in (EOF, TIMEOUT) else p.pattern for p in patterns])
+
+    def test_prompt_searched_at_the_end_only(self):
+        prompt = re.compile(b'[$#] $')
+        searcher = searcher_combined([prompt, EOF])
+        self.assertEqual(searcher.lookback, 2)
+        # A prompt which is not at the end of the output is not one
+        reads = [b'x' * 5000, b'$ y', b'y' * 5000, b'\n$ ']
+        self.assertEqual(expect_reads(searcher, reads),
+                         (0, b'x' * 5000 + b'$ y' + b'y' * 5000 + b'\n',
+                          b'$ ', b''))
+        self.assertEqual(expect_reads(searcher, reads[:3], end='eof'),
+                         (1, b'x' * 5000 + b'$ y' + b'y' * 5000, EOF, b''))
+        # $ also matches before a newline at the end
+        self.assertSameAsRe([b'[$#] $'], [b'x' * 100, b'$ \n'],
+                            (0, b'x' * 100, b'$ ', b'\n'))
+        searcher = searcher_combined([re.compile(b'.*[$#] $')], tail=4)
+        self.assertEqual(expect_reads(searcher, [b'line\nhost $ ']),
+                         (0, b'line\nho', b'st $ ', b''))
+
+    def assertSameAsRe(self, patterns, reads, expected):
+        compiled = [re.compile(pattern) for pattern in patterns]
+        self.assertEqual(expect_reads(searcher_re(compiled), reads), expected)
+        self.assertEqual(expect_reads(searcher_combined(compiled), reads), expected)
+
+    def test_lookahead_split_over_reads(self):
+        self.assertSameAsRe([b'a(?=b)'], [b'xxa', b'b'], (0, b'xx', b'a', b'b'))
+        self.assertSameAsRe([b'a(?=bc)'], [b'xxa', b'b', b'c'], (0, b'xx', b'a', b'bc'))
+        self.assertSameAsRe([b'zz', b'a(?=b)b'], [b'xa', b'b'], (1, b'x', b'ab', b''))
+
+    def test_negative_lookahead_split_over_reads(self):
+        self.assertSameAsRe([b'a(?!$)'], [b'xa', b'c'], (0, b'x', b'a', b'c'))
+        self.assertSameAsRe([b'a(?!b)c'], [b'xa', b'c'], (0, b'x', b'ac', b''))
+        self.assertSameAsRe([b'a(?!$)'], [b'a\n', b'\n'], (0, b'', b'a', b'\n\n'))
+
+    def test_lookahead_lookback(self):
+        self.assertEqual(searcher_combined([re.compile(b'a')]).lookback, 0)
+        self.assertEqual(searcher_combined([re.compile(b'a(?=bc)')]).lookback, 4)
+        self.assertEqual(searcher_combined([re.compile(b'a(?=b*)')]).lookback, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+'''Tests of the compiled templates, against str.format()'''
+
+import unittest
+
+import templates
+
+
+class RenderTest(unittest.TestCase):
+
+    variables = {'name': 'host1', 'port': 22, 'ratio': 0.5, 'items': ['a', 'b'],
+                 'text': u'caf\xe9'}
+
+    def assertRenders(self, text):
+        self.assertEqual(templates.render(text, self.variables),
+                         text.format(**self.variables))
+
+    def test_simple(self):
+        self.assertRenders('ssh {name} -p {port}')
+        self.assertRenders('{name}{name}')
+        self.assertRenders('{ratio}')
+        self.assertRenders('')
+        self.assertRenders('no fields')
+
+    def test_simple_is_joined(self):
+        self.assertTrue(templates.compile_template('ssh {name} -p {port}').simple)
+
+    def test_escaped_braces(self):
+        self.assertRenders('{{name}} is {name}')
+        self.assertEqual(templates.render('{{name}}', {}), '{name}')
+
+    def test_other_fields_use_format(self):
+        for text in ('{name!r}', '{port:>5}', '{items[1]}', '{ratio.real}', '{name:{port}}'):
+            self.assertFalse(templates.compile_template(text).simple, text)
+            self.assertRenders(text)
+
+    def test_missing_variable(self):
+        self.assertRaises(KeyError, templates.render, '{name} {missing}', self.variables)
+        self.assertRaises(KeyError, templates.render, '{missing!r}', self.variables)
+
+    def test_unicode(self):
+        rendered = templates.render(u'{name}', self.variables)
+        self.assertEqual(type(rendered), type(u''))
+        self.assertEqual(type(templates.render('{name}', self.variables)), type(''))
+        self.assertEqual(templates.render(u'{text}!', self.variables), u'caf\xe9!')
+
+
+class FieldsTest(unittest.TestCase):
+
+    def test_fields(self):
+        self.assertEqual(templates.get_fields('{a} {b.c} {d[0]} {a} {e!r} {f:>2}'),
+                         ['a', 'b', 'd', 'e', 'f'])
+
+    def test_no_fields(self):
+        self.assertEqual(templates.get_fields('plain'), [])
+        self.assertEqual(templates.get_fields('{{a}}'), [])
+
+    def test_fields_of_the_format_spec(self):
+        self.assertEqual(templates.get_fields('{a:{b}}'), ['a', 'b'])
+        self.assertEqual(templates.get_fields('{a:>{b}.{c}}'), ['a', 'b', 'c'])
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_size = templates.CACHE_SIZE
+        templates.cache.clear()
+        templates.stats.update(hits=0, misses=0)
+
+    def tearDown(self):
+        templates.CACHE_SIZE = self.cache_size
+        templates.cache.clear()
+
+    def test_hit(self):
+        first = templates.compile_template('{a}')
+        self.assertTrue(templates.compile_template('{a}') is first)
+        self.assertEqual(templates.get_stats(), {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_changed_template_misses(self):
+        self.assertEqual(templates.render('{a}', {'a': 1}), '1')
+        self.assertEqual(templates.render('{a}!', {'a': 1}), '1!')
+        self.assertEqual(templates.get_stats(), {'hits': 0, 'misses': 2, 'size': 2})
+        self.assertEqual(templates.get_fields('{a}!'), ['a'])
+        self.assertEqual(templates.get_stats()['hits'], 1)
+
+    def test_str_and_unicode_are_kept_apart(self):
+        templates.compile_template('{a}')
+        self.assertEqual(type(templates.render(u'{a}', {'a': 'x'})), type(u''))
+        self.assertEqual(templates.get_stats(), {'hits': 0, 'misses': 2, 'size': 2})
+
+    def test_full_cache_is_emptied(self):
+        templates.CACHE_SIZE = 2
+        templates.compile_template('{a}')
+        templates.compile_template('{b}')
+        templates.compile_template('{c}')
+        self.assertEqual(templates.get_stats()['size'], 1)
+        templates.compile_template('{a}')
+        self.assertEqual(templates.get_stats()['misses'], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
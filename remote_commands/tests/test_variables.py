@@ -0,0 +1,103 @@
+'''Tests of the resolution of the variables of a config: their dependencies
+and the lazy expansion of the combinations of their values'''
+
+import itertools
+import unittest
+
+import remote
+
+
+def index(variables):
+    '''Returns (dict_variables, dependencies) of the variables of a config'''
+    variable_names, dict_variables, dependencies = remote.index_variables(dict(variables))
+    return dict_variables, dependencies
+
+
+class DependenciesTest(unittest.TestCase):
+
+    def setUp(self):
+        remote.output_buffer.messages = []
+
+    def tearDown(self):
+        remote.output_buffer.messages = None
+
+    def assertExits(self, variables, *messages):
+        with self.assertRaises(SystemExit) as context:
+            index(variables)
+        self.assertEqual(context.exception.code, 1)
+        output = ''.join(remote.output_buffer.messages)
+        for message in messages:
+            self.assertTrue(message in output, output)
+
+    def test_order(self):
+        variables, dependencies = index({'c': '{b}/x', 'b': '{a}-y', 'a': 'root',
+                                         'd': 'plain', 'e': '{c} {a}'})
+        order = list(dependencies)
+        self.assertEqual(sorted(order), ['a', 'b', 'c', 'd', 'e'])
+        for key, references in dependencies.items():
+            for reference in references:
+                self.assertTrue(order.index(reference) < order.index(key), (reference, key))
+        self.assertEqual(dependencies['e'], ['c', 'a'])
+        self.assertEqual(dependencies['a'], [])
+
+    def test_group_variables(self):
+        variables, dependencies = index({'host.name': ['h1', 'h2'], 'host.ip': ['{name}.ip', 'b'],
+                                         'cmd': 'ping {ip}'})
+        self.assertEqual(dependencies['ip'], ['name'])
+        self.assertEqual(dependencies['cmd'], ['ip'])
+        self.assertFalse('host' in dependencies)
+
+    def test_cycle(self):
+        self.assertExits({'a': '{b}', 'b': '{c}', 'c': 'x{a}'}, 'a -> b -> c -> a', 'Cyclic dependency')
+
+    def test_self_reference(self):
+        self.assertExits({'a': 'x', 'b': '{b}!'}, 'b -> b', 'Cyclic dependency')
+
+    def test_cycle_among_others(self):
+        self.assertExits({'a': '{c}', 'c': '{d}', 'd': '{c}', 'e': 'x'}, 'c -> d -> c')
+
+    def test_undefined(self):
+        self.assertExits({'a': 'echo {nope}'}, 'Undefined variable: ', '{nope}', 'echo {nope}')
+
+
+class ExpandTest(unittest.TestCase):
+
+    def expand(self, params, variables):
+        variables, dependencies = index(variables)
+        return remote.expand_variables(params, variables, dependencies)
+
+    def test_resolved_in_one_pass(self):
+        items = list(self.expand(['c'], {'c': '{b}/x', 'b': '{a}-y', 'a': 'root'}))
+        self.assertEqual(items, [{'a': 'root', 'b': 'root-y', 'c': 'root-y/x'}])
+
+    def test_combinations(self):
+        items = list(self.expand(['cmd'], {'cmd': '{a}{b}', 'a': ['1', '2'], 'b': ['x', 'y']}))
+        self.assertEqual(sorted(item['cmd'] for item in items), ['1x', '1y', '2x', '2y'])
+
+    def test_group_values_stay_together(self):
+        items = list(self.expand(['cmd'], {'host.name': ['h1', 'h2'], 'host.ip': ['1', '2'],
+                                           'cmd': 'ping {ip} {name}'}))
+        self.assertEqual([item['cmd'] for item in items], ['ping 1 h1', 'ping 2 h2'])
+
+    def test_unreferenced_variables_are_not_expanded(self):
+        items = list(self.expand(['cmd'], {'cmd': 'echo {a}', 'a': ['1', '2'],
+                                           'unused': ['x', 'y', 'z'], 'other': '{unused}!'}))
+        self.assertEqual([item['cmd'] for item in items], ['echo 1', 'echo 2'])
+        self.assertEqual(sorted(items[0]), ['a', 'cmd'])
+
+    def test_unreferenced_template_is_not_rendered(self):
+        # Rendering bad would raise, as 'x' is not a number
+        items = list(self.expand(['cmd'], {'cmd': 'echo', 'x': 'x', 'bad': '{x:d}'}))
+        self.assertEqual(items, [{'cmd': 'echo'}])
+
+    def test_lazy(self):
+        values = [str(value) for value in range(10000)]
+        items = self.expand(['cmd'], {'cmd': '{a}{b}', 'a': values, 'b': values})
+        self.assertEqual([item['cmd'] for item in itertools.islice(items, 3)], ['00', '01', '02'])
+
+    def test_params_without_variables(self):
+        self.assertEqual(list(self.expand(['nothing'], {'a': ['1', '2']})), [{}])
+
+
+if __name__ == '__main__':
+    unittest.main()
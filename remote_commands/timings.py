@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+########################################################################################
+# For any questions or suggestions please contact : Ajmal Yusuf <ayusuf@hortonworks.com>
+########################################################################################
+
+import os
+import time
+import math
+import ctypes
+import threading
+
+# Phases timed by remote.py, in the order they are reported
+phases = ['spawn', 'first_prompt', 'auth', 'master', 'command', 'scp', 'local']
+percentiles = [50, 95, 99]
+
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+def get_monotonic():
+    '''Returns a clock which never goes backwards. Python 2 has no time.monotonic(), so clock_gettime() is
+    called through ctypes, falling back to time.time() where it is not available'''
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    try:
+        librt = ctypes.CDLL('librt.so.1', use_errno=True)
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        CLOCK_MONOTONIC = 1
+        def monotonic():
+            t = timespec()
+            if clock_gettime(CLOCK_MONOTONIC, ctypes.pointer(t)) != 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+            return t.tv_sec + t.tv_nsec * 1e-9
+        monotonic()
+        return monotonic
+    except Exception:
+        return time.time
+
+monotonic = get_monotonic()
+
+def percentile(sorted_values, percent):
+    '''Nearest rank percentile of an already sorted list'''
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+def get_stats(values):
+    values = sorted(values)
+    stats = { 'count' : len(values), 'total' : sum(values), 'max' : values[-1] }
+    for percent in percentiles:
+        stats['p{0}'.format(percent)] = percentile(values, percent)
+    return stats
+
+def phase_order(phase):
+    return (phases.index(phase), phase) if phase in phases else (len(phases), phase)
+
+class Timings(object):
+    '''Durations of the phases of a run, recorded per host from any thread'''
+    def __init__(self):
+        self.durations = {} # (hostname, phase) -> list of seconds
+        self.lock = threading.Lock()
+
+    def record(self, hostname, phase, seconds):
+        with self.lock:
+            self.durations.setdefault((hostname, phase), []).append(seconds)
+
+    def summary(self):
+        '''Returns the stats (count, total, p50, p95, p99 and max, in seconds) of every phase, over all the
+        hosts and for each host:
+        { "phases" : { phase : stats }, "hosts" : { hostname : { phase : stats } } }'''
+        with self.lock:
+            durations = dict((key, list(values)) for key, values in self.durations.items())
+        by_phase = {}
+        by_host = {}
+        for (hostname, phase), values in durations.items():
+            by_phase.setdefault(phase, []).extend(values)
+            by_host.setdefault(hostname, {})[phase] = get_stats(values)
+        return { 'phases' : dict((phase, get_stats(values)) for phase, values in by_phase.items()),
+                 'hosts' : by_host }